@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import hmac
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Mapping, Optional, Tuple
+
+from metrics import ADMISSION_QUEUE, ADMISSION_REJECTIONS, ADMISSION_WAIT
+from rate_limit import TokenBucket
+
+# Admission control for the bridge's /call_tool.
+#
+# Every tool has its own pool of concurrency slots. Requests that find the pool
+# full wait in a bounded queue, interactive requests ahead of bulk ones. A
+# request is turned away immediately, instead of timing out in the queue, when:
+#   - its client has used up its token bucket            -> 429 + Retry-After
+#   - the queue is full, or the expected wait is longer
+#     than the client would wait anyway                   -> 503 + Retry-After
+# so under overload latency for admitted requests stays close to normal.
+#
+# Callers are rate limited by their network address. Services holding a token
+# from ADMISSION_TRUSTED_CLIENTS ("whatsapp=<token>,nextjs=<token>", sent as
+# X-Client-Token) are trusted to name their end user with X-Client-Id (the
+# WhatsApp sender's number), so each end user gets a bucket of their own, and
+# to ask for a lane with X-Priority. A requested lane can only lower a tool's
+# priority, never move a bulk tool into the interactive lane.
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = {INTERACTIVE: 0, BULK: 1}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted. Maps to an HTTP status with Retry-After"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "tool=2,other_tool=1" into a dict"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        limits[name.strip()] = int(value)
+    return limits
+
+
+def _parse_tokens(spec: str) -> Dict[str, str]:
+    """Parse "whatsapp=<token>,nextjs=<token>" into a dict"""
+    tokens = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, token = item.partition("=")
+        if token.strip():
+            tokens[name.strip()] = token.strip()
+    return tokens
+
+
+class PrioritySlots:
+    """
+    A semaphore whose waiters are served by lane (interactive before bulk),
+    first come first served within a lane. Must be used from one event loop.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = {lane: 0 for lane in LANES}
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, lane: str, timeout: float) -> bool:
+        """Take a slot, waiting at most `timeout` seconds. Returns False on timeout"""
+        if self.active < self.limit and not any(self.waiting.values()):
+            self.active += 1
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (LANES[lane], next(self._order), future))
+        self.waiting[lane] += 1
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            # The slot may have been handed over just as the caller went away
+            if future.done() and not future.cancelled():
+                self.release()
+            future.cancel()
+            raise
+        finally:
+            self.waiting[lane] -= 1
+        if future.done():
+            return True
+        future.cancel()
+        return False
+
+    def release(self):
+        # Hand the slot straight to the next live waiter, so it cannot be taken in between
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """Per-tool concurrency slots and wait queues plus per-client rate limits"""
+
+    def __init__(self, default_concurrency: int = 4, tool_concurrency: Optional[Dict[str, int]] = None,
+                 max_queue: int = 32, queue_timeout: float = 20.0,
+                 client_rate: float = 5.0, client_burst: float = 20.0, max_clients: int = 10000,
+                 bulk_tools=(), trusted_clients: Optional[Dict[str, str]] = None):
+        self.default_concurrency = default_concurrency
+        self.tool_concurrency = tool_concurrency or {}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.bulk_tools = set(bulk_tools)
+        # Trusted service name -> its token
+        self.trusted_clients = trusted_clients or {}
+        self._slots: Dict[str, PrioritySlots] = {}
+        self._clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Smoothed service time per tool, used to estimate queue waits
+        self._service_time: Dict[str, float] = {}
+        self.stats = {"admitted": 0, "rejected_rate_limited": 0, "rejected_queue_full": 0,
+                      "rejected_overloaded": 0, "rejected_timeout": 0, "queued": 0}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            default_concurrency=int(os.getenv("ADMISSION_CONCURRENCY", 4)),
+            tool_concurrency=_parse_limits(os.getenv("ADMISSION_TOOL_CONCURRENCY", "generate_monthly_report=2")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 32)),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 20)),
+            client_rate=float(os.getenv("ADMISSION_CLIENT_RATE", 5)),
+            client_burst=float(os.getenv("ADMISSION_CLIENT_BURST", 20)),
+            bulk_tools=[t.strip() for t in os.getenv("ADMISSION_BULK_TOOLS",
+                                                     "generate_monthly_report,get_mall_summary").split(",") if t.strip()],
+            trusted_clients=_parse_tokens(os.getenv("ADMISSION_TRUSTED_CLIENTS", "")),
+        )
+
+    def identify(self, headers: Mapping[str, str], peer: str) -> Tuple[str, bool]:
+        """
+        The rate-limit client of a request and whether it comes from a trusted service:
+        "<service>:<X-Client-Id>" for a service with a valid X-Client-Token, else the peer address
+        """
+        token = headers.get("X-Client-Token") or ""
+        service = next((name for name, expected in self.trusted_clients.items()
+                        if token and hmac.compare_digest(token, expected)), None)
+        if service is None:
+            return peer, False
+        user = headers.get("X-Client-Id")
+        return (f"{service}:{user}" if user else service), True
+
+    def lane_for(self, tool: str, requested: Optional[str] = None, trusted: bool = False) -> str:
+        """
+        Bulk for report-style tools, interactive otherwise. A trusted caller may ask for
+        a lane, but no higher priority than the tool's own
+        """
+        default = BULK if tool in self.bulk_tools else INTERACTIVE
+        requested = (requested or "").lower()
+        if trusted and requested in LANES and LANES[requested] >= LANES[default]:
+            return requested
+        return default
+
+    def _slots_for(self, tool: str) -> PrioritySlots:
+        if tool not in self._slots:
+            self._slots[tool] = PrioritySlots(self.tool_concurrency.get(tool, self.default_concurrency))
+        return self._slots[tool]
+
+    def _check_rate(self, client: str, tool: str):
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._clients[client] = bucket
+            # Forget the least recently seen clients so memory stays bounded
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        wait = bucket.try_acquire()
+        if wait > 0:
+            self._reject("rate_limited", tool)
+            raise AdmissionRejected(429, f"Rate limit exceeded for client {client}", wait)
+
+    def expected_wait(self, tool: str, lane: str) -> float:
+        """Rough wait for a new request: queued work ahead of it divided by the slots"""
+        slots = self._slots_for(tool)
+        ahead = slots.waiting[INTERACTIVE] + (slots.waiting[BULK] if lane == BULK else 0)
+        if slots.active < slots.limit and ahead == 0:
+            return 0.0
+        service_time = self._service_time.get(tool, 1.0)
+        return (ahead + 1) * service_time / slots.limit
+
+    def queue_depth(self, tool: str) -> int:
+        return sum(self._slots_for(tool).waiting.values())
+
+    def _reject(self, reason: str, tool: str):
+        self.stats[f"rejected_{reason}"] += 1
+        ADMISSION_REJECTIONS.labels(tool, reason).inc()
+
+    @asynccontextmanager
+    async def slot(self, tool: str, client: str, lane: str):
+        """Hold a concurrency slot for `tool` while the block runs, or raise AdmissionRejected"""
+        self._check_rate(client, tool)
+        slots = self._slots_for(tool)
+
+        if slots.active >= slots.limit or any(slots.waiting.values()):
+            # Bulk work may only fill half the queue, so interactive requests always find room
+            limit = self.max_queue if lane == INTERACTIVE else max(1, self.max_queue // 2)
+            if self.queue_depth(tool) >= limit:
+                self._reject("queue_full", tool)
+                raise AdmissionRejected(503, f"Too many queued requests for {tool}", self.expected_wait(tool, lane))
+            expected = self.expected_wait(tool, lane)
+            if expected > self.queue_timeout:
+                self._reject("overloaded", tool)
+                raise AdmissionRejected(503, f"{tool} is overloaded (expected wait {expected:.0f}s)", expected)
+            self.stats["queued"] += 1
+
+        queued_at = time.perf_counter()
+        ADMISSION_QUEUE.labels(tool).inc()
+        try:
+            acquired = await slots.acquire(lane, self.queue_timeout)
+        finally:
+            ADMISSION_QUEUE.labels(tool).dec()
+        if not acquired:
+            self._reject("timeout", tool)
+            raise AdmissionRejected(503, f"Timed out waiting for a {tool} slot", self.expected_wait(tool, lane))
+        self.stats["admitted"] += 1
+        admitted_at = time.perf_counter()
+        ADMISSION_WAIT.labels(tool, lane).observe(admitted_at - queued_at)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - admitted_at
+            previous = self._service_time.get(tool)
+            self._service_time[tool] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+            slots.release()
+
+    def status(self):
+        return {
+            **self.stats,
+            "tools": {tool: {"limit": slots.limit, "active": slots.active, **slots.waiting,
+                             "service_time": round(self._service_time.get(tool, 0.0), 3)}
+                      for tool, slots in self._slots.items()},
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import json
+import os
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from chat_history import history, history_tokens, message_tokens
+from llm_gateway import gateway
+
+# The tool-calling chat loop, shared by the Streamlit app (run_llm_with_mcp.py)
+# and the bridge's /chat endpoint (next_mcp_server.py).
+#
+# Each turn asks the model for an answer; when it asks for tools instead, all
+# tool calls of the turn run concurrently and their (compacted) results are
+# added to the history. After max_turns tool rounds one last completion is made
+# without tools. With stream=True the answer is passed on token by token.
+# Each completion runs inside llm_slot(), when given, so a server can admit
+# model calls the way it admits tool calls.
+
+model = os.environ.get("MODEL", "gpt-4.1-nano")
+# Temperature 0 lets the gateway answer repeated questions from its cache
+temperature = float(os.environ.get("CHAT_TEMPERATURE", 0))
+
+DEFAULT_SYSTEM_PROMPT = ("You are a Smart Financial Advisor specialized in analyzing retail transaction data from "
+                         "Jordan malls. You can analyze sales performance, identify patterns, and generate insights "
+                         "from transaction data. You should respond with specific data and insights, and suggest "
+                         "actionable business recommendations when appropriate. For numbers (totals, counts, "
+                         "averages, rankings) use the query_transactions tool, which computes them exactly.")
+
+ToolCaller = Callable[[str, Dict[str, Any]], Awaitable[str]]
+
+
+def openai_tools(tool_objects) -> List[Dict[str, Any]]:
+    """MCP tool definitions in OpenAI's tool calling format"""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": tool.inputSchema,
+            },
+        }
+        for tool in tool_objects
+    ]
+
+
+async def run_agent(input_messages: List[Dict[str, Any]], tools: List[Dict[str, Any]], call_tool: ToolCaller,
+                    max_turns: int = 3, stream: bool = False,
+                    llm_slot: Optional[Callable[[], AsyncContextManager]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run the loop, yielding events:
+      {"type": "tool_call", "id", "name", "arguments"}   before a tool runs
+      {"type": "tool_result", "id", "name", "chars"}     when it has answered
+      {"type": "delta", "text"}                          answer text (stream=True only)
+      {"type": "done", "content", "tokens_saved"}        the final answer
+    """
+    chat_messages = input_messages[:]
+    question = next((m["content"] for m in reversed(input_messages) if m["role"] == "user"), "")
+    # What the history would cost without compaction, to report the savings
+    raw_tokens = history_tokens(chat_messages)
+    saved = 0
+
+    async def run_tool(tool_call):
+        name = tool_call["function"]["name"]
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+        except ValueError:
+            arguments = {}
+        try:
+            observation = str(await call_tool(name, arguments))
+        except Exception as e:
+            observation = f"Error calling tool: {str(e)}"
+        return observation, await history.observation(name, question, observation)
+
+    for turn in range(max_turns + 1):
+        fitted = history.fit(chat_messages, raw_tokens)
+        saved += raw_tokens - history_tokens(fitted)
+        chat_messages = fitted
+
+        request = {"model": model, "messages": chat_messages, "temperature": temperature}
+        # The last completion must answer with what it has
+        if turn < max_turns and tools:
+            request["tools"] = tools
+        async with (llm_slot() if llm_slot else contextlib.nullcontext()):
+            if stream:
+                result = None
+                async for event in gateway.astream(**request):
+                    if event["type"] == "delta":
+                        yield event
+                    else:
+                        result = event["response"]
+            else:
+                result = await gateway.acomplete(**request)
+        choice = result["choices"][0]
+        message = choice["message"]
+
+        if choice["finish_reason"] != "tool_calls" or not message.get("tool_calls"):
+            yield {"type": "done", "content": message.get("content") or "", "tokens_saved": saved}
+            return
+
+        assistant_message = {"role": "assistant", "content": message.get("content"),
+                             "tool_calls": message["tool_calls"]}
+        chat_messages.append(assistant_message)
+        raw_tokens += message_tokens(assistant_message)
+
+        for tool_call in message["tool_calls"]:
+            yield {"type": "tool_call", "id": tool_call["id"], "name": tool_call["function"]["name"],
+                   "arguments": tool_call["function"]["arguments"]}
+        # The model asked for these together, so none depends on another's result
+        observations = await asyncio.gather(*(run_tool(tool_call) for tool_call in message["tool_calls"]))
+        for tool_call, (observation, compacted) in zip(message["tool_calls"], observations):
+            raw_tokens += message_tokens({"content": observation})
+            chat_messages.append({"role": "tool", "tool_call_id": tool_call["id"], "content": compacted})
+            yield {"type": "tool_result", "id": tool_call["id"], "name": tool_call["function"]["name"],
+                   "chars": len(observation)}
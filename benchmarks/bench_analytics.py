@@ -0,0 +1,84 @@
+import os
+import sys
+
+import pytest
+
+# Regression benchmarks for the analytics layer in rag_pipeline at scale.
+#
+#   pip install pytest-benchmark
+#   pytest benchmarks/bench_analytics.py --benchmark-group-by=param:dataset --benchmark-autosave
+#   pytest-benchmark compare   # against earlier saved runs
+#
+# BENCH_SIZES picks the dataset sizes (default "1e5,1e6"; up to 1e8 works but
+# takes a while to generate). Generated datasets are cached in BENCH_DATA_DIR.
+# CSV loading is only measured up to BENCH_CSV_MAX_ROWS, since a 10^8-row CSV
+# is tens of gigabytes. The LLM call itself is not measured; the
+# "report" benchmarks cover everything ask_from_csv does before the LLM call.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+# llm_gateway reads the API key at import; no request is ever made here
+os.environ.setdefault("OPENAI_API_KEY", "bench-not-used")
+
+import rag_pipeline  # noqa: E402
+from generate_transactions import generate  # noqa: E402
+
+SIZES = [int(float(size)) for size in os.getenv("BENCH_SIZES", "1e5,1e6").split(",")]
+DATA_DIR = os.getenv("BENCH_DATA_DIR", os.path.join(ROOT, "benchmarks", "data"))
+CSV_MAX_ROWS = int(float(os.getenv("BENCH_CSV_MAX_ROWS", "1e6")))
+
+ANOMALY_QUESTION = "Identify any unusual transaction patterns or anomalies in the data"
+REPORT_QUESTION = "Generate a detailed financial report for March 2025"
+FILTER_QUESTION = "Show failed transactions at C Mall Amman in March"
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda rows: f"{rows:.0e}")
+def dataset(request):
+    rows = request.param
+    os.makedirs(DATA_DIR, exist_ok=True)
+    store = os.path.join(DATA_DIR, f"transactions_{rows}")
+    csv = store + ".csv" if rows <= CSV_MAX_ROWS else None
+    if not os.path.exists(os.path.join(store, "meta.json")) or (csv and not os.path.exists(csv)):
+        generate(rows, out_csv=csv, out_store=store)
+    return {"rows": rows, "store": store, "csv": csv}
+
+
+@pytest.fixture
+def loaded(dataset):
+    previous = rag_pipeline.csv_path
+    rag_pipeline.use_dataset(dataset["store"])
+    yield dataset
+    rag_pipeline.use_dataset(previous)
+
+
+def test_load_csv(benchmark, dataset):
+    if not dataset["csv"]:
+        pytest.skip(f"CSV loading not measured above {CSV_MAX_ROWS} rows")
+    df = benchmark.pedantic(rag_pipeline.load_transactions, args=(dataset["csv"],), rounds=3, iterations=1)
+    assert len(df) == dataset["rows"]
+
+
+def test_load_store(benchmark, dataset):
+    df = benchmark(rag_pipeline.load_transactions, dataset["store"])
+    assert len(df) == dataset["rows"]
+
+
+def test_filter_transactions(benchmark, loaded):
+    result = benchmark(rag_pipeline.filter_transactions, FILTER_QUESTION)
+    assert len(result) <= 20
+
+
+def test_summary_statistics(benchmark, loaded):
+    result = benchmark(rag_pipeline.get_summary_statistics)
+    assert "transactions_by_mall" in result
+
+
+def test_anomaly_detection(benchmark, loaded):
+    inputs = benchmark(rag_pipeline.build_prompt_inputs, ANOMALY_QUESTION)
+    assert inputs["statistics"]
+
+
+def test_report_generation(benchmark, loaded):
+    inputs = benchmark(rag_pipeline.build_prompt_inputs, REPORT_QUESTION)
+    assert inputs["context"]
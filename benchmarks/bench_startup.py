@@ -0,0 +1,106 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Startup regression benchmarks: how long each server takes to import, and
+# how long the MCP server takes to answer /livez and /readyz (see startup.py).
+#
+#   pytest benchmarks/bench_startup.py --benchmark-autosave
+#   python benchmarks/bench_startup.py          # slowest imports per server
+#
+# Imports are measured in a fresh interpreter with `python -X importtime`, so
+# nothing cached in this process hides a slow import. Besides the time budget
+# (STARTUP_IMPORT_BUDGET_MS), each server has modules it must not import at
+# startup; those fail the run however fast the machine is.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", 1500))
+LIVE_BUDGET_S = float(os.getenv("STARTUP_LIVE_BUDGET_S", 3))
+
+# Modules each server loads in its warmup or on first use, never at import
+DEFERRED = {
+    "mcp_server": ["rag_pipeline", "timeseries", "report_scheduler", "pandas", "langchain_openai", "openai"],
+    "next_mcp_server": ["pandas", "pyarrow", "langchain_openai"],
+    "whatsapp_integration": ["pandas", "pyarrow", "langchain_openai"],
+}
+
+
+def import_profile(module: str) -> dict:
+    """Import `module` in a fresh interpreter; return its total time and per-module times (ms)"""
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-not-used")}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        modules[name.strip()] = {"self_ms": int(own) / 1000, "cumulative_ms": int(cumulative) / 1000}
+    return {"total_ms": modules[module]["cumulative_ms"], "modules": modules}
+
+
+def slowest(profile: dict, count: int = 10) -> list:
+    return sorted(((info["self_ms"], name) for name, info in profile["modules"].items()), reverse=True)[:count]
+
+
+@pytest.mark.parametrize("module", list(DEFERRED))
+def test_import_time(benchmark, module):
+    profile = benchmark.pedantic(import_profile, args=(module,), rounds=3, iterations=1)
+    benchmark.extra_info["total_ms"] = profile["total_ms"]
+    eager = [name for name in DEFERRED[module] if name in profile["modules"]]
+    assert not eager, f"{module} imports {', '.join(eager)} at startup; import them where they are used"
+    assert profile["total_ms"] < IMPORT_BUDGET_MS, (
+        f"import {module} took {profile['total_ms']:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms); slowest: "
+        + ", ".join(f"{name} {ms:.0f} ms" for ms, name in slowest(profile, 5)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_mcp_server_probes():
+    """Seconds from process start to the first /livez and to /readyz"""
+    import requests
+
+    port = _free_port()
+    env = {**os.environ, "MCP_PORT": str(port), "MCP_METRICS_PORT": str(_free_port()),
+           "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-not-used")}
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "mcp_server.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    try:
+        while time.perf_counter() - started < 60 and ready is None:
+            try:
+                if live is None and requests.get(f"http://127.0.0.1:{port}/livez", timeout=1).ok:
+                    live = time.perf_counter() - started
+                if live is not None and requests.get(f"http://127.0.0.1:{port}/readyz", timeout=1).ok:
+                    ready = time.perf_counter() - started
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    print(f"\nmcp_server: live after {live if live is None else round(live, 2)}s, "
+          f"ready after {ready if ready is None else round(ready, 2)}s")
+    assert live is not None and live < LIVE_BUDGET_S, f"/livez took {live}s (budget {LIVE_BUDGET_S}s)"
+    assert ready is not None, "/readyz never passed"
+
+
+if __name__ == "__main__":
+    for name in DEFERRED:
+        profile = import_profile(name)
+        print(f"{name}: {profile['total_ms']:.0f} ms")
+        for ms, module in slowest(profile):
+            print(f"  {ms:8.1f} ms  {module}")
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from transaction_store import StoreWriter  # noqa: E402
+
+# Synthetic transaction generator for scale testing.
+#
+# Distributions are learned from the real export (pdfs/jordan_transactions.csv):
+# branch mix, hour-of-day and weekday seasonality, per-branch failure rate and
+# amount distribution, refund ratio and the tax-to-amount ratio. A small share
+# of rows are injected anomalies (failure bursts, amount outliers and volume
+# spikes); their ground truth is written next to the output as JSON.
+
+SOURCE_CSV = os.path.join(ROOT, "pdfs", "jordan_transactions.csv")
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+NS_PER_MINUTE = 60 * 10**9
+
+
+def learn_profile(source_csv: str = SOURCE_CSV) -> Dict:
+    """Summarise the real data into the distributions the generator samples from"""
+    df = pd.read_csv(source_csv)
+    df["transaction_date"] = pd.to_datetime(df["transaction_date"], format=DATE_FORMAT)
+
+    branch_counts = df["branch_name"].value_counts().sort_index()
+    branches = list(branch_counts.index)
+    mall_of_branch = df.groupby("branch_name")["mall_name"].first().to_dict()
+
+    # Laplace smoothing so hours/days absent from the sample still occur occasionally
+    hours = np.bincount(df["transaction_date"].dt.hour, minlength=24) + 1.0
+    weekdays = np.bincount(df["transaction_date"].dt.weekday, minlength=7) + 1.0
+
+    failure_rate, log_mu, log_sigma = [], [], []
+    for branch in branches:
+        rows = df[df["branch_name"] == branch]
+        failure_rate.append(float((rows["transaction_status"] == "Failed").mean()))
+        log_amounts = np.log(rows["transaction_amount"].clip(lower=0.01))
+        log_mu.append(float(log_amounts.mean()))
+        log_sigma.append(float(log_amounts.std()))
+
+    return {
+        "branches": branches,
+        "malls": sorted(set(mall_of_branch.values())),
+        "mall_of_branch": [mall_of_branch[b] for b in branches],
+        "branch_p": (branch_counts / branch_counts.sum()).to_numpy(),
+        "hour_p": hours / hours.sum(),
+        "weekday_weight": weekdays / weekdays.mean(),
+        "failure_rate": np.array(failure_rate),
+        "refund_ratio": float((df["transaction_type"] == "Refund").mean()),
+        "log_mu": np.array(log_mu),
+        "log_sigma": np.array(log_sigma),
+        "tax_ratio": float((df["tax_amount"] / df["transaction_amount"]).median()),
+    }
+
+
+def _transaction_ids(rng: np.random.Generator, timestamps: np.ndarray) -> np.ndarray:
+    yymm = pd.DatetimeIndex(timestamps).strftime("%y%m").to_numpy(dtype=str)
+    first = rng.integers(1000, 10000, len(timestamps)).astype(str)
+    second = rng.integers(10000, 100000, len(timestamps)).astype(str)
+    ids = np.char.add("JO-", yymm)
+    ids = np.char.add(np.char.add(ids, "-"), first)
+    return np.char.add(np.char.add(ids, "-"), second)
+
+
+class TransactionGenerator:
+    def __init__(self, profile: Dict, start: str, days: int, seed: int, anomaly_rate: float):
+        self.profile = profile
+        self.start_ns = pd.Timestamp(start).value
+        self.days = days
+        self.rng = np.random.default_rng(seed)
+        self.anomaly_rate = anomaly_rate
+        self.anomalies: List[Dict] = []
+
+        weekday_of_day = (pd.Timestamp(start).weekday() + np.arange(days)) % 7
+        day_weight = profile["weekday_weight"][weekday_of_day]
+        self.day_p = day_weight / day_weight.sum()
+
+    def _frame(self, branch_idx, timestamps, failed, refund, amount) -> pd.DataFrame:
+        p = self.profile
+        amount = np.round(amount, 3)
+        return pd.DataFrame({
+            "transaction_id": _transaction_ids(self.rng, timestamps),
+            "mall_name": np.array(p["mall_of_branch"])[branch_idx],
+            "branch_name": np.array(p["branches"])[branch_idx],
+            "transaction_date": pd.to_datetime(timestamps),
+            "tax_amount": np.round(amount * p["tax_ratio"], 4),
+            "transaction_amount": amount,
+            "transaction_type": np.where(refund, "Refund", "Sale"),
+            "transaction_status": np.where(failed, "Failed", "Completed"),
+        })
+
+    def regular(self, n: int) -> pd.DataFrame:
+        p, rng = self.profile, self.rng
+        branch_idx = rng.choice(len(p["branches"]), size=n, p=p["branch_p"])
+        day = rng.choice(self.days, size=n, p=self.day_p)
+        hour = rng.choice(24, size=n, p=p["hour_p"])
+        minute = rng.integers(0, 60, size=n)
+        timestamps = self.start_ns + ((day * 24 + hour) * 60 + minute) * NS_PER_MINUTE
+        failed = rng.random(n) < p["failure_rate"][branch_idx]
+        refund = rng.random(n) < p["refund_ratio"]
+        amount = rng.lognormal(p["log_mu"][branch_idx], p["log_sigma"][branch_idx])
+        return self._frame(branch_idx, timestamps.astype("datetime64[ns]"), failed, refund, amount)
+
+    def anomalous(self, n: int) -> pd.DataFrame:
+        """n rows split over a few injected incidents, with their ground truth recorded"""
+        p, rng = self.profile, self.rng
+        frames = []
+        remaining = n
+        while remaining > 0:
+            size = int(min(remaining, max(5, rng.integers(20, 200))))
+            remaining -= size
+            kind = rng.choice(["failure_burst", "amount_outlier", "volume_spike"])
+            branch = int(rng.integers(len(p["branches"])))
+            window_start = self.start_ns + int(rng.integers(self.days * 24)) * 60 * NS_PER_MINUTE
+            window_minutes = 120 if kind == "failure_burst" else (15 if kind == "volume_spike" else 24 * 60)
+            timestamps = window_start + rng.integers(0, window_minutes, size) * NS_PER_MINUTE
+            branch_idx = np.full(size, branch)
+            amount = rng.lognormal(p["log_mu"][branch], p["log_sigma"][branch], size)
+            failed = rng.random(size) < p["failure_rate"][branch]
+            if kind == "failure_burst":
+                failed = rng.random(size) < 0.8
+            elif kind == "amount_outlier":
+                amount = amount * rng.uniform(20, 50, size)
+            frames.append(self._frame(branch_idx, timestamps.astype("datetime64[ns]"), failed,
+                                      np.zeros(size, dtype=bool), amount))
+            self.anomalies.append({
+                "kind": str(kind),
+                "branch_name": p["branches"][branch],
+                "start": str(pd.Timestamp(window_start)),
+                "minutes": window_minutes,
+                "rows": size,
+            })
+        return pd.concat(frames, ignore_index=True)
+
+    def chunk(self, n: int) -> pd.DataFrame:
+        n_anomalous = int(self.rng.binomial(n, self.anomaly_rate)) if self.anomaly_rate > 0 else 0
+        parts = [self.regular(n - n_anomalous)]
+        if n_anomalous:
+            parts.append(self.anomalous(n_anomalous))
+        return pd.concat(parts, ignore_index=True)
+
+
+def generate(rows: int, out_csv: str = None, out_store: str = None, start: str = "2025-01-01",
+             days: int = 365, seed: int = 42, anomaly_rate: float = 1e-4, chunk_size: int = 1_000_000) -> Dict:
+    """Write `rows` synthetic transactions to CSV and/or a binary store. Returns a summary"""
+    if not out_csv and not out_store:
+        raise ValueError("Nothing to write: pass out_csv and/or out_store")
+    profile = learn_profile()
+    generator = TransactionGenerator(profile, start, days, seed, anomaly_rate)
+    categories = {
+        "mall_name": profile["malls"],
+        "branch_name": profile["branches"],
+        "transaction_type": ["Refund", "Sale"],
+        "transaction_status": ["Completed", "Failed"],
+    }
+    writer = StoreWriter(out_store, rows, categories) if out_store else None
+
+    started = time.time()
+    written = 0
+    while written < rows:
+        chunk = generator.chunk(min(chunk_size, rows - written))
+        if out_csv:
+            csv_chunk = chunk.assign(transaction_date=chunk["transaction_date"].dt.strftime(DATE_FORMAT))
+            csv_chunk.to_csv(out_csv, mode="w" if written == 0 else "a", header=written == 0,
+                             index=False, float_format="%.4f")
+        if writer:
+            writer.write(chunk)
+        written += len(chunk)
+        print(f"  {written:,}/{rows:,} rows ({time.time() - started:.1f}s)")
+    if writer:
+        writer.close()
+
+    summary = {"rows": rows, "seed": seed, "start": start, "days": days,
+               "anomaly_rate": anomaly_rate, "anomalies": generator.anomalies}
+    truth_path = (out_store.rstrip("/\\") if out_store else os.path.splitext(out_csv)[0]) + ".anomalies.json"
+    with open(truth_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Jordan retail transactions")
+    parser.add_argument("--rows", type=float, default=1e5, help="Number of rows, e.g. 1e6")
+    parser.add_argument("--csv", help="Write a CSV with the same schema as pdfs/jordan_transactions.csv")
+    parser.add_argument("--store", help="Write a binary store directory (see transaction_store.py)")
+    parser.add_argument("--start", default="2025-01-01", help="First day of the generated period")
+    parser.add_argument("--days", type=int, default=365, help="Length of the generated period in days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--anomaly-rate", type=float, default=1e-4, help="Share of rows that are injected anomalies")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    result = generate(int(args.rows), args.csv, args.store, args.start, args.days,
+                      args.seed, args.anomaly_rate, args.chunk_size)
+    print(f"Generated {result['rows']:,} rows with {len(result['anomalies'])} injected anomalies")
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import AsyncExitStack
+from typing import Dict, List
+
+import httpx
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+
+# End-to-end load generator for the WhatsApp -> bridge -> MCP -> RAG chain.
+#
+# Each scenario drives one entry point at a fixed request rate (open loop, so
+# a slow server builds up in-flight requests instead of lowering the offered
+# load). Comparing the layers shows where the time goes:
+#   webhook   - whatsapp_integration /webhook (full chain)
+#   call_tool - next_mcp_server /call_tool (bridge + MCP + RAG + LLM)
+#   mcp_sse   - mcp_server over MCP SSE (MCP + RAG + LLM)
+# With --spawn the whole stack is started against the local stubs in stubs/,
+# so no OpenAI, Twilio or SMTP account is needed.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "What was the total revenue at C Mall Amman in January?",
+    "How many failed transactions were there at Z Mall Al Bayader?",
+    "Compare Y Mall branches by average transaction amount",
+    "What is the refund ratio at C Mall Irbid in February?",
+    "Which branch had the highest completion rate last month?",
+]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(name: str, samples: List[tuple], elapsed: float, dropped: int) -> Dict:
+    latencies = sorted(latency for latency, ok in samples if ok)
+    errors = sum(1 for _, ok in samples if not ok)
+    total = len(samples)
+    return {
+        "scenario": name,
+        "requests": total,
+        "errors": errors,
+        "dropped": dropped,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round((total - errors) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+async def run_open_loop(name: str, send, rps: float, duration: float, max_inflight: int) -> Dict:
+    """Fire send() at a fixed rate for `duration` seconds and collect (latency, ok) samples"""
+    samples = []
+    inflight = set()
+    dropped = 0
+    questions = itertools.cycle(QUESTIONS)
+    interval = 1.0 / rps
+
+    async def one(question: str):
+        start = time.perf_counter()
+        try:
+            ok = await send(question)
+        except Exception:
+            ok = False
+        samples.append((time.perf_counter() - start, ok))
+
+    started = time.perf_counter()
+    next_at = started
+    while time.perf_counter() - started < duration:
+        if len(inflight) >= max_inflight:
+            dropped += 1
+        else:
+            task = asyncio.create_task(one(next(questions)))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    if inflight:
+        await asyncio.wait(inflight)
+    return summarize(name, samples, time.perf_counter() - started, dropped)
+
+
+async def scenario_webhook(args, client: httpx.AsyncClient):
+    async def send(question: str) -> bool:
+        response = await client.post(f"{args.whatsapp_url}/webhook", data={
+            "Body": question,
+            "From": "whatsapp:+962700000000",
+            "MessageSid": f"SM{uuid.uuid4().hex}",
+        })
+        return response.status_code == 200
+    return send
+
+
+async def scenario_call_tool(args, client: httpx.AsyncClient):
+    async def send(question: str) -> bool:
+        response = await client.post(f"{args.bridge_url}/call_tool", json={
+            "tool_name": "get_financial_analysis",
+            "arguments": {"question": question},
+        })
+        return response.status_code == 200
+    return send
+
+
+async def scenario_mcp_sse(args, stack):
+    read, write = await stack.enter_async_context(sse_client(url=args.mcp_url))
+    session = await stack.enter_async_context(ClientSession(read, write))
+    await session.initialize()
+
+    async def send(question: str) -> bool:
+        result = await session.call_tool("get_financial_analysis", arguments={"question": question})
+        return not result.isError
+    return send
+
+
+async def fetch_stub_stats(client: httpx.AsyncClient) -> Dict:
+    stub_stats = {}
+    for name, url in (("fake_openai", "http://localhost:8011/stats"), ("fake_twilio", "http://localhost:8010/messages")):
+        try:
+            response = await client.get(url, timeout=2)
+            stub_stats[name] = response.json()["stats"]
+        except Exception:
+            pass
+    return stub_stats
+
+
+def wait_for_port(port: int, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            sock.settimeout(0.5)
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return True
+        time.sleep(0.2)
+    return False
+
+
+def spawn_stack(log_dir: str, processes: List[subprocess.Popen]):
+    """
+    Start the stubs and the three services wired to them. Each process is added to
+    `processes` as it starts, so the caller can stop them even if a later one fails
+    """
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": "http://localhost:8011/v1",
+        "OPENAI_API_KEY": "fake",
+        "TWILIO_API_BASE": "http://localhost:8010",
+        "TWILIO_AUTH_TOKEN": "fake",
+        "SMTP_HOST": "localhost",
+        "SMTP_PORT": "8025",
+        "SMTP_SECURITY": "none",
+        "SENDER_EMAIL": "bench@example.com",
+        "PYTHONUNBUFFERED": "1",
+    })
+    order = [("stubs/fake_openai.py", 8011), ("stubs/fake_twilio.py", 8010), ("stubs/fake_smtp.py", 8025),
+             ("mcp_server.py", 8000), ("next_mcp_server.py", 8001), ("whatsapp_integration.py", 8002)]
+    for script, port in order:
+        log = open(os.path.join(log_dir, os.path.basename(script) + ".log"), "w")
+        processes.append(subprocess.Popen([sys.executable, script], cwd=ROOT, env=env,
+                                          stdout=log, stderr=subprocess.STDOUT))
+        if not wait_for_port(port, timeout=60):
+            raise RuntimeError(f"{script} did not open port {port}; see logs in {log_dir}")
+        if script == "next_mcp_server.py":
+            # The bridge connects to the MCP server during startup
+            httpx.get("http://localhost:8001/status", timeout=30)
+
+
+def print_report(results: List[Dict], stub_stats: Dict):
+    header = f"{'scenario':<11}{'reqs':>7}{'errs':>6}{'drop':>6}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<11}{r['requests']:>7}{r['errors']:>6}{r['dropped']:>6}{r['throughput_rps']:>8}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+    # Median cost added by each hop, from the difference between adjacent layers
+    by_name = {r["scenario"]: r for r in results}
+    layers = [("webhook", "call_tool", "whatsapp_integration"), ("call_tool", "mcp_sse", "next_mcp_server bridge")]
+    for outer, inner, hop in layers:
+        if outer in by_name and inner in by_name:
+            print(f"p50 added by {hop}: {round(by_name[outer]['p50_ms'] - by_name[inner]['p50_ms'], 1)} ms")
+    if stub_stats:
+        print("\nStub server counters:")
+        print(json.dumps(stub_stats, indent=2))
+
+
+async def main(args):
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    results = []
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.max_inflight)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        for name in scenarios:
+            async with AsyncExitStack() as stack:
+                if name == "webhook":
+                    send = await scenario_webhook(args, client)
+                elif name == "call_tool":
+                    send = await scenario_call_tool(args, client)
+                elif name == "mcp_sse":
+                    send = await scenario_mcp_sse(args, stack)
+                else:
+                    print(f"Unknown scenario '{name}', skipping")
+                    continue
+                print(f"Running {name} at {args.rps} req/s for {args.duration}s...")
+                results.append(await run_open_loop(name, send, args.rps, args.duration, args.max_inflight))
+        stub_stats = await fetch_stub_stats(client)
+
+    print_report(results, stub_stats)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "stubs": stub_stats, "rps": args.rps, "duration": args.duration}, f, indent=2)
+        print(f"\nWrote results to {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the financial advisor request chain")
+    parser.add_argument("--scenarios", default="mcp_sse,call_tool,webhook",
+                        help="Comma-separated scenarios: webhook, call_tool, mcp_sse")
+    parser.add_argument("--rps", type=float, default=5.0, help="Target requests per second per scenario")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run each scenario")
+    parser.add_argument("--max-inflight", type=int, default=200, help="Cap on outstanding requests")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--whatsapp-url", default="http://localhost:8002")
+    parser.add_argument("--bridge-url", default="http://localhost:8001")
+    parser.add_argument("--mcp-url", default="http://localhost:8000/sse")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start the stubs and all services locally before the run")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.spawn:
+            log_dir = tempfile.mkdtemp(prefix="loadtest-logs-")
+            print(f"Starting local stack (logs in {log_dir})...")
+            spawn_stack(log_dir, processes)
+        asyncio.run(main(args))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
@@ -0,0 +1,199 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from metrics import register_stats
+
+# Keeps the tool-calling loop's message history inside a token budget.
+#
+# Every completion in the loop resends the whole history, so one long report
+# observation is paid for again on each turn. HistoryManager
+#   - counts tokens per message (tiktoken if its encoding is available, else ~4 chars/token)
+#   - shortens large tool observations as they come in: keeps the head and
+#     tail, or, with HISTORY_SUMMARIZE=1, has the LLM summarize them
+#   - drops earlier tool-call turns that a later turn repeated with the same
+#     arguments, and failed calls that were retried
+#   - before each completion, shrinks old observations and then drops the
+#     oldest turns until the history fits HISTORY_TOKEN_BUDGET
+# System messages and the latest user message are always kept.
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # tiktoken missing, or its encoding file cannot be downloaded
+            print(f"Token counts are estimated ({type(e).__name__}: tiktoken encoding unavailable)")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Tokens a message costs in a request, including the per-message overhead"""
+    tokens = 4 + count_tokens(str(message.get("content") or ""))
+    for call in message.get("tool_calls") or []:
+        tokens += count_tokens(call["function"]["name"]) + count_tokens(call["function"]["arguments"])
+    return tokens
+
+
+def history_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Keep the start and end of `text` (where totals and conclusions usually are)"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Work in characters, scaled by this text's own chars-per-token ratio
+    keep_chars = int(len(text) * max_tokens / tokens)
+    head = text[:keep_chars * 2 // 3]
+    tail = text[len(text) - keep_chars // 3:]
+    return f"{head}\n[... {tokens - max_tokens} tokens omitted ...]\n{tail}"
+
+
+def _call_signature(call: Dict[str, Any]) -> str:
+    try:
+        arguments = json.dumps(json.loads(call["function"]["arguments"]), sort_keys=True)
+    except ValueError:
+        arguments = call["function"]["arguments"]
+    return f"{call['function']['name']}:{arguments}"
+
+
+def _is_error(content: str) -> bool:
+    return str(content).startswith(("Error calling tool", "Tool not found", "Server not available"))
+
+
+class HistoryManager:
+    def __init__(self, token_budget: int = 8000, max_observation_tokens: int = 1500,
+                 min_observation_tokens: int = 200, summarize: bool = False,
+                 summary_model: Optional[str] = None):
+        self.token_budget = token_budget
+        self.max_observation_tokens = max_observation_tokens
+        self.min_observation_tokens = min_observation_tokens
+        self.summarize = summarize
+        self.summary_model = summary_model
+        self.stats = {"completions": 0, "tokens_before": 0, "tokens_sent": 0, "tokens_saved": 0,
+                      "observations_shortened": 0, "turns_dropped": 0, "over_budget": 0}
+
+    @classmethod
+    def from_env(cls) -> "HistoryManager":
+        return cls(
+            token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", 8000)),
+            max_observation_tokens=int(os.getenv("HISTORY_MAX_OBSERVATION_TOKENS", 1500)),
+            min_observation_tokens=int(os.getenv("HISTORY_MIN_OBSERVATION_TOKENS", 200)),
+            summarize=os.getenv("HISTORY_SUMMARIZE", "0") == "1",
+            summary_model=os.getenv("HISTORY_SUMMARY_MODEL", os.getenv("MODEL", "gpt-4.1-nano")),
+        )
+
+    async def observation(self, tool_name: str, question: str, text: str) -> str:
+        """Shorten one tool observation before it enters the history"""
+        text = str(text)
+        if count_tokens(text) <= self.max_observation_tokens:
+            return text
+        self.stats["observations_shortened"] += 1
+        if self.summarize:
+            try:
+                return await self._summarize(tool_name, question, text)
+            except Exception as e:
+                print(f"Could not summarize {tool_name} output, truncating instead: {str(e)}")
+        return truncate_text(text, self.max_observation_tokens)
+
+    async def _summarize(self, tool_name: str, question: str, text: str) -> str:
+        from llm_gateway import gateway, message_text
+
+        # Temperature 0, so the same observation is summarized once and then served from the cache
+        result = await gateway.acomplete(
+            model=self.summary_model,
+            temperature=0,
+            max_tokens=self.max_observation_tokens,
+            messages=[{"role": "system", "content": (
+                "Condense the tool output below for another assistant answering the user's question. "
+                "Keep every number, name, date and total that could matter; drop formatting and repetition.")},
+                {"role": "user", "content": f"Question: {question}\n\nOutput of {tool_name}:\n{text}"}],
+        )
+        return f"[Summary of {tool_name} output]\n{message_text(result)}"
+
+    @staticmethod
+    def _turns(messages: List[Dict[str, Any]]) -> List[List[int]]:
+        """Indexes of each tool-calling turn: the assistant message plus its tool results"""
+        turns, current = [], None
+        for index, message in enumerate(messages):
+            if message.get("role") == "assistant" and message.get("tool_calls"):
+                current = [index]
+                turns.append(current)
+            elif message.get("role") == "tool" and current is not None:
+                current.append(index)
+            else:
+                current = None
+        return turns
+
+    def drop_redundant(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Remove turns whose every call was repeated later, or failed and was retried later"""
+        turns = self._turns(messages)
+        dropped = set()
+        for position, turn in enumerate(turns):
+            later = [messages[i] for t in turns[position + 1:] for i in t[:1]]
+            later_signatures = {_call_signature(c) for m in later for c in m["tool_calls"]}
+            later_tools = {c["function"]["name"] for m in later for c in m["tool_calls"]}
+            results = {messages[i]["tool_call_id"]: messages[i].get("content") for i in turn[1:]}
+            if all(_call_signature(call) in later_signatures
+                   or (_is_error(results.get(call["id"], "")) and call["function"]["name"] in later_tools)
+                   for call in messages[turn[0]]["tool_calls"]):
+                dropped.update(turn)
+        self.stats["turns_dropped"] += sum(1 for turn in turns if turn[0] in dropped)
+        return [m for i, m in enumerate(messages) if i not in dropped]
+
+    def fit(self, messages: List[Dict[str, Any]], raw_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        The history to send for the next completion, within the token budget.
+        `raw_tokens` is what the history would cost with the tool observations
+        in full; savings are counted against it.
+        """
+        before = history_tokens(messages) if raw_tokens is None else raw_tokens
+        fitted = self.drop_redundant(messages)
+
+        # Shrink the oldest observations first; the newest is usually what the model needs next
+        tool_indexes = [i for i, m in enumerate(fitted) if m.get("role") == "tool"]
+        for index in tool_indexes[:-1]:
+            if history_tokens(fitted) <= self.token_budget:
+                break
+            content = str(fitted[index].get("content") or "")
+            if count_tokens(content) > self.min_observation_tokens:
+                fitted[index] = {**fitted[index], "content": truncate_text(content, self.min_observation_tokens)}
+
+        # Then drop whole turns, oldest first, keeping the latest one
+        while history_tokens(fitted) > self.token_budget:
+            turns = self._turns(fitted)
+            if len(turns) < 2:
+                break
+            fitted = [m for i, m in enumerate(fitted) if i not in set(turns[0])]
+            self.stats["turns_dropped"] += 1
+
+        sent = history_tokens(fitted)
+        if sent > self.token_budget:
+            self.stats["over_budget"] += 1
+        self.stats["completions"] += 1
+        self.stats["tokens_before"] += before
+        self.stats["tokens_sent"] += sent
+        self.stats["tokens_saved"] += before - sent
+        return fitted
+
+
+history = HistoryManager.from_env()
+register_stats("chat_history", history.stats)
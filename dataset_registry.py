@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import rag_pipeline
+
+# Several tenants' transaction datasets served by one process.
+#
+# DATASETS_FILE is a JSON file mapping a dataset id to its data, any format
+# rag_pipeline loads (CSV, store, database file, partitioned directory):
+#   {"jordan": "pdfs/jordan_transactions.csv",
+#    "ksa-retail": {"path": "data/ksa.sqlite", "name": "KSA Retail"}}
+# A request names its dataset in the MCP request _meta only (the bridge puts
+# its X-Dataset header there). Tools take no `dataset` argument, since the LLM
+# writes tool arguments; no dataset (or "default") means the server's own
+# TRANSACTIONS_PATH dataset.
+#
+# A tenant's dataset is loaded on its first request and kept while it is
+# used. After every tenant request the resident datasets are measured (their
+# frames, and the rollups, sketches and indexes queries built for them); while
+# they exceed DATASET_MEMORY_BUDGET_MB, the least recently used are dropped.
+# The next request for a dropped tenant loads it anew. Requests already
+# running keep the dataset they pinned until they finish. The server's own
+# dataset is always resident and not counted against the budget.
+
+DATASETS_FILE = os.getenv("DATASETS_FILE")
+DEFAULT_DATASET = "default"
+MEMORY_BUDGET_BYTES = int(float(os.getenv("DATASET_MEMORY_BUDGET_MB", 2048)) * 2**20)
+
+
+def load_catalog(path: Optional[str] = DATASETS_FILE) -> Dict[str, Dict[str, Any]]:
+    """Dataset ids and their paths from DATASETS_FILE (relative paths are relative to the file)"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    catalog = {}
+    for dataset_id, entry in entries.items():
+        entry = {"path": entry} if isinstance(entry, str) else dict(entry)
+        entry["path"] = os.path.join(os.path.dirname(os.path.abspath(path)), entry["path"])
+        catalog[dataset_id] = entry
+    return catalog
+
+
+def dataset_bytes(dataset: Dict[str, Any]) -> int:
+    """Memory a loaded dataset holds: its frame plus the rollups, sketches and indexes built for it so far"""
+    if "frame_bytes" not in dataset:
+        # Measured once; a loaded frame does not change
+        df = dataset["df"]
+        dataset["frame_bytes"] = int(df.memory_usage(deep=True).sum()) if df is not None else 0
+    size = dataset["frame_bytes"]
+    rollups = dataset.get("rollups")
+    if rollups is not None:
+        size += sum(int(table.memory_usage(deep=True).sum()) for table in rollups.tables.values())
+    sketches = dataset.get("sketches")
+    if sketches is not None:
+        size += sketches.nbytes()
+    indexes = dataset.get("query_indexes")
+    if indexes is not None:
+        size += indexes.date_order.nbytes + indexes.sorted_ns.nbytes
+        size += sum(order.nbytes + codes.nbytes for (order, _), codes in
+                    zip(indexes.postings.values(), indexes.codes.values()))
+    return size
+
+
+class DatasetRegistry:
+    """Tenant datasets by id, loaded on first use and evicted least recently used first"""
+
+    def __init__(self, catalog: Optional[Dict[str, Dict[str, Any]]] = None,
+                 budget_bytes: int = MEMORY_BUDGET_BYTES):
+        self.catalog = load_catalog() if catalog is None else catalog
+        self.budget_bytes = budget_bytes
+        self._resident: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One load per dataset at a time; loads of different datasets run in parallel
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0, "resident": 0, "resident_bytes": 0}
+
+    def ids(self) -> List[str]:
+        return sorted(self.catalog)
+
+    def get(self, dataset_id: Optional[str]) -> Dict[str, Any]:
+        """The dataset for `dataset_id`, loading it on first use; the server's own one for no id"""
+        if not dataset_id or dataset_id == DEFAULT_DATASET:
+            return rag_pipeline.current_dataset()
+        if dataset_id not in self.catalog:
+            raise ValueError(f"Unknown dataset '{dataset_id}'. Available: {', '.join(self.ids()) or 'none'}")
+        with self._lock:
+            dataset = self._resident.get(dataset_id)
+            if dataset is not None:
+                self._resident.move_to_end(dataset_id)
+                self.stats["hits"] += 1
+                return dataset
+            load_lock = self._load_locks.setdefault(dataset_id, threading.Lock())
+        with load_lock:
+            with self._lock:
+                if dataset_id in self._resident:
+                    return self._resident[dataset_id]
+            started = time.perf_counter()
+            dataset = rag_pipeline.load_dataset(self.catalog[dataset_id]["path"])
+            print(f"Loaded dataset {dataset_id} ({dataset['rows']:,} rows) in {time.perf_counter() - started:.2f}s")
+            with self._lock:
+                self._resident[dataset_id] = dataset
+                self.stats["loads"] += 1
+            self.evict()
+        return dataset
+
+    def evict(self):
+        """Drop least recently used datasets until the resident ones fit the memory budget"""
+        with self._lock:
+            sizes = {dataset_id: dataset_bytes(dataset) for dataset_id, dataset in self._resident.items()}
+            total = sum(sizes.values())
+            # The most recently used dataset stays even if it alone exceeds the budget
+            while total > self.budget_bytes and len(self._resident) > 1:
+                dataset_id, _ = self._resident.popitem(last=False)
+                total -= sizes[dataset_id]
+                self.stats["evictions"] += 1
+                print(f"Evicted dataset {dataset_id} ({sizes[dataset_id] / 2**20:.1f} MB) to stay within "
+                      f"{self.budget_bytes / 2**20:.0f} MB")
+            self.stats["resident"] = len(self._resident)
+            self.stats["resident_bytes"] = total
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = list(self._resident)
+        return {**self.stats, "budget_bytes": self.budget_bytes, "resident_ids": resident,
+                "datasets": self.ids()}
+
+
+registry = DatasetRegistry()
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+# Versioned, shared transaction datasets for multi-worker deployments.
+#
+# DATASET_ROOT holds one transaction store per published version plus a
+# CURRENT pointer:
+#   versions/<version>/   a store (see transaction_store.py), memory-mapped by every worker
+#   CURRENT               {"version", "path", "published_at", "activate_at"}
+# publish() writes the new store completely before replacing CURRENT in one
+# atomic rename. Workers poll CURRENT, load (map) the new version as soon as
+# they see it, and all switch at the same `activate_at` moment, set a little
+# after publishing so every worker has time to notice.
+
+DATASET_ROOT = os.getenv("DATASET_ROOT", os.path.join(os.getcwd(), "datasets"))
+CURRENT_FILE = "CURRENT"
+# A partitioned dataset directory is identified by its manifest (see partitions.py)
+MANIFEST_FILE = "manifest.json"
+
+
+def read_current(root: str = DATASET_ROOT) -> Optional[Dict[str, Any]]:
+    """The published version pointer, or None if nothing was published yet"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(root: str) -> Optional[Dict[str, Any]]:
+    """The manifest of a partitioned dataset (see partitions.py), or None if `root` is not one"""
+    try:
+        with open(os.path.join(root, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def manifest_pointer(root: str) -> Optional[Dict[str, Any]]:
+    """A partitioned dataset's manifest as a version pointer, for DatasetWatcher(pointer=...)"""
+    manifest = read_manifest(root)
+    return {"version": manifest["version"], "path": root} if manifest else None
+
+
+def publish(source: str, root: str = DATASET_ROOT, switch_delay: Optional[float] = None,
+            keep: int = 3) -> Dict[str, Any]:
+    """Copy or convert `source` (CSV or store) into a new version and make it current"""
+    if switch_delay is None:
+        switch_delay = float(os.getenv("DATASET_SWITCH_DELAY", 5))
+    version = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+    target = os.path.join(root, "versions", version)
+    staging = target + ".tmp"
+
+    # pandas is only needed to publish; the watcher that every server starts stays import-light
+    import pandas as pd
+    from transaction_store import is_store, write_store
+
+    if is_store(source):
+        shutil.copytree(source, staging)
+    else:
+        df = pd.read_csv(source)
+        df["transaction_date"] = pd.to_datetime(df["transaction_date"], format="%d/%m/%Y %H:%M")
+        write_store(df, staging)
+    os.replace(staging, target)
+
+    now = time.time()
+    pointer = {"version": version, "path": target, "published_at": now, "activate_at": now + switch_delay}
+    tmp_path = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    print(f"Published dataset version {version} from {source} (active in {switch_delay:.0f}s)")
+
+    prune(root, keep)
+    return pointer
+
+
+def prune(root: str = DATASET_ROOT, keep: int = 3):
+    """Delete all but the newest `keep` versions. Workers still mapping an old one keep their pages"""
+    versions_dir = os.path.join(root, "versions")
+    current = (read_current(root) or {}).get("version")
+    versions = sorted(v for v in os.listdir(versions_dir) if not v.endswith(".tmp"))
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version == current:
+            continue
+        # On Windows a version still mapped by a worker cannot be removed; try again next time
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+
+class DatasetWatcher:
+    """
+    Follow the CURRENT pointer in a background thread.
+
+    `load(path)` is called as soon as a new version appears and may take a
+    while; `activate(loaded, pointer)` is called at the version's activate_at
+    time and should only swap references. `pointer` replaces reading CURRENT,
+    e.g. manifest_pointer to follow ingestion into a partitioned dataset.
+    """
+
+    def __init__(self, load: Callable[[str], Any], activate: Callable[[Any, Dict[str, Any]], None],
+                 root: str = DATASET_ROOT, poll_interval: Optional[float] = None,
+                 active_version: Optional[str] = None,
+                 pointer: Optional[Callable[[], Optional[Dict[str, Any]]]] = None):
+        self.load = load
+        self.activate = activate
+        self.root = root
+        self.pointer = pointer or (lambda: read_current(self.root))
+        self.poll_interval = poll_interval or float(os.getenv("DATASET_POLL_SECONDS", 1))
+        self.active_version = active_version
+        self._failed_version = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dataset-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                pointer = self.pointer()
+            except (OSError, ValueError) as e:
+                print(f"Could not read dataset pointer: {e}")
+                continue
+            if not pointer or pointer["version"] in (self.active_version, self._failed_version):
+                continue
+            try:
+                loaded = self.load(pointer["path"])
+            except Exception as e:
+                print(f"Failed to load dataset version {pointer['version']}: {e}")
+                self._failed_version = pointer["version"]  # don't retry a broken version in a loop
+                continue
+            # Wait for the agreed moment so all workers switch together
+            delay = pointer.get("activate_at", 0) - time.time()
+            if delay > 0 and self._stopping.wait(delay):
+                return
+            self.activate(loaded, pointer)
+            self.active_version = pointer["version"]
+            print(f"Switched to dataset version {pointer['version']}")
@@ -0,0 +1,325 @@
+import heapq
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from send_mail import build_message, open_smtp_connection, smtp_settings
+
+# Directory where not-yet-delivered mail is persisted
+DEFAULT_SPOOL_DIR = os.getenv("EMAIL_SPOOL_DIR", os.path.join(os.getcwd(), "email_spool"))
+
+# SMTP errors after which the same message will not succeed on retry
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                    smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError)
+
+# How long, and how many, sent or failed messages stay available to status()
+FINISHED_TTL = float(os.getenv("EMAIL_STATUS_TTL", 3600))
+FINISHED_MAX = int(os.getenv("EMAIL_STATUS_MAX", 10000))
+
+
+class EmailOutbox:
+    """
+    Asynchronous, persistent outbox for outgoing email.
+
+    enqueue() writes the message to a spool directory and returns its id
+    immediately. A single background thread drains the queue, reusing one
+    authenticated SMTP connection for batches of messages and closing it
+    after a period of inactivity. Transient failures are retried with
+    exponential backoff; delivered messages are removed from the spool, and
+    anything still in the spool is re-queued when the outbox starts again.
+    Sent and failed messages are kept for status() until they are older
+    than finished_ttl or more than finished_max of them have piled up.
+    """
+
+    def __init__(self, spool_dir: str = DEFAULT_SPOOL_DIR,
+                 batch_size: int = int(os.getenv("EMAIL_BATCH_SIZE", 20)),
+                 max_retries: int = int(os.getenv("EMAIL_MAX_RETRIES", 5)),
+                 base_delay: float = 2.0, max_delay: float = 300.0,
+                 idle_timeout: float = float(os.getenv("EMAIL_IDLE_TIMEOUT", 30)),
+                 id_prefix: str = os.getenv("EMAIL_ID_PREFIX", ""),
+                 finished_ttl: float = FINISHED_TTL, finished_max: int = FINISHED_MAX):
+        self.spool_dir = spool_dir
+        # Tags message ids with the worker that owns them in multi-worker deployments
+        self.id_prefix = id_prefix
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idle_timeout = idle_timeout
+        self.finished_ttl = finished_ttl
+        self.finished_max = finished_max
+
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._delayed: List[tuple] = []  # heap of (due_time, message_id)
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._unfinished = 0  # records still queued or retrying
+        self._finished: "OrderedDict[str, float]" = OrderedDict()  # message_id -> finished_at, oldest first
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._connection: Optional[smtplib.SMTP] = None
+        self._connection_used_at = 0.0
+
+        self.stats = {"enqueued": 0, "sent": 0, "failed": 0, "retries": 0,
+                      "connections_opened": 0, "batches": 0}
+
+    # ----- spool -----
+
+    def _spool_path(self, message_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{message_id}.json")
+
+    def _write_spool(self, record: Dict[str, Any]):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self._spool_path(record["id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+    def _remove_spool(self, message_id: str):
+        try:
+            os.remove(self._spool_path(message_id))
+        except FileNotFoundError:
+            pass
+
+    def _recover_spool(self):
+        if not os.path.isdir(self.spool_dir):
+            return
+        recovered = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name), encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable spool file {name}: {e}")
+                continue
+            record["status"] = "queued"
+            with self._lock:
+                if record["id"] not in self._records:
+                    self._unfinished += 1
+                self._records[record["id"]] = record
+            self._queue.put(record["id"])
+            recovered += 1
+        if recovered:
+            print(f"Recovered {recovered} pending email(s) from {self.spool_dir}")
+
+    # ----- public API -----
+
+    def start(self):
+        """Start the background sender (idempotent) and re-queue spooled mail"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._recover_spool()
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._close_connection()
+
+    def enqueue(self, receiver: str, subject: str, body: str) -> str:
+        """
+        Persist a message and queue it for delivery. Returns the message id.
+        Raises ValueError for a message that can never be sent (e.g. a line break in a header)
+        """
+        build_message(smtp_settings()["sender_email"] or "", receiver, subject, body)
+        # Start first so spool recovery doesn't pick up this message a second time
+        self.start()
+        record = {
+            "id": self.id_prefix + uuid.uuid4().hex,
+            "receiver": receiver,
+            "subject": subject,
+            "body": body,
+            "attempts": 0,
+            "status": "queued",
+            "error": None,
+            "created_at": time.time(),
+        }
+        self._write_spool(record)
+        with self._lock:
+            self._records[record["id"]] = record
+            self._unfinished += 1
+        self.stats["enqueued"] += 1
+        self._queue.put(record["id"])
+        return record["id"]
+
+    def status(self, message_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(message_id)
+            if record is None:
+                return None
+            return {k: record[k] for k in ("id", "receiver", "subject", "status", "attempts", "error")}
+
+    def pending_count(self) -> int:
+        return self._queue.qsize() + len(self._delayed)
+
+    def flush(self, timeout: float = 60.0) -> bool:
+        """Wait until everything queued has been attempted. Returns False on timeout"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                busy = self._unfinished > 0
+            if not busy:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _finish(self, record: Dict[str, Any], status: str):
+        """Mark a record sent or failed and evict finished records past the TTL or cap"""
+        now = time.time()
+        with self._lock:
+            record["status"] = status
+            self._unfinished -= 1
+            self._finished[record["id"]] = now
+            while self._finished:
+                message_id, finished_at = next(iter(self._finished.items()))
+                if len(self._finished) <= self.finished_max and now - finished_at <= self.finished_ttl:
+                    break
+                del self._finished[message_id]
+                self._records.pop(message_id, None)
+
+    # ----- SMTP connection reuse -----
+
+    def _get_connection(self, settings: dict) -> smtplib.SMTP:
+        if self._connection is not None:
+            try:
+                if self._connection.noop()[0] == 250:
+                    return self._connection
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close_connection()
+        self._connection = open_smtp_connection(settings)
+        self.stats["connections_opened"] += 1
+        return self._connection
+
+    def _close_connection(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.quit()
+        except Exception:
+            pass
+        self._connection = None
+
+    # ----- background sender -----
+
+    def _next_batch(self) -> List[str]:
+        # Move due retries back onto the queue
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._queue.put(heapq.heappop(self._delayed)[1])
+
+        wait = 1.0
+        if self._delayed:
+            wait = max(0.0, min(wait, self._delayed[0][0] - now))
+        try:
+            batch = [self._queue.get(timeout=wait)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _retry_delay(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _schedule_retry(self, record: Dict[str, Any], error: str, delay: float):
+        record["error"] = error
+        if record["attempts"] > self.max_retries:
+            self._fail(record, error)
+            return
+        record["status"] = "retrying"
+        self._write_spool(record)
+        heapq.heappush(self._delayed, (time.time() + delay, record["id"]))
+        self.stats["retries"] += 1
+
+    def _fail(self, record: Dict[str, Any], error: str):
+        record["error"] = error
+        self._remove_spool(record["id"])
+        self._finish(record, "failed")
+        self.stats["failed"] += 1
+        print(f"❌ Giving up on email {record['id']} to {record['receiver']}: {error}")
+
+    def _send_batch(self, batch: List[str]):
+        settings = smtp_settings()
+        sender_email = settings["sender_email"]
+        with self._lock:
+            records = [self._records[message_id] for message_id in batch if message_id in self._records]
+
+        if not sender_email:
+            for record in records:
+                self._fail(record, "Sender email not found in environment variables")
+            return
+
+        self.stats["batches"] += 1
+        for index, record in enumerate(records):
+            record["attempts"] += 1
+            try:
+                connection = self._get_connection(settings)
+                connection.send_message(build_message(sender_email, record["receiver"],
+                                                      record["subject"], record["body"]))
+            except PERMANENT_ERRORS as e:
+                self._fail(record, str(e))
+                continue
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError) as e:
+                connection_error = e
+            except smtplib.SMTPResponseException as e:
+                # The server refused this one message; the connection is still usable
+                if e.smtp_code >= 500:
+                    self._fail(record, f"{e.smtp_code} {e.smtp_error!r}")
+                else:
+                    self._schedule_retry(record, f"{e.smtp_code} {e.smtp_error!r}",
+                                         self._retry_delay(record["attempts"]))
+                continue
+            except (smtplib.SMTPException, OSError) as e:
+                connection_error = e
+            except Exception as e:
+                # Anything else is a problem with the message itself, which a retry won't fix
+                self._fail(record, f"{type(e).__name__}: {e}")
+                continue
+            else:
+                record["error"] = None
+                self._remove_spool(record["id"])
+                self._finish(record, "sent")
+                self.stats["sent"] += 1
+                continue
+
+            # Connection-level problem: retry this and the rest of the batch later
+            self._close_connection()
+            delay = self._retry_delay(record["attempts"])
+            error = f"{type(connection_error).__name__}: {connection_error}"
+            for pending in records[index:]:
+                self._schedule_retry(pending, error, delay)
+            return
+        self._connection_used_at = time.time()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._send_batch(batch)
+            elif self._connection is not None and time.time() - self._connection_used_at > self.idle_timeout:
+                self._close_connection()
+
+
+# Shared outbox for the MCP server process
+outbox = EmailOutbox()
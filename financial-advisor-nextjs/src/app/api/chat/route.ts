@@ -2,17 +2,39 @@ import { NextResponse } from 'next/server';
 import { OpenAI } from 'openai';
 import * as dotenv from 'dotenv';
 import axios from 'axios';
+import { randomUUID } from 'crypto';
 
 dotenv.config();
 
-// Configure OpenAI client
+// Configure OpenAI client. With LLM_GATEWAY_URL (e.g. http://localhost:8003/v1) completions go
+// through the Python LLM gateway, which adds retries, hedging, caching and per-model limits.
 const client = new OpenAI({
-  apiKey: process.env.OPENAI_API_KEY || '',
+  // The gateway holds the real key, so none is needed here when using it
+  apiKey: process.env.OPENAI_API_KEY || (process.env.LLM_GATEWAY_URL ? 'gateway' : ''),
+  baseURL: process.env.LLM_GATEWAY_URL || undefined,
 });
 
 // Model and server configurations
 const MODEL = process.env.MODEL || 'gpt-4';
 const MCP_SERVER_URL = process.env.NEXT_PUBLIC_MCP_SERVER_URL || 'http://localhost:8001';
+// Token from the bridge's ADMISSION_TRUSTED_CLIENTS; without it the bridge rate limits this server by its address
+const BRIDGE_HEADERS: Record<string, string> = process.env.BRIDGE_CLIENT_TOKEN
+  ? { 'X-Client-Token': process.env.BRIDGE_CLIENT_TOKEN }
+  : {};
+// Each browser session gets its own rate-limit bucket at the bridge (X-Client-Id, honoured with the token)
+const SESSION_COOKIE = 'advisor_session';
+
+// The caller's session id from its cookie, or a new one to set
+function chatSession(req: Request): { id: string; isNew: boolean } {
+  const match = (req.headers.get('cookie') || '').match(new RegExp(`(?:^|;\\s*)${SESSION_COOKIE}=([A-Za-z0-9-]{8,64})`));
+  return match ? { id: match[1], isNew: false } : { id: randomUUID(), isNew: true };
+}
+
+function bridgeHeaders(sessionId: string): Record<string, string> {
+  return { ...BRIDGE_HEADERS, 'X-Client-Id': `session:${sessionId}` };
+}
+
+const SYSTEM_PROMPT = 'You are RightNow, an AI financial advisor specialized in analyzing retail transaction data from Jordan malls. You provide real-time insights, trend analysis, and actionable recommendations based on financial data.';
 
 // Check if MCP server is available
 async function checkMcpServerStatus() {
@@ -26,7 +48,7 @@ async function checkMcpServerStatus() {
 }
 
 // This function connects to the MCP server and calls a specific tool
-async function callMcpTool(toolName: string, arguments_: any) {
+async function callMcpTool(toolName: string, arguments_: any, sessionId: string) {
   try {
     console.log(`Tool Call: ${toolName}`);
     console.log('Arguments:', arguments_);
@@ -38,7 +60,11 @@ async function callMcpTool(toolName: string, arguments_: any) {
         tool_name: toolName,
         arguments: arguments_
       },
-      { timeout: 30000 } // 30 second timeout for long-running operations
+      {
+        timeout: 30000, // 30 second timeout for long-running operations
+        // The bridge puts chat tools in the interactive lane, ahead of bulk report generation
+        headers: bridgeHeaders(sessionId)
+      }
     );
     
     if (response.status !== 200) {
@@ -49,6 +75,11 @@ async function callMcpTool(toolName: string, arguments_: any) {
     return response.data.result;
   } catch (error) {
     console.error('Error calling MCP tool:', error);
+    // The bridge is overloaded or this client is over its rate limit
+    if (axios.isAxiosError(error) && (error.response?.status === 429 || error.response?.status === 503)) {
+      const retryAfter = error.response.headers['retry-after'] || 'a few';
+      return `Error: The financial data service is busy right now. Please try again in ${retryAfter} seconds.`;
+    }
     return `Error: Unable to call the tool ${toolName}. The financial data service is currently unavailable. Please ensure the MCP server is running.`;
   }
 }
@@ -86,6 +117,15 @@ async function fetchMcpTools() {
 }
 
 export async function POST(req: Request) {
+  const session = chatSession(req);
+  const response = await handleChat(req, session.id);
+  if (session.isNew) {
+    response.headers.append('Set-Cookie', `${SESSION_COOKIE}=${session.id}; Path=/; HttpOnly; SameSite=Lax`);
+  }
+  return response;
+}
+
+async function handleChat(req: Request, sessionId: string): Promise<Response> {
   try {
     const { messages } = await req.json();
     
@@ -96,11 +136,31 @@ export async function POST(req: Request) {
       );
     }
     
+    // Run the whole tool-calling loop in the bridge, next to the MCP server: one request per
+    // message, with the answer streamed back as it is generated. Falls back to the loop below.
+    if (process.env.SERVER_SIDE_CHAT !== '0') {
+      try {
+        const upstream = await fetch(`${MCP_SERVER_URL}/chat`, {
+          method: 'POST',
+          headers: { ...bridgeHeaders(sessionId), 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+          body: JSON.stringify({ messages: [{ role: 'system', content: SYSTEM_PROMPT }, ...messages] }),
+        });
+        if (upstream.ok && upstream.body) {
+          return new Response(upstream.body, {
+            headers: { 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache' },
+          });
+        }
+        console.error(`Server-side chat failed with ${upstream.status}, falling back`);
+      } catch (error) {
+        console.error('Server-side chat unavailable, falling back:', error);
+      }
+    }
+    
     // Check if MCP server is available
     const isMcpServerAvailable = await checkMcpServerStatus();
     
     // Create system prompt based on server availability
-    let systemPromptContent = 'You are RightNow, an AI financial advisor specialized in analyzing retail transaction data from Jordan malls. You provide real-time insights, trend analysis, and actionable recommendations based on financial data.';
+    let systemPromptContent = SYSTEM_PROMPT;
     
     if (!isMcpServerAvailable) {
       systemPromptContent += ' IMPORTANT: The MCP server that provides financial data is currently offline. Inform the user that they need to start the MCP server with "python mcp_server.py" to access data analysis features. Do not attempt to provide specific financial insights without the server connection.';
@@ -142,7 +202,7 @@ export async function POST(req: Request) {
         }
         
         // Call the MCP tool
-        const observation = await callMcpTool(functionName, functionArgs);
+        const observation = await callMcpTool(functionName, functionArgs, sessionId);
         
         // Add the observation to the messages
         chatMessages.push({
@@ -188,6 +188,46 @@ export default function Home() {
     return 'Good evening';
   };
 
+  // Read the SSE events of the server-side chat loop, growing one assistant message as text arrives
+  const readChatStream = async (body: ReadableStream<Uint8Array>) => {
+    const reader = body.getReader();
+    const decoder = new TextDecoder();
+    const messageId = uuidv4();
+    let buffer = '';
+    let content = '';
+    let started = false;
+
+    const showContent = (text: string) => {
+      if (!started) {
+        started = true;
+        setIsLoading(false);
+        setMessages(prev => [...prev, { id: messageId, role: 'assistant', content: text, timestamp: new Date() }]);
+      } else {
+        setMessages(prev => prev.map(m => (m.id === messageId ? { ...m, content: text } : m)));
+      }
+    };
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop() || '';
+      for (const raw of events) {
+        if (!raw.startsWith('data: ')) continue;
+        const event = JSON.parse(raw.slice(6));
+        if (event.type === 'delta') {
+          content += event.text;
+          showContent(content);
+        } else if (event.type === 'done') {
+          showContent(event.content);
+        } else if (event.type === 'error') {
+          throw new Error(event.error);
+        }
+      }
+    }
+  };
+
   // Handle form submission
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -224,21 +264,26 @@ export default function Home() {
         throw new Error('Failed to get response');
       }
       
-      const data = await response.json();
-      
-      if (data.error) {
-        throw new Error(data.error);
+      if (response.headers.get('content-type')?.includes('text/event-stream') && response.body) {
+        // Server-side chat loop: show the answer as it streams in
+        await readChatStream(response.body);
+      } else {
+        const data = await response.json();
+        
+        if (data.error) {
+          throw new Error(data.error);
+        }
+        
+        const assistantMessage: Message = {
+          id: uuidv4(),
+          role: 'assistant',
+          content: data.response,
+          timestamp: new Date(),
+        };
+        
+        setMessages(prev => [...prev, assistantMessage]);
       }
       
-      const assistantMessage: Message = {
-        id: uuidv4(),
-        role: 'assistant',
-        content: data.response,
-        timestamp: new Date(),
-      };
-      
-      setMessages(prev => [...prev, assistantMessage]);
-      
       // Add to conversation history if we have at least 2 exchanges
       if (messages.length >= 3 && messages.length % 2 === 1) {
         // Create a title from the first user message
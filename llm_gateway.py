@@ -0,0 +1,476 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from metrics import record_llm_usage, register_stats, track_llm
+from tracing import inject_headers, llm_usage_attributes, set_attributes, span
+
+# One place for every chat completion: rag_pipeline.ask_from_csv, the chat loop in
+# run_llm_with_mcp, and (through the HTTP facade) the Next.js chat route.
+#
+#   - one pooled HTTP/1.1 keep-alive client, so calls skip the TCP/TLS handshake
+#   - deterministic requests (temperature 0, no streaming) are answered from an
+#     LRU cache keyed by model, messages, tools and sampling parameters
+#   - a second, hedged request is sent when the first has not answered by the
+#     model's recent p95 latency; whichever finishes first wins
+#   - 429 / 5xx / connection errors are retried a bounded number of times with
+#     full-jitter backoff (honouring Retry-After)
+#   - each model has a concurrency limit; hedges only use spare slots
+#   - astream() streams a completion token by token; it shares the cache, limits
+#     and retries (until the first token), but is never hedged
+#
+# The gateway runs its own event loop in a background thread, so synchronous
+# callers (the MCP tools) and async ones (FastAPI, the chat loop) share the
+# same connection pool, limits and cache.
+#
+#   python llm_gateway.py      # OpenAI-compatible facade on LLM_GATEWAY_PORT (default 8003)
+
+load_dotenv()
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# Parameters that change the answer, and so belong in the cache key
+KEY_PARAMS = ("temperature", "top_p", "max_tokens", "max_completion_tokens", "seed", "stop",
+              "response_format", "tool_choice", "parallel_tool_calls", "presence_penalty", "frequency_penalty")
+
+
+class LLMError(Exception):
+    """A completion failed for good (after retries, or with a non-retryable status)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "gpt-4.1=4,gpt-4.1-nano=16" into a dict"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        limits[name.strip()] = int(value)
+    return limits
+
+
+class LatencyTracker:
+    """Recent completion latencies of one model, for the hedging deadline"""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        # Too few samples make for a meaningless percentile
+        if len(self.samples) < 20:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class LLMGateway:
+    def __init__(self, base_url: str = "https://api.openai.com/v1", api_key: str = "",
+                 timeout: float = 60.0, max_retries: int = 2, retry_base: float = 0.5, retry_cap: float = 8.0,
+                 default_concurrency: int = 8, model_concurrency: Optional[Dict[str, int]] = None,
+                 hedge: bool = True, hedge_min_delay: float = 1.0,
+                 cache_size: int = 512, cache_ttl: float = 3600.0, max_connections: int = 32):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.default_concurrency = default_concurrency
+        self.model_concurrency = model_concurrency or {}
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_connections = max_connections
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._latency: Dict[str, LatencyTracker] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"requests": 0, "cache_hits": 0, "upstream_calls": 0, "retries": 0,
+                      "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        return cls(
+            base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            api_key=os.getenv("OPENAI_API_KEY", ""),
+            timeout=float(os.getenv("LLM_TIMEOUT", 60)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+            default_concurrency=int(os.getenv("LLM_CONCURRENCY", 8)),
+            model_concurrency=_parse_limits(os.getenv("LLM_MODEL_CONCURRENCY", "")),
+            hedge=os.getenv("LLM_HEDGE", "1") == "1",
+            hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", 1.0)),
+            cache_size=int(os.getenv("LLM_CACHE_SIZE", 512)),
+            cache_ttl=float(os.getenv("LLM_CACHE_TTL", 3600)),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 32)),
+        )
+
+    # -- event loop and connection pool --------------------------------------
+
+    def _ensure_started(self):
+        if self._loop is not None:
+            return
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+            self._client = asyncio.run_coroutine_threadsafe(self._make_client(), loop).result()
+            self._loop = loop
+
+    async def _make_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections, keepalive_expiry=120),
+        )
+
+    def complete(self, **request) -> Dict[str, Any]:
+        """Blocking chat completion. Takes the body of POST /chat/completions, returns the response JSON"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._complete(request, inject_headers()), self._loop).result()
+
+    async def acomplete(self, **request) -> Dict[str, Any]:
+        """complete() for async callers; waits without blocking their event loop"""
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._complete(request, inject_headers()), self._loop)
+        return await asyncio.wrap_future(future)
+
+    # -- cache ---------------------------------------------------------------
+
+    @staticmethod
+    def cacheable(request: Dict[str, Any]) -> bool:
+        """Only requests that should always get the same answer are cached"""
+        return (request.get("temperature") == 0 and not request.get("stream")
+                and request.get("n", 1) == 1 and not request.get("no_cache"))
+
+    @staticmethod
+    def cache_key(request: Dict[str, Any]) -> str:
+        keyed = {"model": request.get("model"), "messages": request.get("messages"),
+                 "tools": request.get("tools")}
+        keyed.update({name: request[name] for name in KEY_PARAMS if name in request})
+        return hashlib.sha256(json.dumps(keyed, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, response = entry
+        if time.time() - stored_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return response
+
+    def _cache_put(self, key: str, response: Dict[str, Any]):
+        self._cache[key] = (time.time(), response)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # -- request path --------------------------------------------------------
+
+    def _slots_for(self, model: str) -> asyncio.Semaphore:
+        if model not in self._slots:
+            self._slots[model] = asyncio.Semaphore(self.model_concurrency.get(model, self.default_concurrency))
+        return self._slots[model]
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """How long to wait before hedging, or None until enough latencies are known"""
+        tracker = self._latency.get(model)
+        p95 = tracker.p95() if tracker else None
+        return None if p95 is None else max(self.hedge_min_delay, p95)
+
+    async def _complete(self, request: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        request = dict(request)
+        cacheable = self.cacheable(request)
+        request.pop("no_cache", None)
+        model = request.get("model", "")
+        self.stats["requests"] += 1
+
+        key = self.cache_key(request) if cacheable else None
+        if key is not None:
+            cached = self._cache_get(key)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                return cached
+
+        with span("llm.chat_completion", {"llm.model": model}, carrier=headers) as llm_span, track_llm(model):
+            response = await self._hedged(model, request, headers)
+            usage = llm_usage_attributes(response)
+            set_attributes(llm_span, usage)
+            record_llm_usage(model, usage.get("llm.tokens.input"), usage.get("llm.tokens.output"))
+
+        if key is not None:
+            self._cache_put(key, response)
+        return response
+
+    async def _hedged(self, model: str, request: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        slots = self._slots_for(model)
+        async with slots:
+            primary = asyncio.ensure_future(self._with_retries(model, request, headers))
+            delay = self.hedge_delay(model) if self.hedge and not request.get("stream") else None
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            # Hedge only with a spare slot, so hedging never queues behind or starves other calls
+            if done or slots.locked():
+                return await primary
+            await slots.acquire()
+            self.stats["hedges"] += 1
+            hedge = asyncio.ensure_future(self._with_retries(model, request, headers))
+            try:
+                pending = {primary, hedge}
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                self.stats["hedge_wins"] += 1
+                            return task.result()
+                # Both failed
+                return primary.result()
+            finally:
+                for task in (primary, hedge):
+                    task.cancel()
+                slots.release()
+
+    async def _with_retries(self, model: str, request: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                self.stats["upstream_calls"] += 1
+                response = await self._client.post("/chat/completions", json=request, headers=headers)
+                if response.status_code < 400:
+                    self._latency.setdefault(model, LatencyTracker()).add(time.perf_counter() - started)
+                    return response.json()
+                error = LLMError(f"LLM request failed with {response.status_code}: {response.text[:200]}",
+                                 response.status_code)
+                retryable = response.status_code in RETRY_STATUSES
+                retry_after = response.headers.get("retry-after")
+            except httpx.TransportError as e:
+                error = LLMError(f"LLM request failed: {e!r}")
+                retryable = True
+
+            await self._backoff(error, retryable, attempt, retry_after)
+            attempt += 1
+
+    async def _backoff(self, error: LLMError, retryable: bool, attempt: int, retry_after: Optional[str]):
+        """Sleep before retry number `attempt` + 1, or raise `error` when out of retries"""
+        if not retryable or attempt >= self.max_retries:
+            self.stats["failures"] += 1
+            raise error
+        # Full jitter, so clients that failed together do not retry together
+        delay = random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, min(self.retry_cap, float(retry_after)))
+            except ValueError:
+                pass
+        self.stats["retries"] += 1
+        print(f"{error} - retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    # -- streaming -----------------------------------------------------------
+
+    async def _stream(self, request: Dict[str, Any], headers: Dict[str, str], emit: Callable[[Any], None]):
+        """
+        Run one streamed completion, passing {"type": "delta", "text"} events to
+        `emit` as they arrive and then {"type": "done", "response"} with the
+        assembled completion. Errors are only retried before the first delta.
+        """
+        request = {key: value for key, value in request.items() if key not in ("stream", "no_cache")}
+        cacheable = self.cacheable(request)
+        model = request.get("model", "")
+        self.stats["requests"] += 1
+
+        key = self.cache_key(request) if cacheable else None
+        cached = self._cache_get(key) if key is not None else None
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            content = message_text(cached)
+            if content:
+                emit({"type": "delta", "text": content})
+            emit({"type": "done", "response": cached})
+            return
+
+        body = {**request, "stream": True, "stream_options": {"include_usage": True}}
+        streamed = False
+
+        def forward(event):
+            nonlocal streamed
+            streamed = True
+            emit(event)
+
+        with span("llm.chat_completion", {"llm.model": model, "llm.stream": True}, carrier=headers) as llm_span, \
+                track_llm(model):
+            async with self._slots_for(model):
+                attempt = 0
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        self.stats["upstream_calls"] += 1
+                        async with self._client.stream("POST", "/chat/completions", json=body, headers=headers) as response:
+                            if response.status_code >= 400:
+                                text = (await response.aread()).decode(errors="replace")
+                                error = LLMError(f"LLM request failed with {response.status_code}: {text[:200]}",
+                                                 response.status_code)
+                                await self._backoff(error, response.status_code in RETRY_STATUSES, attempt,
+                                                    response.headers.get("retry-after"))
+                                attempt += 1
+                                continue
+                            assembled = await self._read_stream(response, forward)
+                            break
+                    except httpx.TransportError as e:
+                        # Once part of the answer went out, a retry would repeat it
+                        await self._backoff(LLMError(f"LLM request failed: {e!r}"), not streamed, attempt, None)
+                        attempt += 1
+            self._latency.setdefault(model, LatencyTracker()).add(time.perf_counter() - started)
+            usage = llm_usage_attributes(assembled)
+            set_attributes(llm_span, usage)
+            record_llm_usage(model, usage.get("llm.tokens.input"), usage.get("llm.tokens.output"))
+
+        if key is not None:
+            self._cache_put(key, assembled)
+        emit({"type": "done", "response": assembled})
+
+    @staticmethod
+    async def _read_stream(response: httpx.Response, emit: Callable[[Any], None]) -> Dict[str, Any]:
+        """Forward content deltas and assemble the full completion from the SSE chunks"""
+        content, tool_calls, finish_reason, usage, model = [], {}, None, None, None
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            model = chunk.get("model", model)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if delta.get("content"):
+                    content.append(delta["content"])
+                    emit({"type": "delta", "text": delta["content"]})
+                # Tool calls arrive in pieces keyed by index; arguments are concatenated
+                for position, call in enumerate(delta.get("tool_calls") or []):
+                    current = tool_calls.setdefault(call.get("index", position),
+                                                    {"id": None, "type": "function",
+                                                     "function": {"name": "", "arguments": ""}})
+                    current["id"] = call.get("id") or current["id"]
+                    function = call.get("function") or {}
+                    current["function"]["name"] += function.get("name") or ""
+                    current["function"]["arguments"] += function.get("arguments") or ""
+                finish_reason = choice.get("finish_reason") or finish_reason
+        message = {"role": "assistant", "content": "".join(content) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        return {"model": model, "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage}
+
+    async def astream(self, **request) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streamed chat completion for async callers. Yields {"type": "delta", "text"}
+        events as the answer is generated, then one {"type": "done", "response"}.
+        """
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(event):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        async def run():
+            try:
+                await self._stream(request, headers, emit)
+            finally:
+                emit(None)
+
+        headers = inject_headers()
+        future = asyncio.run_coroutine_threadsafe(run(), self._loop)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            # Raise the stream's error, if it failed
+            await asyncio.wrap_future(future)
+        finally:
+            future.cancel()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "cached": len(self._cache),
+            "models": {model: {"limit": self.model_concurrency.get(model, self.default_concurrency),
+                               "p95": self._latency[model].p95() if model in self._latency else None}
+                       for model in self._slots},
+        }
+
+
+gateway = LLMGateway.from_env()
+register_stats("llm_gateway", gateway.stats)
+
+
+def message_text(response: Dict[str, Any]) -> str:
+    """The assistant text of a completion response"""
+    return response["choices"][0]["message"].get("content") or ""
+
+
+def create_app():
+    """OpenAI-compatible facade, so non-Python clients share the gateway"""
+    from fastapi import FastAPI, HTTPException, Request
+    import metrics
+    import tracing
+
+    app = FastAPI(title="LLM Gateway")
+    tracing.instrument_app(app, "llm-gateway")
+    metrics.instrument_app(app)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            raise HTTPException(status_code=400, detail="Streaming is not supported by the gateway")
+        try:
+            return await gateway.acomplete(**body)
+        except LLMError as e:
+            raise HTTPException(status_code=e.status_code or 502, detail=str(e))
+
+    @app.get("/status")
+    async def status():
+        return gateway.status()
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+    import tracing
+
+    tracing.init_tracing("llm-gateway")
+    port = int(os.getenv("LLM_GATEWAY_PORT", 8003))
+    # The gateway spends this server's API key, so only listen locally unless told otherwise
+    host = os.getenv("LLM_GATEWAY_HOST", "127.0.0.1")
+    print(f"Starting LLM gateway on {host}:{port}, forwarding to {gateway.base_url}")
+    uvicorn.run(create_app(), host=host, port=port)
@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import re
+import zlib
+from typing import Any, Dict, List, Optional
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.shared.exceptions import McpError
+
+# Pool of MCP client sessions spread over one or more MCP servers (e.g. the
+# workers started by mcp_workers.py). Each session is kept open by its own
+# task, which reconnects with backoff when the connection drops, and every
+# call goes to the connected session with the fewest calls in flight. Calls
+# for a tenant dataset stick to one server, so tenants spread over workers.
+
+# Message ids of emails queued by worker N start with "wN-" (EMAIL_ID_PREFIX)
+_WORKER_TAG = re.compile(r"^w(\d+)-")
+
+
+class PooledSession:
+    def __init__(self, url: str, server_index: int):
+        self.url = url
+        self.server_index = server_index
+        self.session: Optional[ClientSession] = None
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        # Set to make the maintaining task drop the connection and reconnect (or stop)
+        self.broken = asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self.session is not None
+
+
+class MCPSessionPool:
+    def __init__(self, urls: List[str], sessions_per_server: int = 1,
+                 retry_delay: float = 2.0, max_retry_delay: float = 30.0):
+        self.urls = urls
+        self.members = [PooledSession(url, index) for index, url in enumerate(urls)
+                        for _ in range(sessions_per_server)]
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.tools: List[Any] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._round_robin = itertools.count()
+
+    @property
+    def connected(self) -> bool:
+        return any(member.connected for member in self.members)
+
+    async def start(self, wait: float = 15.0) -> bool:
+        """Open all sessions in the background. Returns once one is connected, or after `wait` seconds"""
+        self._tasks = [asyncio.create_task(self._maintain(member)) for member in self.members]
+        deadline = asyncio.get_running_loop().time() + wait
+        while not self.connected and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.1)
+        return self.connected
+
+    async def _maintain(self, member: PooledSession):
+        # The connection is opened and closed inside this one task, as the SSE client requires
+        delay = self.retry_delay
+        while not self._stopping:
+            try:
+                async with sse_client(url=member.url) as (read, write):
+                    async with ClientSession(read, write) as session:
+                        await session.initialize()
+                        tools = (await session.list_tools()).tools
+                        if not self.tools:
+                            self.tools = tools
+                        member.session = session
+                        member.broken.clear()
+                        delay = self.retry_delay
+                        print(f"✅ Connected to MCP server at {member.url}. Found {len(tools)} tools.")
+                        await member.broken.wait()
+            except Exception as e:
+                if not self._stopping:
+                    print(f"❌ MCP connection to {member.url} failed: {str(e)}")
+            finally:
+                member.session = None
+            if not self._stopping:
+                await asyncio.sleep(delay)
+                delay = min(self.max_retry_delay, delay * 2)
+
+    def pick(self, affinity: Optional[int] = None) -> PooledSession:
+        """The least busy connected session, on server `affinity` if that one is connected"""
+        candidates = [m for m in self.members if m.connected]
+        if not candidates:
+            raise ConnectionError("No MCP server connection available")
+        if affinity is not None:
+            candidates = [m for m in candidates if m.server_index == affinity] or candidates
+        # Rotate the starting point so idle sessions share the work evenly
+        offset = next(self._round_robin) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda m: m.in_flight)
+
+    @staticmethod
+    def affinity(arguments: Dict[str, Any]) -> Optional[int]:
+        """Server that owns the state a call refers to (currently: queued emails)"""
+        match = _WORKER_TAG.match(str((arguments or {}).get("message_id", "")))
+        return int(match.group(1)) if match else None
+
+    def dataset_affinity(self, dataset: Optional[str]) -> Optional[int]:
+        """
+        Server that serves a tenant dataset (see dataset_registry.py): always the same
+        one while it is connected, so each worker keeps only its share of tenants in memory
+        """
+        if not dataset or len(self.urls) < 2:
+            return None
+        return zlib.crc32(dataset.encode()) % len(self.urls)
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any], meta: Optional[Dict[str, Any]] = None):
+        affinity = self.affinity(arguments)
+        if affinity is None:
+            # The dataset in _meta is the one the server serves (mcp_server.TenantFastMCP)
+            affinity = self.dataset_affinity((meta or {}).get("dataset"))
+        member = self.pick(affinity)
+        member.in_flight += 1
+        member.calls += 1
+        try:
+            return await member.session.call_tool(name, arguments=arguments, meta=meta)
+        except McpError:
+            # The server answered with an error; the connection itself is fine
+            raise
+        except Exception:
+            member.failures += 1
+            member.broken.set()
+            raise
+        finally:
+            member.in_flight -= 1
+
+    async def close(self):
+        self._stopping = True
+        for member in self.members:
+            member.broken.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [{"url": m.url, "connected": m.connected, "in_flight": m.in_flight,
+                 "calls": m.calls, "failures": m.failures} for m in self.members]
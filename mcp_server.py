@@ -1,13 +1,154 @@
+import functools
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Union
 from mcp.server.fastmcp import FastMCP
-from send_mail import send_email as raw_send_email
-from rag_pipeline import ask_from_csv
+from dataset_versions import DatasetWatcher, manifest_pointer, read_current, read_manifest
+from email_outbox import outbox
+from metrics import register_stats, start_metrics_server, track_tool
+import profiling
+from send_mail import smtp_settings
+from startup import Warmup
+from tracing import init_tracing, span
 
-# Auto open in port 8000
-mcp = FastMCP(
+# rag_pipeline (pandas, the data), timeseries and report_scheduler are imported
+# where they are first used, so the server binds its port right away; the
+# warmup below loads them in the background (see startup.py)
+
+class TenantFastMCP(FastMCP):
+    """
+    FastMCP that takes the tenant dataset from the request _meta only. The
+    bridge puts the caller's X-Dataset there; tool arguments are written by the
+    LLM, so a `dataset` argument naming another tenant is refused rather than
+    letting a prompt read someone else's data.
+    """
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]):
+        arguments = dict(arguments or {})
+        requested = arguments.pop("dataset", None)
+        allowed = (request_trace_context() or {}).get("dataset")
+        if requested and requested != allowed:
+            raise ValueError(f"The dataset argument '{requested}' does not match this request's dataset; "
+                             "the dataset is chosen by the caller (X-Dataset), not the tool arguments")
+        return await super().call_tool(name, arguments)
+
+# Auto open in port 8000 (MCP_PORT; each worker of mcp_workers.py gets its own)
+mcp = TenantFastMCP(
     name="financial-advisor-mcp",
+    port=int(os.getenv("MCP_PORT", 8000)),
 )
 
+init_tracing("mcp_server")
+
+# Outbox and report store counters, served with the tool metrics from the sidecar port
+register_stats("email_outbox", lambda: {**outbox.stats, "pending": outbox.pending_count()}, gauges=["pending"])
+
+def report_store_stats():
+    # A metrics scrape should not be what loads the report scheduler
+    if "report_scheduler" not in sys.modules:
+        return {}
+    from report_scheduler import report_store
+    return {**report_store.stats, "hit_ratio": report_store.hit_ratio()}
+
+register_stats("report_store", report_store_stats, gauges=["hit_ratio"])
+
+def dataset_registry_stats():
+    # Loaded with the first tenant request
+    if "dataset_registry" not in sys.modules:
+        return {}
+    return sys.modules["dataset_registry"].registry.stats
+
+register_stats("dataset_registry", dataset_registry_stats, gauges=["resident", "resident_bytes"])
+
+def quick_answer_stats():
+    # Loaded with the first question (rag_pipeline.ask_from_csv)
+    if "quick_answers" not in sys.modules:
+        return {}
+    return sys.modules["quick_answers"].bypass_stats()
+
+register_stats("quick_answers", quick_answer_stats, gauges=["bypass_ratio"])
+
+def warm_dataset():
+    import rag_pipeline
+    rag_pipeline.current_dataset()
+
+def warm_timeseries():
+    import rag_pipeline
+    import timeseries
+    dataset = rag_pipeline.current_dataset()
+    # Database-backed datasets aggregate in the database (transaction_db.py),
+    # partitioned ones per partition on first use (partitions.py)
+    if dataset["df"] is not None:
+        timeseries.rollups_for(dataset)
+
+def warm_query_indexes():
+    import query_engine
+    import rag_pipeline
+    dataset = rag_pipeline.current_dataset()
+    if dataset["df"] is not None:
+        query_engine.indexes_for(dataset)
+
+def load_dataset_version(path: str):
+    import rag_pipeline
+    return rag_pipeline.load_dataset(path)
+
+def activate_dataset_version(dataset, pointer):
+    import rag_pipeline
+    rag_pipeline.activate_dataset(dataset)
+
+# Started once the server listens; /readyz passes when every step is done
+warmup = (Warmup("mcp_server")
+          .step("dataset", warm_dataset)
+          .step("timeseries_rollups", warm_timeseries)
+          .step("query_indexes", warm_query_indexes)
+          .step("reports", lambda: __import__("report_scheduler")))
+mcp.custom_route("/livez", methods=["GET"], include_in_schema=False)(warmup.livez)
+mcp.custom_route("/readyz", methods=["GET"], include_in_schema=False)(warmup.readyz)
+
+def request_trace_context():
+    """Trace context the caller sent in the MCP request _meta, if any"""
+    try:
+        meta = mcp.get_context().request_context.meta
+    except (LookupError, ValueError):
+        return None
+    return dict(meta.model_extra or {}) if meta is not None else None
+
+def tenant_dataset(dataset_id: Optional[str]):
+    """A tenant's dataset from the registry (loaded on first use), or None for the server's own"""
+    if not dataset_id:
+        return None
+    from dataset_registry import registry
+    return registry.get(dataset_id)
+
+def traced_tool(fn):
+    """
+    Run a tool inside a span that continues the caller's trace, record its
+    metrics and profile, and keep it on one dataset version throughout: the
+    tenant dataset named in the request _meta (the bridge forwards X-Dataset
+    there), else the server's own.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        import rag_pipeline
+        meta = request_trace_context()
+        dataset_id = (meta or {}).get("dataset")
+        try:
+            with span(f"mcp.tool.{fn.__name__}", carrier=meta), track_tool(fn.__name__), \
+                    profiling.profiler.profile(f"mcp_tool-{fn.__name__}"), \
+                    rag_pipeline.pinned_dataset(tenant_dataset(dataset_id)):
+                return fn(*args, **kwargs)
+        finally:
+            if dataset_id:
+                # Rollups and indexes the call built count against the memory budget
+                sys.modules["dataset_registry"].registry.evict()
+    return wrapper
+
+# Turn slow-request profiling on or off at runtime
+mcp.custom_route("/admin/profiling", methods=["GET", "POST"], include_in_schema=False)(profiling.admin_endpoint)
+
 @mcp.tool()
+@traced_tool
 def get_financial_analysis(question: str) -> str:
     """
        Query the Jordan retail transaction data and provide financial analysis
@@ -18,30 +159,136 @@ def get_financial_analysis(question: str) -> str:
        Returns:
            str: The answer with financial analysis based on the transaction data.
        """
+    from rag_pipeline import ask_from_csv
     return ask_from_csv(question)
 
 @mcp.tool()
+@traced_tool
 def send_email(receiver: str, subject: str, body: str) -> str:
     """Send an email to a given recipient with a subject and message"""
-    return raw_send_email(receiver, subject, body)
+    if not smtp_settings()["sender_email"]:
+        return "❌ Error: Sender email or app password not found in environment variables."
+    try:
+        message_id = outbox.enqueue(receiver, subject, body)
+    except ValueError as e:
+        return f"❌ Error: {e}"
+    return f"✅ Email queued for delivery to {receiver} (message id: {message_id}). write the inform to confirm"
 
 @mcp.tool()
+@traced_tool
+def get_email_status(message_id: str) -> str:
+    """Check the delivery status of an email queued with send_email"""
+    status = outbox.status(message_id)
+    if status is None:
+        return f"No email with message id {message_id} was found."
+    return json.dumps(status)
+
+@mcp.tool()
+@traced_tool
 def get_mall_summary() -> str:
     """Get a summary of all mall transaction statistics"""
-    return ask_from_csv("Give me a summary of transactions across all malls")
+    from report_scheduler import mall_summary
+    return mall_summary()
 
 @mcp.tool()
+@traced_tool
 def get_transaction_anomalies() -> str:
     """Identify potential anomalies or unusual patterns in the transaction data"""
+    from rag_pipeline import ask_from_csv
     return ask_from_csv("Identify any unusual transaction patterns or anomalies in the data")
 
 @mcp.tool()
-def generate_monthly_report(month: str) -> str:
-    """Generate a financial performance report for a specific month"""
-    return ask_from_csv(f"Generate a detailed financial report for {month}")
+@traced_tool
+def generate_monthly_report(month: str, branch: str = "") -> str:
+    """Generate a financial performance report for a specific month, optionally for a single branch"""
+    from report_scheduler import monthly_report
+    return monthly_report(month, branch)
+
+@mcp.tool()
+@traced_tool
+def get_time_series(bucket: str = "day", group_by: str = "", start_ms: Optional[int] = None,
+                    end_ms: Optional[int] = None, metrics: str = "count,sum,avg", value: str = "amount",
+                    filters: Optional[Dict[str, str]] = None) -> str:
+    """
+    Transaction counts, sums and averages per time bucket, for charts
+
+    Parameters:
+        bucket (str): minute, hour, day, week or month.
+        group_by (str): Optional series split: mall, branch, status or type.
+        start_ms (int): Optional range start, epoch milliseconds (inclusive).
+        end_ms (int): Optional range end, epoch milliseconds (exclusive).
+        metrics (str): Comma-separated subset of count, sum, avg.
+        value (str): amount (transaction_amount) or tax (tax_amount).
+        filters (dict): Optional exact matches, e.g. {"status": "Completed"}.
+
+    Returns:
+        str: JSON with the series as columns t (bucket start, ms), group and the metrics.
+    """
+    import timeseries
+    return json.dumps(timeseries.time_series(bucket, group_by, start_ms, end_ms, metrics, value, filters),
+                      separators=(",", ":"))
+
+@mcp.tool()
+@traced_tool
+def query_transactions(filters: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]] = None,
+                       group_by: Optional[List[str]] = None, bucket: str = "",
+                       aggregates: Optional[List[str]] = None, order_by: Optional[List[str]] = None,
+                       limit: int = 50) -> str:
+    """
+    Exact counts, sums, averages, minimums and maximums over the transactions, plus
+    approximate percentiles and distinct counts. Prefer this over get_financial_analysis
+    for any numeric question.
+
+    Parameters:
+        filters (list): Conditions that must all hold, each {"field", "op", "value"}.
+            Fields: mall, branch, status, type, amount, tax, date (ISO, e.g. "2025-03-01"),
+            hour (0-23), weekday (0 = Monday), day ("YYYY-MM-DD"), month ("YYYY-MM").
+            Ops: =, !=, in, not_in, <, <=, >, >=, between ([low, high], inclusive).
+            {"status": "Failed"} is shorthand for an = condition.
+        group_by (list): Any of mall, branch, status, type, hour, weekday, day, month.
+        bucket (str): Optional time bucket per row: minute, hour, day, week or month.
+        aggregates (list): "count" and "sum:amount", "avg:tax", "min:amount", "max:amount", ...
+            (default count and sum:amount). Approximate, with "error_bounds" in the result:
+            "median:amount", "p95:amount", "p99:tax", ... (within 1% of the value) and
+            "distinct:id" or "distinct:prefix" (transaction id prefixes, 1.6% standard error).
+            These need whole-day date ranges and no hour, amount or tax conditions.
+        order_by (list): Result columns, "-" first for descending, e.g. ["-sum_amount"].
+        limit (int): Maximum rows returned (default 50).
+
+    Returns:
+        str: JSON with the plan used, the total row count and the result as columns.
+    """
+    import query_engine
+    result = query_engine.run_query({"filters": filters, "group_by": group_by, "bucket": bucket,
+                                     "aggregates": aggregates, "order_by": order_by, "limit": limit})
+    return json.dumps(result, separators=(",", ":"))
 
 if __name__ == "__main__":
-    print("Starting Financial Advisor MCP Server...")
+    print(f"Starting Financial Advisor MCP Server on port {mcp.settings.port}...")
+    # Metrics get their own port so scrapes never queue behind tool calls on the server's event loop
+    start_metrics_server()
+    # In a multi-worker deployment, follow the published dataset version
+    if os.getenv("DATASET_ROOT"):
+        current = read_current(os.getenv("DATASET_ROOT"))
+        if current:
+            # rag_pipeline is not imported yet; its first load (the warmup) reads this version
+            os.environ["TRANSACTIONS_PATH"] = current["path"]
+        DatasetWatcher(load_dataset_version, activate_dataset_version,
+                       root=os.getenv("DATASET_ROOT"),
+                       active_version=current["version"] if current else None).start()
+    elif read_manifest(os.getenv("TRANSACTIONS_PATH", "")):
+        # A partitioned dataset (partitions.py): follow its manifest so ingested rows show up
+        partitioned_path = os.environ["TRANSACTIONS_PATH"]
+        DatasetWatcher(load_dataset_version, activate_dataset_version,
+                       pointer=lambda: manifest_pointer(partitioned_path),
+                       active_version=read_manifest(partitioned_path)["version"]).start()
+    # Deliver any mail left in the spool by a previous run
+    outbox.start()
+    # Pre-generate routine reports during off-peak hours
+    if os.getenv("REPORT_SCHEDULER", "0") == "1":
+        warmup.step("report_scheduler", lambda: __import__("report_scheduler").ReportScheduler().start())
+    # Listen first; the data, rollups and reports load behind /readyz
+    warmup.start()
     mcp.run(transport='sse')
 
 
@@ -0,0 +1,108 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from dataset_versions import DATASET_ROOT, publish, read_current
+
+# Multi-worker deployment of mcp_server.py.
+#
+#   python mcp_workers.py run --workers 4              # workers on ports 8000-8003
+#   python mcp_workers.py publish new_export.csv       # switch every worker to new data
+#
+# Workers do not load their own copy of the data: they memory-map the current
+# version under DATASET_ROOT (see dataset_versions.py), so the pages are shared
+# by all of them and the dataset costs the same memory for 1 worker or 16.
+# Point the bridge at all of them with the MCP_SERVER_URLS line printed on start.
+# Each worker has its own email spool, and only worker 0 runs the report scheduler.
+
+load_dotenv()
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def worker_env(index: int, args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "MCP_WORKER_ID": str(index),
+        "MCP_PORT": str(args.base_port + index),
+        "MCP_METRICS_PORT": str(args.metrics_base_port + index),
+        "DATASET_ROOT": args.dataset_root,
+        "TRANSACTIONS_PATH": read_current(args.dataset_root)["path"],
+        "EMAIL_SPOOL_DIR": os.path.join(os.getenv("EMAIL_SPOOL_DIR", os.path.join(ROOT, "email_spool")),
+                                        f"worker-{index}"),
+        "EMAIL_ID_PREFIX": f"w{index}-",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if index != 0:
+        env["REPORT_SCHEDULER"] = "0"
+    return env
+
+
+def start_worker(index: int, args) -> subprocess.Popen:
+    print(f"Starting MCP worker {index} on port {args.base_port + index}")
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "mcp_server.py")], cwd=ROOT,
+                            env=worker_env(index, args))
+
+
+def run(args):
+    if read_current(args.dataset_root) is None:
+        source = os.getenv("TRANSACTIONS_PATH", os.path.join(ROOT, "pdfs", "jordan_transactions.csv"))
+        print(f"No published dataset in {args.dataset_root}, publishing {source}")
+        publish(source, args.dataset_root, switch_delay=0)
+
+    workers = [start_worker(i, args) for i in range(args.workers)]
+    urls = ",".join(f"http://localhost:{args.base_port + i}/sse" for i in range(args.workers))
+    print(f"\nStart the bridge with:\n  MCP_SERVER_URLS={urls} python next_mcp_server.py\n")
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        # Restart workers that exit unexpectedly
+        while not stopping:
+            for i, worker in enumerate(workers):
+                if worker.poll() is not None:
+                    print(f"MCP worker {i} exited with code {worker.returncode}, restarting")
+                    workers[i] = start_worker(i, args)
+            time.sleep(1)
+    finally:
+        print("Stopping MCP workers...")
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(10)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several MCP server workers over one shared dataset")
+    parser.add_argument("--dataset-root", default=DATASET_ROOT, help="Directory holding published dataset versions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Start the workers")
+    run_parser.add_argument("--workers", type=int, default=int(os.getenv("MCP_WORKERS", os.cpu_count() or 2)))
+    run_parser.add_argument("--base-port", type=int, default=int(os.getenv("MCP_PORT", 8000)))
+    run_parser.add_argument("--metrics-base-port", type=int, default=int(os.getenv("MCP_METRICS_PORT", 9101)))
+
+    publish_parser = commands.add_parser("publish", help="Publish a new dataset version; running workers switch to it together")
+    publish_parser.add_argument("source", help="A transactions CSV or a store directory")
+    publish_parser.add_argument("--switch-delay", type=float, default=None,
+                                help="Seconds until workers switch (default DATASET_SWITCH_DELAY or 5)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        publish(args.source, args.dataset_root, args.switch_delay)
@@ -0,0 +1,154 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Prometheus metrics shared by all services.
+#
+# The FastAPI apps (next_mcp_server, whatsapp_integration) serve them from
+# /metrics; the FastMCP server has no HTTP app of its own, so it serves them
+# from a sidecar port (MCP_METRICS_PORT, default 9101). Component counters
+# that already live in `stats` dicts (dispatcher, outbox, dedup, report store)
+# are exported through register_stats() instead of being duplicated here.
+
+# Latencies range from a cached report (milliseconds) to a slow LLM call (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests handled",
+                        ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency",
+                         ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled")
+
+TOOL_CALLS = Counter("tool_calls_total", "MCP tool calls", ["tool", "status"])
+TOOL_LATENCY = Histogram("tool_call_duration_seconds", "MCP tool call latency",
+                         ["tool"], buckets=LATENCY_BUCKETS)
+TOOL_IN_FLIGHT = Gauge("tool_calls_in_flight", "MCP tool calls in progress", ["tool"])
+
+LLM_REQUESTS = Counter("llm_requests_total", "LLM completions requested", ["model", "status"])
+LLM_LATENCY = Histogram("llm_request_duration_seconds", "LLM completion latency",
+                        ["model"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens used", ["model", "direction"])
+
+ADMISSION_REJECTIONS = Counter("admission_rejections_total", "Requests turned away by admission control",
+                               ["tool", "reason"])
+ADMISSION_QUEUE = Gauge("admission_queue_depth", "Requests waiting for a tool slot", ["tool"])
+ADMISSION_WAIT = Histogram("admission_wait_seconds", "Time spent waiting for a tool slot",
+                           ["tool", "lane"], buckets=LATENCY_BUCKETS)
+
+DATASET_ROWS = Gauge("dataset_rows", "Rows in the loaded transactions dataset")
+DATASET_MEMORY = Gauge("dataset_memory_bytes", "Memory used by the loaded transactions dataset")
+
+
+class StatsCollector:
+    """
+    Export a component's stats dict on every scrape.
+
+    Keys listed in `gauges` are exported as gauges, every other numeric key as
+    a counter (`<prefix>_<key>_total`). Non-numeric values are skipped.
+    """
+
+    def __init__(self, prefix: str, stats: Callable[[], Dict[str, Any]], gauges: Iterable[str] = ()):
+        self.prefix = prefix
+        self.stats = stats
+        self.gauges = set(gauges)
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            if key in self.gauges:
+                yield GaugeMetricFamily(name, f"{self.prefix} {key}", value=value)
+            else:
+                yield CounterMetricFamily(name, f"{self.prefix} {key}", value=value)
+
+
+_registered_stats = set()
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, Any]], gauges: Iterable[str] = ()):
+    """Export a stats dict (or a function returning one) under `prefix`. Registering a prefix twice is a no-op"""
+    if prefix in _registered_stats:
+        return
+    _registered_stats.add(prefix)
+    REGISTRY.register(StatsCollector(prefix, stats if callable(stats) else (lambda: stats), gauges))
+
+
+@contextmanager
+def track_tool(tool: str):
+    """Count and time one tool call"""
+    started = time.perf_counter()
+    TOOL_IN_FLIGHT.labels(tool).inc()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        TOOL_IN_FLIGHT.labels(tool).dec()
+        TOOL_CALLS.labels(tool, status).inc()
+        TOOL_LATENCY.labels(tool).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def track_llm(model: str):
+    """Count and time one LLM completion. Token usage is recorded with record_llm_usage()"""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        LLM_REQUESTS.labels(model, status).inc()
+        LLM_LATENCY.labels(model).observe(time.perf_counter() - started)
+
+
+def record_llm_usage(model: str, input_tokens, output_tokens):
+    if input_tokens:
+        LLM_TOKENS.labels(model, "input").inc(input_tokens)
+    if output_tokens:
+        LLM_TOKENS.labels(model, "output").inc(output_tokens)
+
+
+def record_dataset(df, rows=None):
+    """Update the dataset gauges after a dataset is (re)loaded (df is None for database-backed datasets)"""
+    DATASET_ROWS.set(len(df) if df is not None else rows or 0)
+    DATASET_MEMORY.set(int(df.memory_usage(deep=True).sum()) if df is not None else 0)
+
+
+def instrument_app(app):
+    """Record request metrics for a FastAPI app and serve them from /metrics"""
+    from fastapi import Response
+
+    @app.middleware("http")
+    async def metrics_middleware(request, call_next):
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Label by route template (e.g. /send_test_message/{phone_number}) to keep cardinality bounded
+            route = request.scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            HTTP_REQUESTS.labels(request.method, route, str(status)).inc()
+            HTTP_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server(port: int = None):
+    """Serve /metrics on a sidecar port, for processes without their own HTTP app"""
+    port = port or int(os.getenv("MCP_METRICS_PORT", 9101))
+    start_http_server(port, addr=os.getenv("METRICS_HOST", "0.0.0.0"))
+    print(f"Metrics available at http://localhost:{port}/metrics")
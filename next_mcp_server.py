@@ -2,15 +2,21 @@ import asyncio
 import json
 import os
 import sys
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Query, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from mcp import ClientSession
-from mcp.client.sse import sse_client
-from contextlib import AsyncExitStack
 from dotenv import load_dotenv
 import uvicorn
 import time
+from typing import Optional
+from admission import AdmissionController, AdmissionRejected
+from agent_loop import DEFAULT_SYSTEM_PROMPT, openai_tools, run_agent
+import metrics
+from mcp_pool import MCPSessionPool
+import profiling
+import response_codecs
+from startup import FAST_START, Warmup
+from tracing import inject_headers, instrument_app, set_attributes, span
 
 # Load .env file
 load_dotenv()
@@ -26,82 +32,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MCP server configuration
-mcp_server_url = "http://localhost:8000/sse"
-exit_stack = AsyncExitStack()
-session = None
+# Server span per request, continuing the caller's trace
+instrument_app(app, "next_mcp_server")
+# Request metrics, served from /metrics
+metrics.instrument_app(app)
+
+# MCP server configuration: one URL, or a comma-separated list of workers (see mcp_workers.py)
+mcp_server_urls = [url.strip() for url in os.getenv("MCP_SERVER_URLS", "http://localhost:8000/sse").split(",")
+                   if url.strip()]
+mcp_server_url = mcp_server_urls[0]
+# Upper bound on the tool rounds a /chat request may ask for (max_turns)
+CHAT_MAX_TURNS = int(os.getenv("CHAT_MAX_TURNS", 5))
+
+# Calls are spread over a pool of sessions, SESSIONS_PER_SERVER per MCP server
+session_pool = MCPSessionPool(mcp_server_urls, sessions_per_server=int(os.getenv("SESSIONS_PER_SERVER", 1)))
 is_connected = False
 tool_map = {}
 tool_objects = []
 
+# Per-tool concurrency limits, bounded wait queues and per-client rate limits for /call_tool
+admission = AdmissionController.from_env()
+metrics.register_stats("admission", admission.stats)
+
+# Connection state of the bridge, served with the request metrics
+metrics.register_stats("mcp_bridge", lambda: {"connected": session_pool.connected, "tools": len(tool_map),
+                                              "sessions": sum(m.connected for m in session_pool.members)},
+                       gauges=["connected", "tools", "sessions"])
+
+def connection_ready() -> bool:
+    """Refresh the connection state and tool list from the session pool"""
+    global is_connected, tool_map, tool_objects
+    is_connected = session_pool.connected
+    if is_connected and not tool_objects:
+        tool_objects = session_pool.tools
+        tool_map = {tool.name: "MCP_SERVER" for tool in tool_objects}
+    return is_connected
+
+# /livez answers once uvicorn listens; /readyz once the MCP sessions are up and the codecs warm
+warmup = Warmup("next_mcp_server").check("mcp_connected", connection_ready)
+if response_codecs.HAS_ARROW:
+    warmup.step("arrow", lambda: response_codecs.to_arrow({"warm": [1]}))
+warmup.add_routes(app)
+
 @app.on_event("startup")
 async def startup_event():
-    global session, is_connected, tool_map, tool_objects
-    
-    # Try to connect to the MCP server, with up to 3 retries
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            print(f"Connecting to MCP server at {mcp_server_url} (attempt {attempt+1}/{max_retries})...")
-            sse_transport = await exit_stack.enter_async_context(sse_client(url=mcp_server_url))
-            read, write = sse_transport
-            session = await exit_stack.enter_async_context(ClientSession(read, write))
-            await session.initialize()
-            
-            # Get available tools
-            tools_result = await session.list_tools()
-            tool_map = {tool.name: "MCP_SERVER" for tool in tools_result.tools}
-            tool_objects = tools_result.tools
-            
-            print(f"✅ Connected to MCP server. Found {len(tool_objects)} tools.")
-            is_connected = True
-            break
-        except Exception as e:
-            print(f"❌ Error connecting to MCP server: {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = 2 * (attempt + 1)  # Exponential backoff
-                print(f"Retrying in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
-            else:
-                print("Failed to connect after multiple attempts.")
-                print("Please make sure the original MCP server is running with: python mcp_server.py")
-                is_connected = False
+    warmup.start()
+    # Open the session pool; sessions that cannot connect yet keep retrying in the background
+    print(f"Connecting to MCP server(s) at {', '.join(mcp_server_urls)}...")
+    # In fast-start mode uvicorn listens at once and /readyz reports the connection instead
+    await session_pool.start(wait=0 if FAST_START else 15.0)
+    if not FAST_START and not connection_ready():
+        print("Failed to connect to any MCP server yet, still retrying in the background.")
+        print("Please make sure the original MCP server is running with: python mcp_server.py")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    # Close the MCP connection
-    if hasattr(exit_stack, 'aclose'):
-        await exit_stack.aclose()
+    # Close the MCP connections
+    await session_pool.close()
 
 @app.get("/status")
 async def get_status():
-    if is_connected:
-        return {"status": "connected", "tools_count": len(tool_objects)}
+    if connection_ready():
+        return {"status": "connected", "tools_count": len(tool_objects), "sessions": session_pool.status()}
     else:
         raise HTTPException(status_code=503, detail="MCP server is not connected")
 
 @app.get("/list_tools")
 async def list_tools():
-    if not is_connected:
+    if not connection_ready():
         raise HTTPException(status_code=503, detail="MCP server is not connected")
     
     # Format tools for OpenAI's tool calling format
-    formatted_tools = []
-    for tool in tool_objects:
-        formatted_tools.append({
-            "type": "function",
-            "function": {
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": tool.inputSchema,
-            }
-        })
-    
-    return {"tools": formatted_tools}
+    return {"tools": openai_tools(tool_objects)}
 
 @app.post("/call_tool")
 async def call_tool(request: Request):
-    if not is_connected:
+    if not connection_ready():
         raise HTTPException(status_code=503, detail="MCP server is not connected")
     
     data = await request.json()
@@ -114,13 +120,158 @@ async def call_tool(request: Request):
     if tool_name not in tool_map:
         raise HTTPException(status_code=404, detail=f"Tool '{tool_name}' not found")
     
+    # Identify the caller for rate limiting; interactive chat is served ahead of bulk reports
+    client_id, trusted = request_client(request)
+    lane = admission.lane_for(tool_name, request.headers.get("X-Priority") or data.get("priority"), trusted)
+    
+    result = await run_tool(tool_name, arguments, client_id, lane, request_dataset(request, data))
+    items = [item.model_dump(mode="json", exclude_none=True, by_alias=True) for item in result.content]
+    text = "\n".join(item["text"] for item in items if item.get("type") == "text")
+    # "result" keeps the text for existing clients. Tools that return more than one item, or
+    # non-text items (images, resources), also get them all in "content"
+    payload = {"result": text, "is_error": bool(result.isError)}
+    if len(items) > 1 or any(item.get("type") != "text" for item in items):
+        payload["content"] = items
+    return response_codecs.respond(request, payload, table=tool_table(text, items, bool(result.isError)))
+
+def tool_table(text: str, items: list, is_error: bool = False) -> dict:
+    """
+    What an Arrow response holds: the tool's own columns if it returned columnar JSON, else its
+    content items. is_error goes into the schema metadata so Arrow clients can tell failures apart
+    """
+    if text.startswith("{") and not is_error:
+        try:
+            parsed = json.loads(text)
+            if isinstance(parsed, dict) and isinstance(parsed.get("columns"), dict):
+                return {**parsed, "is_error": False}
+        except ValueError:
+            pass
+    return {"is_error": is_error, "columns": {"type": [item.get("type") for item in items],
+                        "text": [item.get("text") for item in items],
+                        "mime_type": [item.get("mimeType") for item in items],
+                        "data": [item.get("data") for item in items]}}
+
+def result_text(result) -> str:
+    """The text items of a tool result, joined; images and resources are left out"""
+    return "\n".join(item.text for item in result.content if item.type == "text")
+
+def request_client(request: Request):
+    """The caller's rate-limit id and whether it is a trusted service (see admission.py)"""
+    return admission.identify(request.headers, request.client.host if request.client else "unknown")
+
+def request_dataset(request: Request, data: Optional[dict] = None) -> Optional[str]:
+    """The tenant dataset a request asks for: the X-Dataset header, or "dataset" in the body"""
+    return request.headers.get("X-Dataset") or (data or {}).get("dataset") or None
+
+async def run_tool(tool_name: str, arguments: dict, client_id: str, lane: str, dataset: Optional[str] = None):
+    """Call a tool through admission control and the session pool, mapping failures to HTTP errors"""
     try:
-        # Call the tool via MCP
-        result = await session.call_tool(tool_name, arguments=arguments)
-        return {"result": result.content[0].text}
+        async with admission.slot(tool_name, client_id, lane):
+            # Call the tool via MCP, passing the trace context and the tenant dataset in the request _meta
+            meta = inject_headers({"dataset": dataset} if dataset else None)
+            with span("mcp.call_tool", {"mcp.tool": tool_name, "admission.lane": lane}) as current, \
+                    metrics.track_tool(tool_name), profiling.profiler.profile(f"call_tool-{tool_name}"):
+                result = await session_pool.call_tool(tool_name, arguments, meta=meta)
+                set_attributes(current, {"mcp.result_chars": len(result_text(result))})
+        return result
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason,
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calling tool: {str(e)}")
 
+@app.get("/timeseries")
+async def get_timeseries(request: Request, bucket: str = "day", group_by: str = "", start: int = None,
+                         end: int = None, metric_names: str = Query("count,sum,avg", alias="metrics"),
+                         value: str = "amount", mall: str = None, branch: str = None, status: str = None,
+                         transaction_type: str = Query(None, alias="type")):
+    """
+    Chart data straight from the MCP server's rollups, without the LLM.
+    start/end are epoch milliseconds. Returns columnar JSON, or an Arrow IPC
+    stream or MessagePack when the Accept header asks for them (see response_codecs.py).
+    """
+    if not connection_ready():
+        raise HTTPException(status_code=503, detail="MCP server is not connected")
+    filters = {name: label for name, label in (("mall", mall), ("branch", branch), ("status", status),
+                                                ("type", transaction_type)) if label}
+    arguments = {"bucket": bucket, "group_by": group_by, "start_ms": start, "end_ms": end,
+                 "metrics": metric_names, "value": value, "filters": filters or None}
+    client_id, _ = request_client(request)
+    result = await run_tool("get_time_series", arguments, client_id, "interactive", request_dataset(request))
+    text = result_text(result)
+    if result.isError:
+        raise HTTPException(status_code=400, detail=text)
+
+    # The tool already returns compact JSON; JSON responses pass it through without re-encoding
+    series = json.loads(text)
+    return response_codecs.respond(request, series, table=series, json_text=text)
+
+@app.post("/chat")
+async def chat(request: Request):
+    """
+    Run the whole tool-calling chat loop here, next to the MCP sessions, so a
+    chat message costs the client one request. Streams the loop's events
+    (tool calls, answer text, done) as SSE unless the body says "stream": false.
+    """
+    data = await request.json()
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise HTTPException(status_code=400, detail="Invalid request. Messages array is required.")
+    max_turns = data.get("max_turns", 3)
+    if isinstance(max_turns, bool) or not isinstance(max_turns, (int, str)) or not str(max_turns).strip().isdigit():
+        raise HTTPException(status_code=400, detail="Invalid request. max_turns must be a whole number.")
+    max_turns = min(max(int(max_turns), 1), CHAT_MAX_TURNS)
+    messages = [{"role": m.get("role"), "content": m.get("content")} for m in messages
+                if m.get("role") in ("system", "user", "assistant")]
+    if not any(m["role"] == "system" for m in messages):
+        messages.insert(0, {"role": "system", "content": DEFAULT_SYSTEM_PROMPT})
+
+    tools = openai_tools(tool_objects) if connection_ready() else []
+    client_id, _ = request_client(request)
+    dataset = request_dataset(request, data)
+
+    async def call(tool_name, arguments):
+        try:
+            result = await run_tool(tool_name, arguments, client_id, "interactive", dataset)
+        except HTTPException as e:
+            return f"Error calling tool: {e.detail}"
+        return result_text(result)
+
+    # Model completions queue and count against the client's rate limit like tool calls do
+    events = run_agent(messages, tools, call, max_turns=max_turns, stream=data.get("stream", True),
+                       llm_slot=lambda: admission.slot("llm", client_id, "interactive"))
+    if not data.get("stream", True):
+        try:
+            async for event in events:
+                if event["type"] == "done":
+                    return {"response": event["content"], "tokens_saved": event["tokens_saved"]}
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.reason,
+                                headers={"Retry-After": str(e.retry_after)})
+        raise HTTPException(status_code=502, detail="The chat loop ended without an answer")
+
+    async def event_stream():
+        try:
+            async for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+        except AdmissionRejected as e:
+            yield f"data: {json.dumps({'type': 'error', 'error': e.reason, 'retry_after': e.retry_after})}\n\n"
+        except Exception as e:
+            print(f"Error in chat loop: {str(e)}")
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    # No buffering by proxies, so tokens reach the browser as they are generated
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/admission")
+async def get_admission_status():
+    """Admission control counters plus per-tool slots, queue depths and service times"""
+    return admission.status()
+
+# Turn slow-request profiling on or off at runtime
+app.add_route("/admin/profiling", profiling.admin_endpoint, methods=["GET", "POST"], include_in_schema=False)
+
 # SSE endpoint for compatibility with original MCP server
 @app.get("/sse")
 async def sse():
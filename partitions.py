@@ -0,0 +1,382 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataset_versions import MANIFEST_FILE, read_manifest
+from stream_alerts import STATE_FILE, StreamMonitor
+from transaction_store import COLUMN_ORDER, decode_ids, is_store, read_ids, read_store, write_store
+
+# Month-partitioned transaction storage.
+#
+# Almost every question names a month, yet a single store makes every query
+# touch every row. A partitioned dataset is a directory of stores, one per
+# month (and optionally per mall), plus manifest.json:
+#   2025-02.<version>/            a store (see transaction_store.py)
+#   2025-02_y-mall.<version>/     with --by-mall
+#   manifest.json                 {"version", "by_mall", "partitions": [...]}
+# Each manifest entry carries the partition's zone map (min/max date, amount
+# and tax) and its aggregates (rows, sums, and count/amount per mall, branch,
+# status and type), so:
+#   - summary statistics, periods and branch names come from the manifest alone
+#   - queries skip partitions whose month, labels or zone map rule them out
+#   - query results are cached per partition version (query_engine.py), so
+#     new rows invalidate only what was computed from their partition
+#
+# ingest() rewrites only the partitions that receive rows, normally the
+# current month's, and then replaces the manifest in one rename. Closed
+# months are immutable unless explicitly allowed. Servers pointed at the
+# directory (TRANSACTIONS_PATH) follow the manifest version and keep the
+# indexes, rollups and cached results of every partition that did not change.
+# One writer at a time; readers never see a half-written partition.
+# Replaced partitions are kept for PARTITION_RETENTION_SECONDS, so servers
+# still on the previous manifest can open them until their watcher switches,
+# and removed by a later ingest; only directories named like partitions are
+# ever removed.
+# The ingest CLI also runs the new rows through the streaming anomaly
+# detectors (stream_alerts.py), whose state is kept in the dataset directory.
+#
+#   python partitions.py import pdfs/jordan_transactions.csv data/partitioned --by-mall
+#   python partitions.py ingest data/partitioned new_rows.csv
+
+FORMAT_VERSION = 1
+LABEL_COLUMNS = ["mall_name", "branch_name", "transaction_status", "transaction_type"]
+ZONE_COLUMNS = {"amount": "transaction_amount", "tax": "tax_amount"}
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+# How long a replaced partition stays on disk for readers of the previous manifest
+RETENTION_SECONDS = float(os.getenv("PARTITION_RETENTION_SECONDS", 3600))
+# "2025-02.1a2b3c4d", "2025-02_y-mall.1a2b3c4d", and their ".tmp" staging directories
+_PARTITION_NAME = re.compile(r"^\d{4}-\d{2}(_[a-z0-9-]+)?\.[0-9a-f]{8}(\.tmp)?$")
+
+
+def is_partitioned(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def is_closed(month: str, now: Optional[datetime] = None) -> bool:
+    """A month is closed (immutable) once it has ended"""
+    return month < (now or datetime.now()).strftime("%Y-%m")
+
+
+def _slug(label: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", label.lower()).strip("-")
+
+
+def _read_rows(source: str) -> pd.DataFrame:
+    if is_store(source):
+        return read_store(source, mmap=False)
+    df = pd.read_csv(source)
+    df["transaction_date"] = pd.to_datetime(df["transaction_date"], format=DATE_FORMAT)
+    return df
+
+
+def _partition_keys(df: pd.DataFrame, by_mall: bool) -> List[pd.Series]:
+    """(month, mall) of every row; mall is "" unless partitioning by mall"""
+    month = df["transaction_date"].dt.strftime("%Y-%m").rename("month")
+    mall = df["mall_name"].astype(str) if by_mall else pd.Series("", index=df.index)
+    return [month, mall.rename("mall")]
+
+
+def _stats(df: pd.DataFrame) -> Dict[str, Any]:
+    """Zone map and aggregates of one partition"""
+    ns = df["transaction_date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    amount = df["transaction_amount"].to_numpy(dtype=np.float64)
+    labels = {}
+    for column in LABEL_COLUMNS:
+        grouped = pd.DataFrame({"label": df[column].astype(str).to_numpy(), "amount": amount}).groupby("label")
+        counts, sums = grouped.size(), grouped["amount"].sum()
+        labels[column] = {label: [int(counts[label]), float(sums[label])] for label in counts.index}
+    zone = {"date": [int(ns.min()), int(ns.max())]}
+    for name, column in ZONE_COLUMNS.items():
+        values = df[column].to_numpy(dtype=np.float64)
+        zone[name] = [float(values.min()), float(values.max())]
+    return {"rows": len(df), "amount": float(amount.sum()), "tax": float(df["tax_amount"].sum()),
+            "zone": zone, "labels": labels}
+
+
+def _write_partition(root: str, month: str, mall: str, df: pd.DataFrame) -> Dict[str, Any]:
+    version = uuid.uuid4().hex[:8]
+    name = f"{month}_{_slug(mall)}.{version}" if mall else f"{month}.{version}"
+    staging = os.path.join(root, name + ".tmp")
+    write_store(df.sort_values("transaction_date", kind="stable"), staging)
+    os.replace(staging, os.path.join(root, name))
+    return {"month": month, "mall": mall or None, "path": name, "version": version, **_stats(df)}
+
+
+def _write_manifest(root: str, by_mall: bool, partitions: List[Dict[str, Any]],
+                    retired: Optional[Dict[str, float]] = None):
+    partitions = sorted(partitions, key=lambda p: (p["month"], p["mall"] or ""))
+    manifest = {"format_version": FORMAT_VERSION, "version": uuid.uuid4().hex[:12], "by_mall": by_mall,
+                "updated_at": time.time(), "partitions": partitions, "retired": retired or {}}
+    staging = os.path.join(root, MANIFEST_FILE + ".tmp")
+    with open(staging, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(staging, os.path.join(root, MANIFEST_FILE))
+    return manifest
+
+
+def import_partitioned(source: str, root: str, by_mall: bool = False) -> Dict[str, Any]:
+    """Split a transactions CSV (or store) into a new partitioned dataset at `root`"""
+    if os.path.exists(root) and os.listdir(root):
+        raise ValueError(f"{root} is not empty; ingest() adds rows to an existing partitioned dataset")
+    os.makedirs(root, exist_ok=True)
+    df = _read_rows(source)
+    partitions = [_write_partition(root, month, mall, rows)
+                  for (month, mall), rows in df.groupby(_partition_keys(df, by_mall), sort=True)]
+    return _write_manifest(root, by_mall, partitions)
+
+
+def ingest(root: str, rows: pd.DataFrame, allow_closed: bool = False,
+           monitor: Optional[StreamMonitor] = None) -> Dict[str, Any]:
+    """
+    Add transactions (CSV schema, parsed dates) to a partitioned dataset.
+
+    Only the partitions that receive rows are rewritten; rows for a closed
+    month are refused unless `allow_closed`. Once the new manifest is in
+    place, the rows are passed to `monitor` for anomaly alerts. Returns the
+    new manifest.
+    """
+    manifest = read_manifest(root)
+    if manifest is None:
+        raise ValueError(f"{root} is not a partitioned dataset")
+    by_mall = manifest["by_mall"]
+    current = {(p["month"], p["mall"] or ""): p for p in manifest["partitions"]}
+    keys = _partition_keys(rows, by_mall)
+    closed = sorted(m for m in keys[0].unique() if is_closed(m))
+    if closed and not allow_closed:
+        raise ValueError(f"Months {', '.join(closed)} are closed; pass allow_closed to rewrite them")
+
+    # Partitions replaced by this or earlier ingests, with when; removed once past the retention
+    retired = _collect_retired(root, manifest)
+    for (month, mall), new_rows in rows.groupby(keys, sort=True):
+        old = current.get((month, mall))
+        if old is not None:
+            new_rows = pd.concat([read_store(os.path.join(root, old["path"]), mmap=False),
+                                  new_rows[COLUMN_ORDER]], ignore_index=True)
+            retired[old["path"]] = time.time()
+        current[(month, mall)] = _write_partition(root, month, mall, new_rows)
+    manifest = _write_manifest(root, by_mall, list(current.values()), retired)
+    if monitor is not None:
+        monitor.observe(rows)
+    return manifest
+
+
+def _collect_retired(root: str, manifest: Dict[str, Any], now: Optional[float] = None) -> Dict[str, float]:
+    """
+    Delete partitions replaced more than RETENTION_SECONDS ago and return the
+    ones still kept. Only directories named like partitions are touched; one
+    no manifest mentions (a crashed write) counts from its modification time.
+    On Windows a mapped partition cannot be removed and is retried next time.
+    """
+    now = now or time.time()
+    listed = {p["path"] for p in manifest["partitions"]}
+    retired = dict(manifest.get("retired", {}))
+    kept = {}
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in listed or not _PARTITION_NAME.match(name) or not os.path.isdir(path):
+            continue
+        since = retired.get(name, os.path.getmtime(path))
+        if now - since < RETENTION_SECONDS:
+            kept[name] = since
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path):
+            kept[name] = since
+    return kept
+
+
+# Opened partitions, shared by every manifest version that still lists them, so
+# an ingest keeps the indexes and rollups other partitions already built
+_open: Dict[str, Dict[str, Any]] = {}
+_open_lock = threading.Lock()
+
+
+class PartitionedStore:
+    """
+    Read access to a partitioned dataset (one manifest version).
+
+    Offers the same methods rag_pipeline uses on a TransactionDB: row_count,
+    branch_names, periods, summary_statistics and sample.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.manifest = read_manifest(self.root)
+        if self.manifest is None:
+            raise ValueError(f"{root} is not a partitioned dataset")
+        self.version = self.manifest["version"]
+        self.partitions = self.manifest["partitions"]
+        listed = {os.path.join(self.root, p["path"]) for p in self.partitions}
+        with _open_lock:
+            for path in [path for path in _open if os.path.dirname(path) == self.root and path not in listed]:
+                del _open[path]
+
+    def dataset(self, partition: Dict[str, Any]) -> Dict[str, Any]:
+        """One partition as a rag_pipeline-style dataset, memory-mapped on first use"""
+        path = os.path.join(self.root, partition["path"])
+        with _open_lock:
+            if path not in _open:
+                _open[path] = {
+                    "path": path,
+                    "df": read_store(path, columns=[c for c in COLUMN_ORDER if c != "transaction_id"]),
+                    "db": None, "partitions": None,
+                    "ids": read_ids(path),
+                    "rows": partition["rows"],
+                    "version": partition["version"],
+                    "branch_names": sorted(partition["labels"]["branch_name"]),
+                }
+            return _open[path]
+
+    def prune(self, start_ns: Optional[int] = None, end_ns: Optional[int] = None,
+              labels: Optional[Dict[str, Set[str]]] = None, months: Optional[Set[str]] = None,
+              month_numbers: Optional[Set[int]] = None,
+              ranges: Optional[Dict[str, Tuple[float, float]]] = None) -> List[Dict[str, Any]]:
+        """
+        Partitions that can hold rows matching every constraint: a date range
+        [start_ns, end_ns), allowed labels per column, 'YYYY-MM' months, month
+        numbers, and value ranges (lo, hi) of amount/tax
+        """
+        kept = []
+        for p in self.partitions:
+            first, last = p["zone"]["date"]
+            if (start_ns is not None and last < start_ns) or (end_ns is not None and first >= end_ns):
+                continue
+            if months is not None and p["month"] not in months:
+                continue
+            if month_numbers is not None and int(p["month"][5:7]) not in month_numbers:
+                continue
+            if any(not allowed & p["labels"][column].keys() for column, allowed in (labels or {}).items()):
+                continue
+            if any(hi < p["zone"][name][0] or lo > p["zone"][name][1] for name, (lo, hi) in (ranges or {}).items()):
+                continue
+            kept.append(p)
+        return kept
+
+    @staticmethod
+    def covers(partition: Dict[str, Any], start_ns: Optional[int], end_ns: Optional[int]) -> bool:
+        """Whether every row of the partition lies in [start_ns, end_ns)"""
+        first, last = partition["zone"]["date"]
+        return (start_ns is None or first >= start_ns) and (end_ns is None or last < end_ns)
+
+    def month_version(self, month: str) -> str:
+        """Changes only when a partition of `month` changes"""
+        versions = [p["version"] for p in self.partitions if p["month"] == month]
+        if not versions:
+            return self.version
+        return hashlib.sha1(",".join(versions).encode()).hexdigest()[:12]
+
+    # -- TransactionDB interface (rag_pipeline.py) --
+
+    def row_count(self) -> int:
+        return sum(p["rows"] for p in self.partitions)
+
+    def branch_names(self) -> List[str]:
+        return sorted({b for p in self.partitions for b in p["labels"]["branch_name"]})
+
+    def periods(self) -> List[str]:
+        return sorted({p["month"] for p in self.partitions})
+
+    def summary_statistics(self) -> Dict[str, Any]:
+        """rag_pipeline's summary statistics, from the manifest without reading any rows"""
+        totals = {column: {} for column in LABEL_COLUMNS}
+        months = {}
+        for p in self.partitions:
+            for column in LABEL_COLUMNS:
+                for label, (count, amount) in p["labels"][column].items():
+                    current = totals[column].setdefault(label, [0, 0.0])
+                    current[0] += count
+                    current[1] += amount
+            month = int(p["month"][5:7])
+            months[month] = months.get(month, 0) + p["rows"]
+
+        def counts(column):
+            # Most frequent first, as pandas value_counts orders them
+            return {k: v[0] for k, v in sorted(totals[column].items(), key=lambda kv: (-kv[1][0], kv[0]))}
+
+        return {
+            "transactions_by_mall": counts("mall_name"),
+            # Rounded past the cents, so summation order (float noise) does not show
+            "total_amount_by_mall": {k: round(v[1], 6) for k, v in sorted(totals["mall_name"].items())},
+            "transaction_status_distribution": counts("transaction_status"),
+            "transaction_types": counts("transaction_type"),
+            "transactions_by_month": {f"Month {m}": n for m, n in sorted(months.items())},
+        }
+
+    def sample(self, conditions: List[Tuple[str, Any]], limit: int = 20, seed: int = 0) -> pd.DataFrame:
+        """
+        Up to `limit` random rows matching every (column, value) condition ("month" matches
+        the month number); the same seed picks the same rows
+        """
+        labels, month_numbers = {}, None
+        for column, value in conditions:
+            if column == "month":
+                month_numbers = {value} if month_numbers is None else month_numbers & {value}
+            else:
+                labels[column] = labels[column] & {value} if column in labels else {value}
+        matches = []
+        for p in self.prune(labels=labels, month_numbers=month_numbers):
+            part = self.dataset(p)
+            df = part["df"]
+            mask = np.ones(len(df), dtype=bool)
+            for column, value in conditions:
+                if column == "month":
+                    mask &= df["transaction_date"].dt.month.to_numpy() == value
+                else:
+                    mask &= (df[column] == value).to_numpy()
+            positions = np.flatnonzero(mask)
+            if len(positions):
+                matches.append((part, positions))
+
+        total = sum(len(positions) for _, positions in matches)
+        rng = np.random.default_rng(seed)
+        chosen = np.sort(rng.choice(total, size=min(limit, total), replace=False)) if total else []
+        frames, offset = [], 0
+        for part, positions in matches:
+            picked = positions[[i - offset for i in chosen if offset <= i < offset + len(positions)]]
+            offset += len(positions)
+            if len(picked):
+                rows = part["df"].iloc[picked].reset_index(drop=True)
+                rows.insert(0, "transaction_id", decode_ids(part["ids"], picked))
+                frames.append(rows.astype({c: str for c in LABEL_COLUMNS}))
+        if not frames:
+            return pd.DataFrame(columns=COLUMN_ORDER)
+        return pd.concat(frames, ignore_index=True)[COLUMN_ORDER]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Month-partitioned storage for the transactions dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Split a CSV (or store) into a new partitioned dataset")
+    import_parser.add_argument("source", help="Transactions CSV or store directory")
+    import_parser.add_argument("root", help="New directory for the partitioned dataset")
+    import_parser.add_argument("--by-mall", action="store_true", help="Partition by mall as well as month")
+    ingest_parser = commands.add_parser("ingest", help="Add the rows of a CSV to a partitioned dataset")
+    ingest_parser.add_argument("root", help="Partitioned dataset directory")
+    ingest_parser.add_argument("source", help="CSV (or store) with the new transactions")
+    ingest_parser.add_argument("--allow-closed", action="store_true", help="Also accept rows for closed months")
+    ingest_parser.add_argument("--no-alerts", action="store_true", help="Skip the streaming anomaly detectors")
+    args = parser.parse_args()
+
+    started = time.time()
+    if args.command == "import":
+        manifest = import_partitioned(args.source, args.root, by_mall=args.by_mall)
+    else:
+        monitor = None if args.no_alerts else StreamMonitor(state_path=os.path.join(args.root, STATE_FILE))
+        manifest = ingest(args.root, _read_rows(args.source), allow_closed=args.allow_closed, monitor=monitor)
+        if monitor is not None:
+            monitor.flush()
+            print(f"{monitor.stats['alerts']} alerts raised")
+    rows = sum(p["rows"] for p in manifest["partitions"])
+    print(f"{args.root}: {len(manifest['partitions'])} partitions, {rows:,} rows, "
+          f"version {manifest['version']} ({time.time() - started:.1f}s)")
@@ -0,0 +1,292 @@
+import contextvars
+import functools
+import glob
+import heapq
+import hmac
+import inspect
+import json
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Opt-in profiling of slow requests.
+#
+# Switch on with PROFILING_ENABLED=1 or at runtime through /admin/profiling
+# (POST needs ADMIN_TOKEN to be set and sent as X-Admin-Token). While enabled, each sampled request is
+# profiled (pyinstrument if installed, cProfile otherwise) and the profile is
+# kept only if the request is among the slowest PROFILE_KEEP seen so far, so the
+# directory never holds more than PROFILE_KEEP profiles. pyinstrument output is
+# speedscope JSON (open at https://www.speedscope.app); cProfile output is a
+# .prof file for snakeviz or flameprof. With PROFILE_MEMORY=1, tracemalloc also
+# records peak memory and the top allocation sites of the pandas steps in
+# rag_pipeline, written next to the profile as .memory.json.
+# When disabled, the hooks cost one flag check per request.
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # fall back to cProfile
+    _Pyinstrument = None
+
+# Allocation records of the request being profiled, if any
+_current_sample: contextvars.ContextVar = contextvars.ContextVar("profiling_sample", default=None)
+
+_PROFILE_NAME = re.compile(r"^(\d+)ms-")
+
+# Allocations made by the profilers themselves are left out of the memory reports
+_IGNORED_ALLOCATION_SITES = (tracemalloc.__file__, "pyinstrument", "<frozen importlib")
+
+
+class SlowRequestProfiler:
+    """Keep profiles of the slowest requests in a directory with bounded retention"""
+
+    def __init__(self, directory: str = None, keep: int = None, min_seconds: float = None,
+                 sample_rate: float = None, memory: bool = None, enabled: bool = None):
+        self.directory = directory or os.getenv("PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+        self.keep = keep if keep is not None else int(os.getenv("PROFILE_KEEP", 20))
+        self.min_seconds = min_seconds if min_seconds is not None else float(os.getenv("PROFILE_MIN_SECONDS", 1.0))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("PROFILE_SAMPLE_RATE", 1.0))
+        self.memory = memory if memory is not None else os.getenv("PROFILE_MEMORY", "0") == "1"
+        self.enabled = False
+        self._lock = threading.Lock()
+        # cProfile can only run one profile per interpreter at a time
+        self._cprofile_lock = threading.Lock()
+        # Min-heap of (duration, file stem) for the profiles currently kept
+        self._kept = []
+        self.stats = {"profiled": 0, "kept": 0, "skipped_busy": 0}
+        if enabled is None:
+            enabled = os.getenv("PROFILING_ENABLED", "0") == "1"
+        if enabled:
+            self.configure(enabled=True)
+
+    def configure(self, enabled: Optional[bool] = None, keep: Optional[int] = None,
+                  min_seconds: Optional[float] = None, sample_rate: Optional[float] = None,
+                  memory: Optional[bool] = None):
+        """Change settings at runtime, e.g. from the admin endpoint"""
+        with self._lock:
+            if keep is not None:
+                self.keep = max(1, int(keep))
+            if min_seconds is not None:
+                self.min_seconds = float(min_seconds)
+            if sample_rate is not None:
+                self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+            if memory is not None:
+                self.memory = _flag(memory, "memory")
+            if enabled is not None:
+                self.enabled = _flag(enabled, "enabled")
+            if self.enabled:
+                os.makedirs(self.directory, exist_ok=True)
+                self._load_kept()
+            # tracemalloc slows every allocation down, so it only runs while needed
+            if self.enabled and self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif not (self.enabled and self.memory) and tracemalloc.is_tracing():
+                tracemalloc.stop()
+        print(f"Profiling {'enabled' if self.enabled else 'disabled'} "
+              f"(keep {self.keep} slowest over {self.min_seconds}s, memory={self.memory})")
+
+    def _load_kept(self):
+        """Pick up profiles written by an earlier run so retention covers them too"""
+        kept = {}
+        for path in glob.glob(os.path.join(self.directory, "*ms-*")):
+            stem = os.path.basename(path).split(".")[0]
+            match = _PROFILE_NAME.match(stem)
+            if match:
+                kept[stem] = int(match.group(1)) / 1000
+        self._kept = [(duration, stem) for stem, duration in kept.items()]
+        heapq.heapify(self._kept)
+        self._trim()
+
+    def _trim(self):
+        while len(self._kept) > self.keep:
+            _, stem = heapq.heappop(self._kept)
+            for path in glob.glob(os.path.join(self.directory, stem + ".*")):
+                os.remove(path)
+
+    def _should_keep(self, duration: float) -> bool:
+        if duration < self.min_seconds:
+            return False
+        return len(self._kept) < self.keep or duration > self._kept[0][0]
+
+    @contextmanager
+    def profile(self, label: str):
+        """Profile the enclosed request; the profile is kept if it is among the slowest"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+
+        if _Pyinstrument is not None:
+            profiler = _Pyinstrument(interval=0.001, async_mode="enabled")
+        elif self._cprofile_lock.acquire(blocking=False):
+            import cProfile
+            profiler = cProfile.Profile()
+        else:
+            self.stats["skipped_busy"] += 1
+            yield
+            return
+
+        sample = {"label": label, "allocations": []}
+        token = _current_sample.set(sample)
+        started = time.perf_counter()
+        if _Pyinstrument is None:
+            profiler.enable()
+        else:
+            profiler.start()
+        try:
+            yield
+        finally:
+            if _Pyinstrument is None:
+                profiler.disable()
+                self._cprofile_lock.release()
+            else:
+                profiler.stop()
+            duration = time.perf_counter() - started
+            _current_sample.reset(token)
+            self.stats["profiled"] += 1
+            with self._lock:
+                if self._should_keep(duration):
+                    self._write(profiler, sample, duration)
+
+    def _write(self, profiler, sample: Dict[str, Any], duration: float):
+        safe_label = re.sub(r"[^A-Za-z0-9_-]+", "_", sample["label"])[:80]
+        stem = f"{int(duration * 1000):07d}ms-{datetime.now():%Y%m%d-%H%M%S-%f}-{safe_label}"
+        base = os.path.join(self.directory, stem)
+        if _Pyinstrument is not None:
+            with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+                f.write(profiler.output(SpeedscopeRenderer()))
+        else:
+            profiler.dump_stats(base + ".prof")
+        if sample["allocations"]:
+            with open(base + ".memory.json", "w", encoding="utf-8") as f:
+                json.dump({"label": sample["label"], "duration_seconds": round(duration, 4),
+                           "allocations": sample["allocations"]}, f, indent=2)
+        heapq.heappush(self._kept, (duration, stem))
+        self.stats["kept"] += 1
+        self._trim()
+        print(f"Profiled slow request {sample['label']} ({duration:.2f}s) -> {base}")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "profiler": "pyinstrument" if _Pyinstrument is not None else "cProfile",
+            "directory": self.directory,
+            "keep": self.keep,
+            "min_seconds": self.min_seconds,
+            "sample_rate": self.sample_rate,
+            "memory": self.memory,
+            "stats": dict(self.stats),
+            "slowest": [{"seconds": duration, "profile": stem}
+                        for duration, stem in sorted(self._kept, reverse=True)],
+        }
+
+
+@contextmanager
+def track_allocations(name: str, top: int = 10):
+    """Record peak memory and top allocation sites of a step, when the current request is being profiled"""
+    sample = _current_sample.get()
+    if sample is None or not tracemalloc.is_tracing():
+        yield
+        return
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    started_size, _ = tracemalloc.get_traced_memory()
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        diff = [stat for stat in tracemalloc.take_snapshot().compare_to(before, "lineno")
+                if not any(site in stat.traceback[0].filename for site in _IGNORED_ALLOCATION_SITES)]
+        sample["allocations"].append({
+            "step": name,
+            "peak_bytes_above_start": peak - started_size,
+            "top": [{"site": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                    for stat in diff[:top]],
+        })
+
+
+def allocations_traced(name: str):
+    """Decorator form of track_allocations"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track_allocations(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled(label: str):
+    """Decorator profiling a sync or async function with the module profiler"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with profiler.profile(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profiler.profile(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _flag(value, name: str) -> bool:
+    """A boolean setting given as a bool, 0/1 or a string such as true/false"""
+    if isinstance(value, str):
+        value = value.strip().lower()
+    if value in (True, 1, "1", "true", "yes", "on"):
+        return True
+    if value in (False, 0, "0", "false", "no", "off"):
+        return False
+    raise ValueError(f"{name} must be true or false, not {value!r}")
+
+
+async def admin_endpoint(request):
+    """
+    GET returns the profiler status; POST changes its settings, e.g.
+    {"enabled": true, "keep": 20, "min_seconds": 2, "sample_rate": 0.5, "memory": true}.
+    Mounted at /admin/profiling by the servers.
+    """
+    from starlette.responses import JSONResponse
+
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if admin_token and not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+        return JSONResponse({"error": "Invalid or missing X-Admin-Token"}, status_code=401)
+    if request.method == "POST":
+        # Changing settings (tracemalloc slows the whole process) needs a configured token
+        if not admin_token:
+            return JSONResponse({"error": "Set ADMIN_TOKEN to change profiler settings"}, status_code=403)
+        try:
+            settings = await request.json()
+        except ValueError:
+            return JSONResponse({"error": "Body must be JSON"}, status_code=400)
+        if not isinstance(settings, dict):
+            return JSONResponse({"error": "Body must be a JSON object"}, status_code=400)
+        allowed = {"enabled", "keep", "min_seconds", "sample_rate", "memory"}
+        unknown = set(settings) - allowed
+        if unknown:
+            return JSONResponse({"error": f"Unknown settings: {sorted(unknown)}"}, status_code=400)
+        try:
+            for name in ("enabled", "memory"):
+                if settings.get(name) is not None:
+                    settings[name] = _flag(settings[name], name)
+            for name, cast in (("keep", int), ("min_seconds", float), ("sample_rate", float)):
+                if settings.get(name) is not None:
+                    settings[name] = cast(settings[name])
+        except (TypeError, ValueError) as e:
+            return JSONResponse({"error": f"Invalid setting: {e}"}, status_code=400)
+        profiler.configure(**settings)
+    return JSONResponse(profiler.status())
+
+
+# One profiler per process
+profiler = SlowRequestProfiler()
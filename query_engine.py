@@ -0,0 +1,752 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import rag_pipeline
+from sketches import DISTINCT_FIELDS, REDUCE, distinct_counts, error_bound, quantiles, sketches_for
+from timeseries import BUCKETS, DIMENSIONS, VALUES, bucket_start, rollups_for
+from tracing import set_attributes, span
+
+# Structured queries over the transactions, for the query_transactions tool.
+#
+# A query is JSON:
+#   {"filters": [{"field": "status", "op": "=", "value": "Failed"},
+#                {"field": "hour", "op": "between", "value": [14, 16]}],
+#    "group_by": ["branch"], "bucket": "month",
+#    "aggregates": ["count", "sum:amount"], "order_by": ["-sum_amount"], "limit": 10}
+#
+# Fields: mall, branch, status, type (labels); amount, tax (numbers); date
+# (ISO timestamp, filters only); hour (0-23), weekday (0 = Monday), day
+# ("YYYY-MM-DD") and month ("YYYY-MM"), derived from the transaction date.
+# Aggregates: count, and sum/avg/min/max of amount or tax. Approximate ones,
+# answered from the daily sketches (sketches.py) with their error bound in the
+# response: median and pNN (p90, p99.5, ...) of amount or tax, within 1% of the
+# value, and distinct:id / distinct:prefix, within 1.6% standard error. Their
+# filters and groups must resolve to whole days (no amount/tax or hour filters).
+#
+# The planner picks the cheapest exact way to answer:
+#   rollup  the time-series rollups (timeseries.py) when every filter and group
+#           is a label, a minute-aligned date range or a time part the rollup's
+#           bucket resolves, and the aggregates are counts, sums or averages
+#   index   otherwise a scan of only the rows a date range or label filter
+#           selects, found through per-dataset indexes built on first use
+#   scan    a vectorized scan of every row when no index narrows it enough
+#   sql     for a database-backed dataset (transaction_db.py), one GROUP BY
+#           that the database plans with its own indexes
+#   partitions  for a month-partitioned dataset (partitions.py), each partition
+#           the date range, months, labels and zone maps leave is answered as
+#           above and the partial results are merged. Partials are cached per
+#           partition version, so a repeated query only recomputes partitions
+#           that ingestion changed (QUERY_PARTITION_CACHE_ENTRIES)
+# Scans are bounded by QUERY_MAX_SCAN_ROWS and QUERY_TIMEOUT_SECONDS.
+
+MEASURES = VALUES
+TIME_PARTS = ["hour", "weekday", "day", "month"]
+GROUP_FIELDS = [*DIMENSIONS, *TIME_PARTS]
+FILTER_FIELDS = [*DIMENSIONS, *MEASURES, "date", *TIME_PARTS]
+AGGREGATES = ["count", "sum", "avg", "min", "max", "median", "distinct"]
+# Percentiles, p0 to p99.9...
+_PERCENTILE = re.compile(r"p(\d{1,2}(\.\d+)?)")
+OPS = ["=", "!=", "in", "not_in", "<", "<=", ">", ">=", "between"]
+_OP_ALIASES = {"==": "=", "eq": "=", "ne": "!=", "<>": "!=", "not in": "not_in", "nin": "not_in",
+               "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+MAX_SCAN_ROWS = int(float(os.getenv("QUERY_MAX_SCAN_ROWS", "5e7")))
+TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", 10))
+DEFAULT_LIMIT = int(os.getenv("QUERY_DEFAULT_LIMIT", 50))
+MAX_LIMIT = int(os.getenv("QUERY_MAX_LIMIT", 1000))
+# An index is only worth its gather when it keeps less than this share of the rows
+INDEX_MAX_SELECTIVITY = float(os.getenv("QUERY_INDEX_MAX_SELECTIVITY", 0.5))
+PARTITION_CACHE_ENTRIES = int(os.getenv("QUERY_PARTITION_CACHE_ENTRIES", 4096))
+
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+# The rollup buckets a time requirement can be computed from (nested inside it)
+_RESOLVES = {"minute": {"minute"}, "hour": {"minute", "hour"}, "day": {"minute", "hour", "day"},
+             "week": {"minute", "hour", "day", "week"}, "month": {"minute", "hour", "day", "month"}}
+_PART_GRANULARITY = {"hour": "hour", "weekday": "day", "day": "day", "month": "month"}
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+# ---- parsing ----
+
+def _op(op: str) -> str:
+    op = _OP_ALIASES.get(str(op).strip().lower(), str(op).strip().lower())
+    if op not in OPS:
+        raise ValueError(f"Unknown op '{op}', use one of: {', '.join(OPS)}")
+    return op
+
+
+def _time_value(value, upper: bool = False) -> int:
+    """
+    An ISO date or timestamp as epoch ns. As an upper bound it is the end of the
+    day (a bare date) or of the minute (a timestamp), the data's resolution
+    """
+    try:
+        ts = pd.Timestamp(str(value))
+    except ValueError:
+        raise ValueError(f"Cannot read '{value}' as a date; use ISO format like 2025-03-01 or 2025-03-01T14:30")
+    ns = ts.tz_localize(None).value if ts.tzinfo else ts.value
+    if upper and len(str(value)) <= 10:
+        ns += NS_PER_DAY
+    elif upper:
+        ns += NS_PER_MINUTE - ns % NS_PER_MINUTE
+    return ns
+
+
+def _part_value(field: str, value):
+    if field == "weekday" and isinstance(value, str):
+        if value.strip().lower()[:3] not in [d[:3] for d in WEEKDAYS]:
+            raise ValueError(f"Unknown weekday '{value}'")
+        return [d[:3] for d in WEEKDAYS].index(value.strip().lower()[:3])
+    if field in ("hour", "weekday"):
+        return int(value)
+    if field == "month":
+        return str(value)[:7]
+    return str(value)[:10]
+
+
+def _filters(raw) -> List[Dict[str, Any]]:
+    if isinstance(raw, dict):
+        # Shorthand: {"status": "Failed", "branch": ["A", "B"]}
+        raw = [{"field": k, "op": "in" if isinstance(v, list) else "=", "value": v} for k, v in raw.items()]
+    filters = []
+    for condition in raw or []:
+        field, op, value = condition.get("field"), _op(condition.get("op", "=")), condition.get("value")
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter field '{field}', use one of: {', '.join(FILTER_FIELDS)}")
+        values = value if isinstance(value, list) else [value]
+        if op == "between" and len(values) != 2:
+            raise ValueError(f"'between' on {field} needs a [low, high] pair")
+        if op in ("in", "not_in", "between") and not values:
+            raise ValueError(f"'{op}' on {field} needs a list of values")
+        if field == "date":
+            if op in ("!=", "in", "not_in"):
+                raise ValueError("date filters support =, <, <=, >, >= and between")
+        elif field in TIME_PARTS:
+            values = [_part_value(field, v) for v in values]
+        elif field in MEASURES:
+            values = [float(v) for v in values]
+        else:
+            if op in ("<", "<=", ">", ">=", "between"):
+                raise ValueError(f"{field} is a label and supports =, !=, in and not_in")
+            values = [str(v) for v in values]
+        filters.append({"field": field, "op": op, "values": values})
+    return filters
+
+
+def _aggregates(raw) -> List[Tuple[str, Optional[str]]]:
+    aggregates = []
+    for item in raw or ["count", "sum:amount"]:
+        if isinstance(item, dict):
+            fn, field = item.get("fn"), item.get("field")
+        else:
+            fn, _, field = str(item).partition(":")
+        fn, field = fn.strip().lower(), (field or "").strip().lower() or None
+        if fn not in AGGREGATES and not _PERCENTILE.fullmatch(fn):
+            raise ValueError(f"Unknown aggregate '{fn}', use one of: {', '.join(AGGREGATES)}, or pNN like p95")
+        if fn == "count":
+            field = None
+        elif fn == "distinct":
+            if field not in DISTINCT_FIELDS:
+                raise ValueError(f"distinct needs a field: {', '.join(f'distinct:{f}' for f in DISTINCT_FIELDS)}")
+        elif field not in MEASURES:
+            raise ValueError(f"{fn} needs a field: {', '.join(f'{fn}:{m}' for m in MEASURES)}")
+        if (fn, field) not in aggregates:
+            aggregates.append((fn, field))
+    return aggregates
+
+
+def aggregate_name(fn: str, field: Optional[str]) -> str:
+    return fn if field is None else f"{fn}_{field}"
+
+
+def is_sketched(fn: str) -> bool:
+    """Whether an aggregate is answered approximately from the sketches"""
+    return fn in ("median", "distinct") or bool(_PERCENTILE.fullmatch(fn))
+
+
+def percentile(fn: str) -> float:
+    return 0.5 if fn == "median" else float(fn[1:]) / 100
+
+
+def parse_query(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a query and bring it into one canonical form; raises ValueError with what to fix"""
+    group_by = query.get("group_by") or []
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+    # A field named twice groups the same as once
+    group_by = list(dict.fromkeys(group_by))
+    for field in group_by:
+        if field not in GROUP_FIELDS:
+            raise ValueError(f"Unknown group_by field '{field}', use one of: {', '.join(GROUP_FIELDS)}")
+    bucket = query.get("bucket") or None
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', use one of: {', '.join(BUCKETS)}")
+    aggregates = _aggregates(query.get("aggregates"))
+    keys = (["bucket"] if bucket else []) + group_by
+    outputs = keys + [aggregate_name(fn, field) for fn, field in aggregates]
+
+    order_by = query.get("order_by") or []
+    order_by = [order_by] if isinstance(order_by, str) else list(order_by)
+    order = []
+    for item in order_by:
+        name, descending = (item.get("field"), bool(item.get("desc"))) if isinstance(item, dict) \
+            else (str(item).lstrip("-"), str(item).startswith("-"))
+        if name not in outputs:
+            raise ValueError(f"Cannot order by '{name}'; result columns are: {', '.join(outputs)}")
+        order.append((name, descending))
+
+    try:
+        limit = int(query.get("limit") or DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        raise ValueError(f"limit must be a whole number of rows (at most {MAX_LIMIT}), not '{query.get('limit')}'")
+    return {"filters": _filters(query.get("filters")), "group_by": group_by, "bucket": bucket,
+            "aggregates": aggregates, "keys": keys, "order_by": order, "limit": max(1, min(limit, MAX_LIMIT))}
+
+
+# ---- indexes ----
+
+class Indexes:
+    """Per-dataset sorted date index and label postings, for scans that touch only matching rows"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.ns = df["transaction_date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        self.date_order = np.argsort(self.ns, kind="stable")
+        self.sorted_ns = self.ns[self.date_order]
+        self.codes: Dict[str, np.ndarray] = {}
+        self.labels: Dict[str, List[str]] = {}
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for dimension, column in DIMENSIONS.items():
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, labels = values.cat.codes.to_numpy(), [str(c) for c in values.cat.categories]
+            else:
+                codes, uniques = pd.factorize(values.astype(str))
+                labels = [str(u) for u in uniques]
+            self.codes[dimension] = codes
+            self.labels[dimension] = labels
+            # Rows of each label, contiguous: order[offsets[code]:offsets[code + 1]]
+            order = np.argsort(codes, kind="stable")
+            offsets = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+            self.postings[dimension] = (order, offsets)
+
+    def date_range(self, start: Optional[int], end: Optional[int]) -> np.ndarray:
+        lo = 0 if start is None else np.searchsorted(self.sorted_ns, start, side="left")
+        hi = len(self.sorted_ns) if end is None else np.searchsorted(self.sorted_ns, end, side="left")
+        return self.date_order[lo:hi]
+
+    def label_rows(self, dimension: str, labels: List[str]) -> np.ndarray:
+        order, offsets = self.postings[dimension]
+        known = {label: i for i, label in enumerate(self.labels[dimension])}
+        parts = [order[offsets[known[label]]:offsets[known[label] + 1]] for label in labels if label in known]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def label_count(self, dimension: str, labels: List[str]) -> int:
+        _, offsets = self.postings[dimension]
+        known = {label: i for i, label in enumerate(self.labels[dimension])}
+        return int(sum(offsets[known[label] + 1] - offsets[known[label]] for label in labels if label in known))
+
+
+_index_lock = threading.Lock()
+
+
+def indexes_for(dataset: Dict[str, Any]) -> Indexes:
+    """The dataset's query indexes, built on first use and kept with the dataset"""
+    if "query_indexes" not in dataset:
+        with _index_lock:
+            if "query_indexes" not in dataset:
+                dataset["query_indexes"] = Indexes(dataset["df"])
+    return dataset["query_indexes"]
+
+
+# ---- planning ----
+
+def _date_range(filters: List[Dict[str, Any]]) -> Tuple[Optional[int], Optional[int]]:
+    """The [start, end) range (epoch ns) all date filters together allow"""
+    start, end = None, None
+    for f in filters:
+        if f["field"] != "date":
+            continue
+        op, values = f["op"], f["values"]
+        bounds = []
+        if op == "=":
+            high = _time_value(values[0], upper=True)
+            bounds = [(high - (NS_PER_DAY if len(str(values[0])) <= 10 else NS_PER_MINUTE), high)]
+        elif op == "between":
+            bounds = [(_time_value(values[0]), _time_value(values[1], upper=True))]
+        elif op == ">=":
+            bounds = [(_time_value(values[0]), None)]
+        elif op == ">":
+            bounds = [(_time_value(values[0], upper=True), None)]
+        elif op == "<":
+            bounds = [(None, _time_value(values[0]))]
+        elif op == "<=":
+            bounds = [(None, _time_value(values[0], upper=True))]
+        for low, high in bounds:
+            if low is not None:
+                start = low if start is None else max(start, low)
+            if high is not None:
+                end = high if end is None else min(end, high)
+    return start, end
+
+
+def rollup_bucket(query: Dict[str, Any]) -> Optional[str]:
+    """The coarsest rollup bucket that answers the query exactly, or None"""
+    if any(fn in ("min", "max") for fn, _ in query["aggregates"]):
+        return None
+    if any(f["field"] in MEASURES for f in query["filters"]):
+        return None
+    start, end = _date_range(query["filters"])
+    if any(bound is not None and bound % NS_PER_MINUTE for bound in (start, end)):
+        return None
+    needed = {_PART_GRANULARITY[f] for f in query["group_by"] if f in TIME_PARTS}
+    needed |= {_PART_GRANULARITY[f["field"]] for f in query["filters"] if f["field"] in TIME_PARTS}
+    if query["bucket"]:
+        needed.add(query["bucket"])
+    for bucket in ["month", "week", "day", "hour", "minute"]:
+        if all(bucket in _RESOLVES[requirement] for requirement in needed):
+            return bucket
+    return None
+
+
+def plan(query: Dict[str, Any], dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """How the query will run: {"path": "rollup"|"index"|"scan"|"sql", ...}"""
+    if dataset.get("db") is not None:
+        return {"path": "sql"}
+    if dataset.get("partitions") is not None:
+        return {"path": "partitions", "partitions": _prune(query, dataset["partitions"]),
+                "total": len(dataset["partitions"].partitions)}
+    bucket = rollup_bucket(query)
+    if bucket is not None:
+        return {"path": "rollup", "bucket": bucket}
+
+    indexes = indexes_for(dataset)
+    total = len(indexes.ns)
+    candidates = [("scan", None, total)]
+    start, end = _date_range(query["filters"])
+    if start is not None or end is not None:
+        lo = 0 if start is None else np.searchsorted(indexes.sorted_ns, start, side="left")
+        hi = total if end is None else np.searchsorted(indexes.sorted_ns, end, side="left")
+        candidates.append(("date", None, int(max(0, hi - lo))))
+    for f in query["filters"]:
+        if f["field"] in DIMENSIONS and f["op"] in ("=", "in"):
+            candidates.append((f["field"], f["values"], indexes.label_count(f["field"], f["values"])))
+    index, labels, rows = min(candidates, key=lambda c: c[2])
+    if index != "scan" and rows > total * INDEX_MAX_SELECTIVITY:
+        index, labels, rows = "scan", None, total
+    if rows > MAX_SCAN_ROWS:
+        raise ValueError(f"This query would scan {rows:,} rows (limit {MAX_SCAN_ROWS:,}); "
+                         "narrow it with a date range or a mall/branch/status filter")
+    return {"path": "index" if index != "scan" else "scan", "index": None if index == "scan" else index,
+            "labels": labels, "rows": rows}
+
+
+def _prune(query: Dict[str, Any], store) -> List[Dict[str, Any]]:
+    """Partitions of a partitioned dataset that can hold matching rows"""
+    labels, months, ranges = {}, None, {}
+    for f in query["filters"]:
+        field, op, values = f["field"], f["op"], f["values"]
+        if field in DIMENSIONS and op in ("=", "in"):
+            column = DIMENSIONS[field]
+            labels[column] = labels[column] & set(values) if column in labels else set(values)
+        elif field in ("month", "day") and op in ("=", "in"):
+            wanted = {str(v)[:7] for v in values}
+            months = wanted if months is None else months & wanted
+        elif field in MEASURES and op in ("=", "<", "<=", ">", ">=", "between"):
+            low, high = ranges.get(field, (-np.inf, np.inf))
+            if op in ("=", ">", ">=", "between"):
+                low = max(low, float(values[0]))
+            if op in ("=", "<", "<="):
+                high = min(high, float(values[0]))
+            elif op == "between":
+                high = min(high, float(values[1]))
+            ranges[field] = (low, high)
+    return store.prune(*_date_range(query["filters"]), labels=labels, months=months, ranges=ranges)
+
+
+# ---- execution ----
+
+def _time_part(field: str, ns: np.ndarray) -> np.ndarray:
+    if field == "hour":
+        return (ns // NS_PER_HOUR) % 24
+    if field == "weekday":
+        # 1970-01-01 was a Thursday
+        return (ns // NS_PER_DAY + 3) % 7
+    unit = "datetime64[D]" if field == "day" else "datetime64[M]"
+    return ns.view("datetime64[ns]").astype(unit).astype(str)
+
+
+def _match(values: np.ndarray, op: str, targets: list) -> np.ndarray:
+    if op == "=":
+        return values == targets[0]
+    if op == "!=":
+        return values != targets[0]
+    if op == "in":
+        return np.isin(values, targets)
+    if op == "not_in":
+        return ~np.isin(values, targets)
+    if op == "between":
+        return (values >= targets[0]) & (values <= targets[1])
+    return {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}[op](values, targets[0])
+
+
+def _label_codes(labels: List[str], wanted: list) -> list:
+    known = {label: i for i, label in enumerate(labels)}
+    return [known.get(v, -1) for v in wanted]
+
+
+class _Rows:
+    """Rows to filter and aggregate: transactions (count 1 each) or rollup rows (counts and sums)"""
+
+    def __init__(self, ns, codes, labels, count, sums, raw=None, in_range=False):
+        self.ns = ns
+        self.codes = codes
+        self.labels = labels
+        self.count = count
+        self.sums = sums
+        # Per-transaction values, for min/max (scans only)
+        self.raw = raw
+        # Rollup rows are already cut to the date range; their ns is the bucket start
+        self.in_range = in_range
+
+    def take(self, mask) -> "_Rows":
+        return _Rows(self.ns[mask], {d: c[mask] for d, c in self.codes.items()}, self.labels,
+                     self.count[mask], {m: v[mask] for m, v in self.sums.items()},
+                     None if self.raw is None else {m: v[mask] for m, v in self.raw.items()}, self.in_range)
+
+
+def _rollup_rows(dataset: Dict[str, Any], bucket: str, query: Dict[str, Any]) -> _Rows:
+    rollups = rollups_for(dataset)
+    start, end = _date_range(query["filters"])
+    rows = rollups.rows(bucket, start, end)
+    return _Rows(rows["t"].to_numpy(), {d: rows[d].to_numpy() for d in DIMENSIONS},
+                 {d: list(rollups.labels[d]) for d in DIMENSIONS}, rows["count"].to_numpy(),
+                 {m: rows[m].to_numpy(dtype=np.float64) for m in MEASURES}, in_range=True)
+
+
+def _scan_rows(dataset: Dict[str, Any], steps: Dict[str, Any], query: Dict[str, Any]) -> _Rows:
+    indexes = indexes_for(dataset)
+    df = dataset["df"]
+    if steps["index"] == "date":
+        positions = indexes.date_range(*_date_range(query["filters"]))
+    elif steps["index"]:
+        positions = indexes.label_rows(steps["index"], steps["labels"])
+    else:
+        positions = slice(None)
+    values = {m: df[column].to_numpy(dtype=np.float64)[positions] for m, column in MEASURES.items()}
+    ns = indexes.ns[positions]
+    return _Rows(ns, {d: c[positions] for d, c in indexes.codes.items()}, indexes.labels,
+                 np.ones(len(ns), dtype=np.int64), values, values)
+
+
+def _apply_filters(rows: _Rows, query: Dict[str, Any], deadline: float) -> _Rows:
+    mask = np.ones(len(rows.ns), dtype=bool)
+    start, end = (None, None) if rows.in_range else _date_range(query["filters"])
+    if start is not None:
+        mask &= rows.ns >= start
+    if end is not None:
+        mask &= rows.ns < end
+    for f in query["filters"]:
+        if time.perf_counter() > deadline:
+            raise QueryTimeout()
+        field, op, values = f["field"], f["op"], f["values"]
+        if field == "date":
+            continue
+        if field in DIMENSIONS:
+            mask &= _match(rows.codes[field], op, _label_codes(rows.labels[field], values))
+        elif field in TIME_PARTS:
+            mask &= _match(_time_part(field, rows.ns), op, values)
+        else:
+            mask &= _match(rows.raw[field], op, values)
+    return rows.take(mask)
+
+
+def _how(query: Dict[str, Any]) -> Dict[str, str]:
+    """How each partial column combines across rows or partitions"""
+    how = {"count": "sum"}
+    for fn, field in query["aggregates"]:
+        if fn in ("sum", "avg"):
+            how[f"sum_{field}"] = "sum"
+        elif fn in ("min", "max"):
+            how[f"{fn}_{field}"] = fn
+    return how
+
+
+def _combine(data: pd.DataFrame, query: Dict[str, Any]) -> pd.DataFrame:
+    how = _how(query)
+    if query["keys"]:
+        return data.groupby(query["keys"], sort=True).agg(how).reset_index()
+    return pd.DataFrame({column: [data[column].agg(fn) if len(data) else 0] for column, fn in how.items()})
+
+
+def _keys(rows: _Rows, query: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """Group key columns of every row: labels as codes, the bucket in epoch ns"""
+    keys = {}
+    if query["bucket"]:
+        keys["bucket"] = bucket_start(rows.ns, query["bucket"])
+    for field in query["group_by"]:
+        keys[field] = rows.codes[field] if field in DIMENSIONS else _time_part(field, rows.ns)
+    return keys
+
+
+def _decode(result: pd.DataFrame, rows: _Rows, query: Dict[str, Any]) -> pd.DataFrame:
+    for field in query["group_by"]:
+        if field in DIMENSIONS:
+            result[field] = np.array(rows.labels[field], dtype=object)[result[field].to_numpy()]
+    return result
+
+
+def _group(rows: _Rows, query: Dict[str, Any]) -> pd.DataFrame:
+    """Counts, sums and min/max per group, with labels decoded; the bucket column stays in epoch ns"""
+    frame = {"count": rows.count}
+    for fn, field in query["aggregates"]:
+        if fn in ("sum", "avg"):
+            frame[f"sum_{field}"] = rows.sums[field]
+        elif fn in ("min", "max"):
+            frame[f"{fn}_{field}"] = rows.raw[field]
+    return _decode(_combine(pd.DataFrame({**frame, **_keys(rows, query)}), query), rows, query)
+
+
+def _finish(result: pd.DataFrame, query: Dict[str, Any]) -> pd.DataFrame:
+    for fn, field in query["aggregates"]:
+        if fn == "avg":
+            result[f"avg_{field}"] = result[f"sum_{field}"] / result["count"].where(result["count"] > 0)
+    if query["bucket"]:
+        result["bucket"] = _bucket_labels(result["bucket"].to_numpy(), query["bucket"])
+    return result
+
+
+def _aggregate(rows: _Rows, query: Dict[str, Any]) -> pd.DataFrame:
+    return _finish(_group(rows, query), query)
+
+
+def _bucket_labels(ns: np.ndarray, bucket: str) -> np.ndarray:
+    unit = "datetime64[m]" if bucket in ("minute", "hour") else "datetime64[D]"
+    return ns.astype(np.int64).view("datetime64[ns]").astype(unit).astype(str)
+
+
+_partials: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+_partials_lock = threading.Lock()
+
+
+def _partitioned_aggregate(dataset: Dict[str, Any], steps: Dict[str, Any], query: Dict[str, Any],
+                           deadline: float) -> Tuple[pd.DataFrame, int]:
+    """Merge per-partition partial results, computing only those not cached for the partition's version"""
+    store = dataset["partitions"]
+    start, end = _date_range(query["filters"])
+    partials, examined = [], 0
+    for partition in steps["partitions"]:
+        if time.perf_counter() > deadline:
+            raise QueryTimeout()
+        part_query = query
+        if (start is not None or end is not None) and store.covers(partition, start, end):
+            # Without its date filters, the partial is shared by every range covering the partition
+            part_query = {**query, "filters": [f for f in query["filters"] if f["field"] != "date"]}
+        key = partition["version"] + json.dumps([part_query[k] for k in ("filters", "group_by", "bucket", "aggregates")],
+                                                default=str)
+        with _partials_lock:
+            partial = _partials.get(key)
+            if partial is not None:
+                _partials.move_to_end(key)
+        if partial is None:
+            part = store.dataset(partition)
+            part_steps = plan(part_query, part)
+            rows = (_rollup_rows(part, part_steps["bucket"], part_query) if part_steps["path"] == "rollup"
+                    else _scan_rows(part, part_steps, part_query))
+            examined += len(rows.ns)
+            partial = _group(_apply_filters(rows, part_query, deadline), part_query)
+            with _partials_lock:
+                _partials[key] = partial
+                while len(_partials) > PARTITION_CACHE_ENTRIES:
+                    _partials.popitem(last=False)
+        partials.append(partial)
+    columns = query["keys"] + list(_how(query))
+    data = pd.concat(partials, ignore_index=True) if partials else pd.DataFrame({c: [] for c in columns})
+    # Partitions without a match contribute nothing (their no-group partial is a row of zeros)
+    return _finish(_combine(data[data["count"] > 0], query), query), examined
+
+
+def _sql_aggregate(dataset: Dict[str, Any], query: Dict[str, Any]) -> pd.DataFrame:
+    db = dataset["db"]
+    try:
+        result = db.aggregate(query, *_date_range(query["filters"]), timeout=TIMEOUT_SECONDS)
+    except TimeoutError:
+        raise QueryTimeout()
+    if query["bucket"]:
+        # The database returns bucket starts in epoch seconds
+        result["bucket"] = _bucket_labels(result["bucket"].to_numpy(np.int64) * 10**9, query["bucket"])
+    return result
+
+
+# ---- sketched aggregates ----
+
+def _check_sketchable(query: Dict[str, Any]):
+    """The sketches are daily and per label; raise unless the query resolves to whole days"""
+    if any(f["field"] in MEASURES for f in query["filters"]):
+        raise ValueError("Percentiles and distinct counts cannot be combined with amount or tax filters")
+    fields = query["group_by"] + [f["field"] for f in query["filters"]]
+    if "hour" in fields or query["bucket"] in ("minute", "hour"):
+        raise ValueError("Percentiles and distinct counts are kept per day; they cannot be split by hour or minute")
+    if any(bound is not None and bound % NS_PER_DAY for bound in _date_range(query["filters"])):
+        raise ValueError("Percentiles and distinct counts need whole-day date ranges, like between 2025-03-01 and 2025-03-31")
+
+
+def _sketch_partial(dataset: Dict[str, Any], query: Dict[str, Any], kind: str, field: str,
+                    deadline: float) -> Tuple[pd.DataFrame, int]:
+    """One dataset's sketch rows for `field`, merged per result group (labels decoded, bucket in ns)"""
+    sketches = sketches_for(dataset)
+    # Monthly sketches serve every query that needs no finer time than a month
+    fields = query["group_by"] + [f["field"] for f in query["filters"]]
+    daily = query["bucket"] in ("day", "week") or "day" in fields or "weekday" in fields
+    table = sketches.rows(kind, field, *_date_range(query["filters"]), daily=daily)
+    column, value, how = REDUCE[kind]
+    # A sketch row's bin or register rides along as a raw value, its count or rank as the count
+    rows = _Rows(table["t"].to_numpy(np.int64), {d: table[d].to_numpy() for d in DIMENSIONS},
+                 {d: list(sketches.labels[d]) for d in DIMENSIONS}, table[value].to_numpy(), {},
+                 {column: table[column].to_numpy()}, in_range=True)
+    rows = _apply_filters(rows, query, deadline)
+    frame = pd.DataFrame({**_keys(rows, query), column: rows.raw[column], value: rows.count})
+    partial = frame.groupby(query["keys"] + [column], sort=False)[value].agg(how).reset_index()
+    return _decode(partial, rows, query), len(table)
+
+
+def _sketch_columns(dataset: Dict[str, Any], steps: Dict[str, Any], query: Dict[str, Any],
+                    deadline: float) -> Tuple[pd.DataFrame, int]:
+    """The sketched aggregates per result group, merged across partitions when partitioned"""
+    aggregates = [(fn, field) for fn, field in query["aggregates"] if is_sketched(fn)]
+    keys = query["keys"]
+    result, examined = None, 0
+    for kind, field in dict.fromkeys(("distinct" if fn == "distinct" else "quantile", field) for fn, field in aggregates):
+        column, value, how = REDUCE[kind]
+        if steps["path"] == "partitions":
+            parts = []
+            for partition in steps["partitions"]:
+                if time.perf_counter() > deadline:
+                    raise QueryTimeout()
+                key = "sketch:" + partition["version"] + json.dumps(
+                    [kind, field] + [query[k] for k in ("filters", "group_by", "bucket")], default=str)
+                with _partials_lock:
+                    partial = _partials.get(key)
+                    if partial is not None:
+                        _partials.move_to_end(key)
+                if partial is None:
+                    partial, read = _sketch_partial(dataset["partitions"].dataset(partition), query, kind, field, deadline)
+                    examined += read
+                    with _partials_lock:
+                        _partials[key] = partial
+                        while len(_partials) > PARTITION_CACHE_ENTRIES:
+                            _partials.popitem(last=False)
+                parts.append(partial)
+            merged = (pd.concat(parts, ignore_index=True) if parts
+                      else pd.DataFrame({c: [] for c in keys + [column, value]}))
+            merged = merged.groupby(keys + [column], sort=False)[value].agg(how).reset_index()
+        else:
+            merged, examined_here = _sketch_partial(dataset, query, kind, field, deadline)
+            examined += examined_here
+        if kind == "distinct":
+            columns = distinct_counts(merged, keys, aggregate_name("distinct", field))
+        else:
+            columns = quantiles(merged, keys, {aggregate_name(fn, f): percentile(fn) for fn, f in aggregates
+                                               if f == field and fn != "distinct"})
+        if result is None:
+            result = columns
+        elif keys:
+            result = result.merge(columns, on=keys, how="outer")
+        else:
+            result = pd.concat([result, columns], axis=1)
+    if query["bucket"]:
+        result["bucket"] = _bucket_labels(result["bucket"].to_numpy(), query["bucket"])
+    return result, examined
+
+
+def _with_sketches(result: pd.DataFrame, sketched: pd.DataFrame, query: Dict[str, Any]) -> pd.DataFrame:
+    if query["keys"]:
+        return result.merge(sketched, on=query["keys"], how="left")
+    for column in sketched.columns:
+        # No matching rows: no percentile, and nothing distinct
+        result[column] = sketched[column].iloc[0] if len(sketched) else (0 if column.startswith("distinct_") else np.nan)
+    return result
+
+
+def _order(result: pd.DataFrame, query: Dict[str, Any]) -> pd.DataFrame:
+    if not query["order_by"]:
+        # Groups in key order (labels alphabetically, time in sequence)
+        return result.sort_values(query["keys"], kind="stable", ignore_index=True) if query["keys"] else result
+    names = [name for name, _ in query["order_by"]]
+    return result.sort_values(names, ascending=[not descending for _, descending in query["order_by"]],
+                              kind="stable", na_position="last")
+
+
+def run_query(query: Dict[str, Any], dataset: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Answer a structured query (exactly, but for sketched aggregates); the result is columnar and capped at `limit` rows"""
+    started = time.perf_counter()
+    deadline = started + TIMEOUT_SECONDS
+    parsed = parse_query(query)
+    sketched = [(fn, field) for fn, field in parsed["aggregates"] if is_sketched(fn)]
+    if sketched:
+        _check_sketchable(parsed)
+    # The exact aggregates (at least the count) are planned as usual; sketched ones are joined on per group
+    exact = {**parsed, "aggregates": [a for a in parsed["aggregates"] if not is_sketched(a[0])] or [("count", None)]}
+    dataset = dataset or rag_pipeline.current_dataset()
+    with span("query.run", {"query.group_by": ",".join(parsed["keys"]),
+                            "query.filters": len(parsed["filters"])}) as current:
+        steps = plan(exact, dataset)
+        try:
+            if steps["path"] == "sql":
+                result = _sql_aggregate(dataset, exact)
+                # The database does not report what it read; the table size bounds it
+                examined = dataset["rows"]
+            elif steps["path"] == "partitions":
+                result, examined = _partitioned_aggregate(dataset, steps, exact, deadline)
+            else:
+                rows = (_rollup_rows(dataset, steps["bucket"], exact) if steps["path"] == "rollup"
+                        else _scan_rows(dataset, steps, exact))
+                if time.perf_counter() > deadline:
+                    raise QueryTimeout()
+                examined = len(rows.ns)
+                result = _aggregate(_apply_filters(rows, exact, deadline), exact)
+            if sketched:
+                approximate, sketch_rows = _sketch_columns(dataset, steps, parsed, deadline)
+                result = _with_sketches(result, approximate, parsed)
+                examined += sketch_rows
+            result = _order(result, parsed)
+        except QueryTimeout:
+            raise ValueError(f"Query stopped after {TIMEOUT_SECONDS:.0f}s; narrow it with a date range or filters")
+        set_attributes(current, {"query.path": steps["path"], "query.rows_examined": examined,
+                                 "query.result_rows": len(result)})
+
+    # Sums from the rollups or scans are the same to the cent; round away float noise
+    names = parsed["keys"] + [aggregate_name(fn, field) for fn, field in parsed["aggregates"]]
+    limited = result.head(parsed["limit"])
+    columns = {}
+    for name in names:
+        values = limited[name]
+        columns[name] = (values.round(3).tolist() if values.dtype.kind == "f"
+                         else [v.item() if hasattr(v, "item") else v for v in values])
+    response = {
+        "plan": steps["path"] + (f":{steps['bucket']}" if steps["path"] == "rollup"
+                                 else f":{len(steps['partitions'])}/{steps['total']}" if steps["path"] == "partitions"
+                                 else f":{steps['index']}" if steps["path"] == "index" else "")
+                + ("+sketch" if sketched else ""),
+        "version": dataset["version"],
+        "rows_examined": examined,
+        "rows": len(result),
+        "truncated": len(result) > parsed["limit"],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "columns": columns,
+    }
+    if sketched:
+        response["error_bounds"] = {aggregate_name(fn, field): error_bound(fn) for fn, field in sketched}
+    return response
@@ -0,0 +1,443 @@
+import calendar
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import query_engine
+import rag_pipeline
+from report_store import period_label
+from tracing import set_attributes, span
+
+# Answers to purely quantitative questions without the LLM.
+#
+# "Total revenue at Y Mall in March", "failure rate at C Mall Irbid", "how
+# many refunds by branch", "which branch had the most transactions in
+# February 2025": a question made only of a metric, labels of the data
+# (malls, branches, statuses, types), months or years, a "by <field>" split
+# or a "which <field> had the highest/lowest ..." ranking is turned into a
+# structured query (query_engine.py), answered exactly from the rollups or
+# indexes in milliseconds and written out from the templates below.
+#
+# A question is only answered here when every word of it is accounted for;
+# anything else ("why", "compare", "suggest", "last month", a report request,
+# "how many branches", "branch with the highest revenue") goes to the LLM
+# through ask_from_csv as before. Nouns like "branch" or "store" only count
+# as understood inside "which <field>" / "by <field>" or a label, and a
+# metric needs its subject ("total transactions", not "the total"): a wrong
+# instant answer is worse than a slow right one. REGRESSIONS below lists
+# questions and what they must get; `python quick_answers.py check` runs it.
+# QUICK_ANSWERS=0 sends every question to the LLM. The share answered here is
+# exported as quick_answers_bypass_ratio.
+
+ENABLED = os.getenv("QUICK_ANSWERS", "1").lower() not in ("0", "false", "no")
+CURRENCY = os.getenv("QUICK_ANSWERS_CURRENCY", "JOD")
+
+# Words that carry no meaning of their own in a quantitative question
+FILLER = {
+    "what", "whats", "what's", "was", "is", "are", "were", "be", "been", "the", "a", "an", "at", "in", "on",
+    "for", "of", "during", "to", "did", "do", "does", "had", "has", "have", "how", "much", "me", "tell",
+    "show", "give", "get", "find", "please", "can", "could", "you", "i", "we", "our", "my", "all", "and",
+    "overall", "there", "made", "recorded", "generated", "earned", "us", "it", "its", "their",
+}
+# Words naming a status or type label by another name
+SYNONYMS = {"success": "completed", "successful": "completed", "succeeded": "completed",
+            "failure": "failed", "failures": "failed", "fail": "failed", "completion": "completed",
+            "refunded": "refund"}
+AMOUNT_WORDS = r"revenue|sales|amount|amounts|value|spend|spending|turnover|income|basket|ticket|size"
+# Amount words naming a total rather than one transaction's amount: "highest revenue" is a ranking, not a max
+TOTAL_WORDS = {"revenue", "sales", "turnover", "income", "spend", "spending"}
+FUNCTIONS = [(r"average|avg|mean", "avg"), (r"median", "median"),
+             (r"highest|largest|biggest|max|maximum", "max"), (r"lowest|smallest|min|minimum", "min"),
+             (r"total|sum", "sum")]
+RANK_DESC = r"highest|most|top|best|busiest"
+RANK_ASC = r"lowest|least|fewest|worst|quietest"
+GROUP_FIELDS = {"mall": "mall", "branch": "branch", "month": "month", "weekday": "weekday", "day": "day",
+                "date": "day", "hour": "hour", "type": "type", "status": "status"}
+_GROUP_WORDS = r"malls?|branch(?:es)?|months?|days?|dates?|weekdays?|hours?|types?|status(?:es)?"
+# Things a question can count other than transactions ("how many branches"); the answer is not a query
+_ENTITY_WORDS = rf"{_GROUP_WORDS}|stores?|locations?|shops?|outlets?|customers?|tenants?"
+MONTH_WORDS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_WORDS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}, sept=9)
+
+NAMES = {"count": "Transactions", "sum:amount": "Total revenue", "sum:tax": "Total tax",
+         "avg:amount": "Average transaction amount", "avg:tax": "Average tax per transaction",
+         "max:amount": "Largest transaction", "max:tax": "Largest tax amount",
+         "min:amount": "Smallest transaction", "min:tax": "Smallest tax amount",
+         "median:amount": "Median transaction amount", "median:tax": "Median tax amount"}
+
+# Questions and the answer they must get on the bundled pdfs/jordan_transactions.csv; None means the LLM
+REGRESSIONS = [
+    ("What was the total revenue at Y Mall in January 2025?",
+     "Total revenue at Y Mall in January 2025: 2,648.26 JOD (313 transactions)."),
+    ("What is the failure rate at C Mall Irbid?", "Failure rate at C Mall Irbid: 6.7% (14 of 210 transactions)."),
+    ("What branch had the highest revenue?",
+     "C Mall Irbid had the highest total revenue: 1,729.90 JOD (210 transactions)."),
+    ("which mall had the highest failure rate", "Y Mall had the highest failure rate: 7.5% (43 of 573 transactions)."),
+    ("Which branch had the most transactions in February 2025?",
+     "Z Mall Gardens had the highest number of transactions in February 2025: 95."),
+    ("how many failed transactions at Z Mall", "Failed transactions at Z Mall: 38."),
+    ("number of refunds at C Mall Aqaba in February", "Refund transactions at C Mall Aqaba in February: 1."),
+    ("total transactions", "Transactions: 1,752."),
+    ("largest transaction at Y Mall Tla'a Al-Ali",
+     "Largest transaction at Y Mall Tla'a Al-Ali: 43.73 JOD (203 transactions)."),
+    ("total tax in 2025", "Total tax in 2025: 1,082.70 JOD (1,752 transactions)."),
+    ("revenue in December", "There are no transactions in December in the data."),
+    ("branch with the highest revenue", None),
+    ("What's the highest revenue?", None),
+    ("How many branches are there?", None),
+    ("How many malls do we have?", None),
+    ("how many stores", None),
+    ("What's the total?", None),
+    ("how many are there?", None),
+    ("which mall is the best?", None),
+    ("which branch had the largest transaction", None),
+    ("how many sales at Y Mall", None),
+    ("total revenue and tax at Y Mall", None),
+    ("total revenue last month", None),
+    ("May I know the total revenue?", None),
+    ("transactions over 20 JOD at Y Mall", None),
+    ("Why is the failure rate high at C Mall Irbid?", None),
+    ("Compare revenue at Y Mall and Z Mall", None),
+    ("Generate a detailed financial report for February 2025", None),
+    ("Give me a summary of transactions across all malls", None),
+]
+
+stats = {"questions": 0, "answered": 0, "to_llm": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def bypass_stats() -> Dict[str, Any]:
+    """The counters plus the share of questions answered without the LLM"""
+    with _stats_lock:
+        counts = dict(stats)
+    counts["bypass_ratio"] = counts["answered"] / counts["questions"] if counts["questions"] else 0.0
+    return counts
+
+
+def _count(key: str):
+    with _stats_lock:
+        stats["questions"] += 1
+        stats[key] += 1
+
+
+# ---- recognizing a question ----
+
+def vocabulary(dataset: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+    """Lowercase label -> (field, label) for the malls, branches, statuses and types of a dataset"""
+    words = dataset.get("quick_vocabulary")
+    if words is None:
+        # One small grouped count (from the rollups) lists the labels of every data source
+        labels = query_engine.run_query({"group_by": ["mall", "status", "type"], "aggregates": ["count"],
+                                         "limit": query_engine.MAX_LIMIT}, dataset)["columns"]
+        words = {}
+        for field in ("mall", "status", "type"):
+            for label in set(labels[field]):
+                words[str(label).lower()] = (field, str(label))
+        for branch in dataset["branch_names"]:
+            words[branch.lower()] = ("branch", branch)
+        dataset["quick_vocabulary"] = words
+    return words
+
+
+def periods(dataset: Dict[str, Any]) -> List[str]:
+    """The dataset's 'YYYY-MM' months, listed once per dataset (a scan of the dates for a frame)"""
+    if "quick_periods" not in dataset:
+        dataset["quick_periods"] = rag_pipeline.available_periods()
+    return dataset["quick_periods"]
+
+
+def _take(text: str, pattern: str) -> Tuple[str, List[re.Match]]:
+    """Every match of `pattern` as a whole phrase, and the text with them blanked out"""
+    matches = list(re.finditer(rf"(?<![\w'-])(?:{pattern})(?![\w'-])", text))
+    for match in reversed(matches):
+        text = text[:match.start()] + " " + text[match.end():]
+    return text, matches
+
+
+def _label_pattern(word: str) -> str:
+    # "refunds" is the Refund type, but "sales" is revenue rather than the Sale type
+    return re.escape(word) + ("s?" if not re.fullmatch(AMOUNT_WORDS, word + "s") else "")
+
+
+def _group_field(word: str) -> str:
+    """'branches' -> 'branch', 'dates' -> 'day'"""
+    return next(field for prefix, field in GROUP_FIELDS.items() if word.startswith(prefix))
+
+
+def parse_question(question: str, dataset: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The structured query a question asks, with what the answer template needs,
+    or None when the question is not fully understood
+    """
+    text = " " + re.sub(r"[?!.,;:]+(\s|$)", r" \1", question.lower()).replace("’", "'") + " "
+    words = vocabulary(dataset)
+    labels: Dict[str, List[str]] = {}
+    group_by: List[str] = []
+    order = None
+    rate = None
+
+    # "failure rate", "refund rate": the share of transactions with that status or type
+    text, matches = _take(text, r"([\w-]+) (?:rate|ratio|share|percentage)")
+    for match in matches:
+        word = SYNONYMS.get(match.group(1), match.group(1))
+        if rate is not None or word not in words or words[word][0] not in ("status", "type"):
+            return None
+        rate = (*words[word], match.group(1))
+
+    # "how many branches": not a count of transactions
+    if _take(text, rf"(?:how many|number of|count of|count) (?:different |distinct )?(?:{_ENTITY_WORDS})")[1]:
+        return None
+
+    # "which branch had the most ...", "what mall has the lowest ...": a ranking over one field
+    text, matches = _take(text, rf"(?:which|what) ({_GROUP_WORDS})")
+    if matches:
+        group_by.append(_group_field(matches[0].group(1)))
+        text, desc = _take(text, RANK_DESC)
+        text, asc = _take(text, RANK_ASC)
+        if len(matches) > 1 or bool(desc) == bool(asc):
+            return None
+        order = "desc" if desc else "asc"
+
+    # Labels, longest first so a branch is not read as its mall
+    for word in sorted(words, key=len, reverse=True):
+        pattern = "|".join(_label_pattern(w) for w in [word, *[s for s, t in SYNONYMS.items() if t == word]])
+        text, matches = _take(text, pattern)
+        if matches:
+            field, label = words[word]
+            labels.setdefault(field, []).append(label)
+
+    # Months ("March", "Mar 2025", "March of 2025"; not "may I") and years
+    text, matches = _take(text, rf"({'|'.join(MONTH_WORDS)})(?: (?:of )?(\d{{4}}))?(?! (?:i|we|you)\b)")
+    text, years = _take(text, r"(?:19|20)\d{2}")
+    years = [match.group(0) for match in years]
+    wanted = []
+    for match in matches:
+        number = MONTH_WORDS[match.group(1)]
+        for year in [match.group(2)] if match.group(2) else years or [None]:
+            wanted.append((number, year))
+            labels.setdefault("months", []).append(calendar.month_name[number] + (f" {year}" if year else ""))
+    if not matches and years:
+        wanted = [(None, year) for year in years]
+        labels["months"] = years
+    months = [p for p in (periods(dataset) if wanted else []) for number, year in wanted
+              if (number is None or int(p[5:7]) == number) and (year is None or p[:4] == year)]
+
+    # "by branch", "per month", "for each mall": a breakdown
+    text, matches = _take(text, rf"(?:by|per|for each|for every|in each|across|each) ({_GROUP_WORDS})")
+    for match in matches:
+        group_by.append(_group_field(match.group(1)))
+
+    # The metric
+    text, counts = _take(text, r"how many|number of|count of|count|volume")
+    text, amount = _take(text, AMOUNT_WORDS)
+    text, tax = _take(text, r"tax|taxes|vat")
+    text, subject = _take(text, r"transactions?")
+    # "how many refunds", "failed transactions": the labels name what is counted
+    subject = subject or labels.get("status") or labels.get("type")
+    functions = []
+    for pattern, fn in FUNCTIONS:
+        text, found = _take(text, pattern)
+        functions += [fn] * len(found)
+    if amount and tax or counts and (amount or tax) or len(set(functions)) > 1:
+        return None
+    fn = functions[0] if functions else None
+    if fn in ("max", "min") and {m.group(0) for m in amount} & TOTAL_WORDS:
+        # "highest revenue" without "which <field>" is ambiguous, not the largest transaction
+        return None
+    if rate is not None:
+        if counts or amount or tax or fn:
+            return None
+        metric = "rate"
+    elif amount or tax:
+        metric = f"{fn or 'sum'}:{'tax' if tax else 'amount'}"
+    elif not subject:
+        # "what's the total?", "how many are there?", "which mall is the best?"
+        return None
+    elif fn in ("avg", "median", "max", "min"):
+        # "average transaction", "largest transaction"
+        metric = f"{fn}:amount"
+    elif counts or fn == "sum" or order is not None:
+        # "how many", "total transactions", "which branch had the most transactions"
+        metric = "count"
+    else:
+        return None
+    if not set(re.findall(r"[\w']+", text)) <= FILLER:
+        return None
+    if len(set(group_by)) != len(group_by) or len(group_by) > 1:
+        return None
+
+    filters = []
+    for field in ("mall", "branch", "status", "type"):
+        values = labels.get(field, [])
+        if values and rate is not None and field == rate[0]:
+            return None
+        if len(values) > 1 and not group_by and order is None:
+            # "Y Mall and Z Mall": one answer each
+            group_by.append(field)
+        if values:
+            filters.append({"field": field, "op": "in", "value": values})
+    if months:
+        filters.append({"field": "month", "op": "in", "value": sorted(set(months))})
+        if len(labels["months"]) > 1 and not group_by and order is None:
+            group_by.append("month")
+
+    aggregates = ["count"] if metric in ("count", "rate") else ["count", metric]
+    return {"query": {"filters": filters, "group_by": group_by + ([rate[0]] if rate else []),
+                      "aggregates": aggregates, "limit": query_engine.MAX_LIMIT},
+            "metric": metric, "rate": rate, "group_by": group_by, "order": order, "labels": labels,
+            # Months asked for that the data does not have
+            "empty": bool(labels.get("months")) and not months}
+
+
+# ---- answering ----
+
+def _kinds(labels: Dict[str, List[str]]) -> str:
+    """'Failed Refund transactions'"""
+    return " ".join([*labels.get("status", []), *labels.get("type", []), "transactions"])
+
+
+def _scope(labels: Dict[str, List[str]], kinds: bool = True) -> str:
+    """' at C Mall Irbid for Refund transactions in March 2025'"""
+    scope = ""
+    places = labels.get("branch", []) + labels.get("mall", [])
+    if places:
+        scope += " at " + " and ".join(places)
+    if kinds and (labels.get("status") or labels.get("type")):
+        scope += " for " + _kinds(labels)
+    if labels.get("months"):
+        scope += " in " + " and ".join(labels["months"])
+    return scope
+
+
+def _transactions(count: int) -> str:
+    return f"{count:,} transaction" + ("" if count == 1 else "s")
+
+
+def _value(metric: str, value) -> str:
+    if metric == "count":
+        return f"{int(value):,}"
+    if metric == "rate":
+        return f"{value:.1%}"
+    return f"{value:,.2f} {CURRENCY}"
+
+
+def _key_label(field: str, key) -> str:
+    if field == "month":
+        return period_label(str(key))
+    if field == "weekday":
+        return calendar.day_name[int(key)]
+    if field == "hour":
+        return f"{int(key):02d}:00"
+    return str(key)
+
+
+def _rows(parsed: Dict[str, Any], columns: Dict[str, list]) -> List[Dict[str, Any]]:
+    """One {"key", "value", "count", "of"} per group (a single one without groups)"""
+    keys = parsed["group_by"]
+    metric = parsed["metric"]
+    grouped: Dict[Any, Dict[str, Any]] = {}
+    for i, count in enumerate(columns["count"]):
+        key = columns[keys[0]][i] if keys else None
+        row = grouped.setdefault(key, {"key": key, "count": 0, "of": 0, "value": 0})
+        if parsed["rate"]:
+            row["of"] += count
+            if columns[parsed["rate"][0]][i] == parsed["rate"][1]:
+                row["count"] += count
+        else:
+            row["count"] = count
+            row["value"] = count if metric == "count" else columns[query_engine.aggregate_name(*metric.split(":"))][i]
+    rows = list(grouped.values())
+    if parsed["rate"]:
+        for row in rows:
+            row["value"] = row["count"] / row["of"] if row["of"] else 0.0
+    if parsed["order"]:
+        rows.sort(key=lambda row: row["value"], reverse=parsed["order"] == "desc")
+    return rows
+
+
+def render(parsed: Dict[str, Any], response: Optional[Dict[str, Any]]) -> str:
+    """The answer text for a parsed question and its query response"""
+    metric = parsed["metric"]
+    labels = parsed["labels"]
+    rows = [] if parsed["empty"] else _rows(parsed, response["columns"])
+    if not any(row["of"] if parsed["rate"] else row["count"] for row in rows):
+        return f"There are no {_kinds(labels)}{_scope(labels, kinds=False)} in the data."
+    about = "about " if metric.startswith("median") else ""
+    if metric == "count":
+        # "Failed transactions at Z Mall: 38."
+        name = _kinds(labels).capitalize() if labels.get("status") or labels.get("type") else "Transactions"
+        scope = _scope(labels, kinds=False)
+    else:
+        name = f"{parsed['rate'][2].capitalize()} rate" if metric == "rate" else NAMES[metric]
+        scope = _scope(labels)
+
+    def detail(row):
+        if metric == "rate":
+            return f"{_value(metric, row['value'])} ({row['count']:,} of {_transactions(row['of'])})"
+        if metric == "count":
+            return _value(metric, row["value"])
+        return f"{about}{_value(metric, row['value'])} ({_transactions(row['count'])})"
+
+    if parsed["order"]:
+        field = parsed["group_by"][0]
+        top = rows[0]
+        ties = [_key_label(field, row["key"]) for row in rows if row["value"] == top["value"]]
+        rank = "highest" if parsed["order"] == "desc" else "lowest"
+        measure = f"number of {name[0].lower() + name[1:]}" if metric == "count" else name[0].lower() + name[1:]
+        return f"{' and '.join(ties)} had the {rank} {measure}{scope}: {detail(top)}."
+    if parsed["group_by"]:
+        field = parsed["group_by"][0]
+        lines = [f"{name}{scope} by {field}:"]
+        lines += [f"- {_key_label(field, row['key'])}: {detail(row)}" for row in rows]
+        return "\n".join(lines)
+    return f"{name}{scope}: {detail(rows[0])}."
+
+
+def quick_answer(question: str) -> Optional[str]:
+    """The templated answer to a fully specified quantitative question, or None to ask the LLM"""
+    if not ENABLED:
+        _count("to_llm")
+        return None
+    with span("quick_answers.answer") as current:
+        dataset = rag_pipeline.current_dataset()
+        try:
+            parsed = parse_question(question, dataset)
+            answer = None
+            if parsed is not None:
+                response = None if parsed["empty"] else query_engine.run_query(parsed["query"], dataset)
+                answer = render(parsed, response)
+                set_attributes(current, {"quick_answers.metric": parsed["metric"],
+                                         "quick_answers.plan": response and response["plan"]})
+        except ValueError as e:
+            # A query the engine refuses (e.g. a sketched aggregate by hour) goes to the LLM
+            print(f"Quick answer failed for {question!r}: {e}")
+            answer = None
+            with _stats_lock:
+                stats["errors"] += 1
+        set_attributes(current, {"quick_answers.answered": answer is not None})
+    _count("answered" if answer is not None else "to_llm")
+    return answer
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Instant answers to quantitative questions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ask = sub.add_parser("ask", help="Answer one question, or say it goes to the LLM")
+    ask.add_argument("question")
+    sub.add_parser("check", help="Run the REGRESSIONS table against the bundled Jordan dataset")
+    args = parser.parse_args()
+    if args.command == "ask":
+        print(quick_answer(args.question) or "(goes to the LLM)")
+    else:
+        rag_pipeline.use_dataset(os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdfs",
+                                              "jordan_transactions.csv"))
+        failed = 0
+        for question, expected in REGRESSIONS:
+            answer = quick_answer(question)
+            if answer != expected:
+                failed += 1
+                print(f"FAIL {question!r}\n  expected {expected!r}\n  got      {answer!r}")
+        print(f"{len(REGRESSIONS) - failed}/{len(REGRESSIONS)} questions answered as expected")
+        raise SystemExit(1 if failed else 0)
@@ -1,24 +1,170 @@
 import pandas as pd
+import numpy as np
 import os
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 import json
+import hashlib
+import contextvars
+import threading
+from contextlib import contextmanager
 from typing import Dict, Any, List, Optional
+from transaction_store import COLUMN_ORDER, decode_ids, is_store, read_ids, read_store
+from transaction_db import TransactionDB, is_database
+from partitions import PartitionedStore, is_partitioned
+from profiling import allocations_traced, track_allocations
+from metrics import record_dataset
+from tracing import set_attributes, span, traced
+from llm_gateway import gateway, message_text
 
 # Load environment variables
 load_dotenv()
 
-# Initialize components
-embeddings = OpenAIEmbeddings()
-model = ChatOpenAI(model="gpt-4.1-nano")
+# Completions go through llm_gateway (pooled connections, retries, hedging, caching).
+# Temperature 0 makes identical questions over the same data cacheable.
+model_name = os.getenv("RAG_MODEL", "gpt-4.1-nano")
+temperature = float(os.getenv("RAG_TEMPERATURE", 0))
 
-# Load the transactions data
-csv_path = os.path.join(os.getcwd(), "pdfs", "jordan_transactions.csv")
-transactions_df = pd.read_csv(csv_path)
+# Location of the transactions data: the CSV export, a binary store directory
+# a .sqlite/.duckdb database file (see transaction_db.py) or a month-partitioned
+# directory (see partitions.py)
+csv_path = os.getenv("TRANSACTIONS_PATH", os.path.join(os.getcwd(), "pdfs", "jordan_transactions.csv"))
 
-# Convert date column to datetime
-transactions_df['transaction_date'] = pd.to_datetime(transactions_df['transaction_date'], format='%d/%m/%Y %H:%M')
+def load_transactions(path: str) -> pd.DataFrame:
+    """Load transactions from a CSV file or a binary store (see transaction_store.py)"""
+    if is_store(path):
+        return read_store(path)
+    df = pd.read_csv(path)
+    # Convert date column to datetime
+    df['transaction_date'] = pd.to_datetime(df['transaction_date'], format='%d/%m/%Y %H:%M')
+    return df
+
+def compute_dataset_version(path: str) -> str:
+    """Identify the dataset file contents cheaply (path, size and modification time)"""
+    if is_partitioned(path):
+        return PartitionedStore(path).version
+    stat = os.stat(os.path.join(path, "meta.json") if is_store(path) else path)
+    fingerprint = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+def load_dataset(path: str) -> Dict[str, Any]:
+    """Load a dataset and everything derived from it, without making it active yet"""
+    if is_database(path):
+        # Queries run inside the database; nothing is loaded into memory
+        db = TransactionDB(path)
+        return {"path": path, "df": None, "db": db, "partitions": None, "ids": None, "rows": db.row_count(),
+                "version": compute_dataset_version(path), "branch_names": db.branch_names()}
+    if is_partitioned(path):
+        # Partitions are memory-mapped when a query first needs them
+        store = PartitionedStore(path)
+        return {"path": path, "df": None, "db": None, "partitions": store, "ids": None,
+                "rows": store.row_count(), "version": store.version, "branch_names": store.branch_names()}
+    with track_allocations("load_transactions"):
+        if is_store(path):
+            # Every column stays memory-mapped; transaction ids are only decoded for the rows shown,
+            # so worker processes sharing a store hold no private copy of it
+            df = read_store(path, columns=[c for c in COLUMN_ORDER if c != "transaction_id"])
+            ids = read_ids(path)
+        else:
+            df = load_transactions(path)
+            ids = None
+    return {
+        "path": path,
+        "df": df,
+        "db": None,
+        "partitions": None,
+        "ids": ids,
+        "rows": len(df),
+        # Version of the loaded data; cached reports are only valid for the same version
+        "version": compute_dataset_version(path),
+        # Known branch names, used for branch-level filtering and reports
+        "branch_names": sorted(str(b) for b in df['branch_name'].unique()),
+    }
+
+# The active dataset, replaced as a whole so readers never see parts of two versions
+_active_dataset: Optional[Dict[str, Any]] = None
+# The dataset a request pinned with pinned_dataset(), if any
+_pinned_dataset: contextvars.ContextVar = contextvars.ContextVar("pinned_dataset", default=None)
+
+def activate_dataset(dataset: Dict[str, Any]):
+    """Make a dataset from load_dataset() the one all analysis runs against"""
+    global _active_dataset, csv_path, transactions_df, dataset_version, branch_names
+    _active_dataset = dataset
+    # Module-level shortcuts to the active dataset
+    csv_path = dataset["path"]
+    transactions_df = dataset["df"]
+    dataset_version = dataset["version"]
+    branch_names = dataset["branch_names"]
+    record_dataset(transactions_df, dataset["rows"])
+
+_load_lock = threading.Lock()
+
+def current_dataset() -> Dict[str, Any]:
+    """The dataset pinned by the current request, otherwise the active one (loaded on first use)"""
+    dataset = _pinned_dataset.get() or _active_dataset
+    if dataset is None:
+        # Concurrent first users (a request and the server's warmup) share one load
+        with _load_lock:
+            if _active_dataset is None:
+                use_dataset(csv_path)
+        dataset = _active_dataset
+    return dataset
+
+def __getattr__(name: str):
+    # The module-level shortcuts exist once a dataset is active; asking for one loads it
+    if name in ("transactions_df", "dataset_version", "branch_names"):
+        current_dataset()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@contextmanager
+def pinned_dataset(dataset: Optional[Dict[str, Any]] = None):
+    """
+    Run the block against `dataset` (e.g. a tenant's, see dataset_registry.py), by default
+    the one active at entry, even if another one is activated meanwhile
+    """
+    token = _pinned_dataset.set(dataset or current_dataset())
+    try:
+        yield _pinned_dataset.get()
+    finally:
+        _pinned_dataset.reset(token)
+
+def use_dataset(path: str):
+    """Load a dataset and make it the one all analysis runs against"""
+    activate_dataset(load_dataset(path))
+
+def data_store(dataset: Dict[str, Any]):
+    """The TransactionDB or PartitionedStore holding a dataset that is not a DataFrame, else None"""
+    return dataset["db"] or dataset["partitions"]
+
+def period_version(period: str, dataset: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Version of the data behind a 'YYYY-MM' period: its partitions' version for a
+    partitioned dataset (unchanged by ingestion into other months), otherwise the dataset's
+    """
+    dataset = dataset or current_dataset()
+    if dataset["partitions"] is not None:
+        return dataset["partitions"].month_version(period)
+    return dataset["version"]
+
+def with_transaction_ids(df: pd.DataFrame, dataset: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """Add the transaction_id column to rows of a store-backed dataset, decoding only those rows"""
+    ids = (dataset or current_dataset())["ids"]
+    if ids is None or "transaction_id" in df.columns:
+        return df
+    df = df.copy()
+    df.insert(0, "transaction_id", decode_ids(ids, df.index.to_numpy()))
+    return df
+
+# The transactions data is loaded on first use (current_dataset()), so importing
+# this module stays cheap; servers load it from their warmup (see startup.py)
+
+def available_periods() -> List[str]:
+    """Months present in the data, as sorted 'YYYY-MM' strings"""
+    dataset = current_dataset()
+    if data_store(dataset):
+        return data_store(dataset).periods()
+    months = np.unique(dataset["df"]['transaction_date'].to_numpy().astype('datetime64[M]'))
+    return [str(m) for m in months]
 
 # Create a financial advisor prompt template
 template = """
@@ -37,65 +183,127 @@ If appropriate, suggest potential business actions based on the insights.
 Answer:
 """
 
-# Setup prompt template
-prompt = ChatPromptTemplate.from_template(template)
-chain = prompt | model
-
+@traced("rag.get_summary_statistics")
+@allocations_traced("get_summary_statistics")
 def get_summary_statistics() -> str:
     """Generate summary statistics about the transaction data"""
+    dataset = current_dataset()
+    if data_store(dataset):
+        return json.dumps(data_store(dataset).summary_statistics(), indent=2)
     stats = {}
+    df = dataset["df"]
     
     # Total transactions by mall
-    mall_counts = transactions_df['mall_name'].value_counts().to_dict()
+    mall_counts = df['mall_name'].value_counts().to_dict()
     stats['transactions_by_mall'] = mall_counts
     
     # Total transaction amount by mall
-    mall_amounts = transactions_df.groupby('mall_name')['transaction_amount'].sum().to_dict()
+    mall_amounts = df.groupby('mall_name')['transaction_amount'].sum().to_dict()
     stats['total_amount_by_mall'] = mall_amounts
     
     # Transaction status distribution
-    status_counts = transactions_df['transaction_status'].value_counts().to_dict()
+    status_counts = df['transaction_status'].value_counts().to_dict()
     stats['transaction_status_distribution'] = status_counts
     
     # Transaction types distribution
-    type_counts = transactions_df['transaction_type'].value_counts().to_dict()
+    type_counts = df['transaction_type'].value_counts().to_dict()
     stats['transaction_types'] = type_counts
     
     # Time-based analysis (transactions by month)
-    transactions_df['month'] = transactions_df['transaction_date'].dt.month
-    month_counts = transactions_df['month'].value_counts().sort_index().to_dict()
+    # (computed on the side rather than added as a column, which would copy the shared data)
+    month_counts = df['transaction_date'].dt.month.value_counts().sort_index().to_dict()
     stats['transactions_by_month'] = {f"Month {m}": count for m, count in month_counts.items()}
     
     return json.dumps(stats, indent=2)
 
-def filter_transactions(query: str) -> pd.DataFrame:
-    """Filter transactions based on the query"""
-    filtered_df = transactions_df
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12
+}
+
+def question_filters(query: str, branch_names: List[str]) -> List[tuple]:
+    """The (column, value) conditions a question asks for; "month" is the month number"""
+    query = query.lower()
+    conditions = []
     
     # Basic keyword filtering
-    if "failed" in query.lower():
-        filtered_df = filtered_df[filtered_df['transaction_status'] == 'Failed']
-    if "success" in query.lower():
-        filtered_df = filtered_df[filtered_df['transaction_status'] == 'Success']
+    if "failed" in query:
+        conditions.append(('transaction_status', 'Failed'))
+    if "success" in query:
+        conditions.append(('transaction_status', 'Success'))
     
     # Mall filtering
     for mall in ["Y Mall", "Z Mall", "C Mall"]:
-        if mall.lower() in query.lower():
-            filtered_df = filtered_df[filtered_df['mall_name'] == mall]
+        if mall.lower() in query:
+            conditions.append(('mall_name', mall))
+    
+    # Branch filtering
+    for branch in branch_names:
+        if branch.lower() in query:
+            conditions.append(('branch_name', branch))
     
     # Date filtering - look for month keywords
-    months = {
-        "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
-        "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12
-    }
-    for month_name, month_num in months.items():
-        if month_name in query.lower():
-            filtered_df = filtered_df[filtered_df['transaction_date'].dt.month == month_num]
+    for month_name, month_num in MONTHS.items():
+        if month_name in query:
+            conditions.append(('month', month_num))
+    return conditions
+
+def sample_seed(dataset: Dict[str, Any], conditions: List[tuple]) -> int:
+    """
+    Seed for the rows shown to the LLM: the same question (its conditions) on the same
+    dataset version gets the same rows, so the prompt is identical and the gateway cache hits
+    """
+    key = f"{dataset['version']}:{sorted((str(c), str(v)) for c, v in conditions)}"
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:4], "big")
+
+@traced("rag.filter_transactions")
+@allocations_traced("filter_transactions")
+def filter_transactions(query: str) -> pd.DataFrame:
+    """Filter transactions based on the query"""
+    dataset = current_dataset()
+    conditions = question_filters(query, dataset["branch_names"])
+    seed = sample_seed(dataset, conditions)
+    if data_store(dataset):
+        return data_store(dataset).sample(conditions, 20, seed)
+    
+    filtered_df = dataset["df"]
+    for column, value in conditions:
+        if column == 'month':
+            filtered_df = filtered_df[filtered_df['transaction_date'].dt.month == value]
+        else:
+            filtered_df = filtered_df[filtered_df[column] == value]
     
     # Return a sample if the filtered dataset is too large
     if len(filtered_df) > 20:
-        return filtered_df.sample(20)
-    return filtered_df
+        return with_transaction_ids(filtered_df.sample(20, random_state=seed), dataset)
+    return with_transaction_ids(filtered_df, dataset)
+
+def build_prompt_inputs(question: str) -> Dict[str, str]:
+    """Gather the data context and statistics the prompt needs for a question"""
+    with pinned_dataset() as dataset, \
+            span("rag.build_prompt_inputs", {"dataset.rows": dataset["rows"], "dataset.version": dataset["version"]}) as current:
+        # Filter relevant transactions
+        filtered_transactions = filter_transactions(question)
+        
+        # Convert to string representation for context
+        with span("rag.to_string", {"rows": len(filtered_transactions)}) as to_string_span, \
+                track_allocations("to_string"):
+            if len(filtered_transactions) > 0:
+                context = filtered_transactions.to_string(index=False)
+            else:
+                context = "No transactions matching your query were found."
+            set_attributes(to_string_span, {"chars": len(context)})
+        
+        # Get summary statistics
+        statistics = get_summary_statistics()
+        set_attributes(current, {"rows.context": len(filtered_transactions),
+                                 "chars.statistics": len(statistics)})
+    
+    return {
+        "question": question,
+        "context": context,
+        "statistics": statistics
+    }
 
 def ask_from_csv(question: str) -> str:
     """
@@ -107,23 +315,18 @@ def ask_from_csv(question: str) -> str:
     Returns:
         str: The answer generated using analysis of transaction data.
     """
-    # Filter relevant transactions
-    filtered_transactions = filter_transactions(question)
-    
-    # Convert to string representation for context
-    if len(filtered_transactions) > 0:
-        context = filtered_transactions.to_string(index=False)
-    else:
-        context = "No transactions matching your query were found."
-    
-    # Get summary statistics
-    statistics = get_summary_statistics()
-    
-    # Generate the answer
-    result = chain.invoke({
-        "question": question,
-        "context": context,
-        "statistics": statistics
-    })
+    with span("rag.ask_from_csv") as current:
+        # Purely quantitative questions are computed and templated without the LLM
+        from quick_answers import quick_answer
+        answer = quick_answer(question)
+        set_attributes(current, {"rag.quick_answer": answer is not None})
+        if answer is not None:
+            return answer
+
+        prompt_inputs = build_prompt_inputs(question)
+        
+        # Generate the answer
+        messages = [{"role": "user", "content": template.format(**prompt_inputs)}]
+        result = gateway.complete(model=model_name, messages=messages, temperature=temperature)
     
-    return result.content
+    return message_text(result)
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+import rag_pipeline
+from report_store import ReportStore, normalize_period, period_label
+
+# Off-peak window in local hours, "start-end" (end exclusive, may wrap midnight)
+DEFAULT_OFFPEAK_HOURS = os.getenv("REPORT_OFFPEAK_HOURS", "1-5")
+# How often the scheduler wakes up to look for missing reports (seconds)
+DEFAULT_INTERVAL = int(os.getenv("REPORT_SCHEDULER_INTERVAL", 900))
+# Optional JSON file mapping "*" or a branch name to {"email": [...], "whatsapp": [...]}
+DISTRIBUTION_FILE = os.getenv("REPORT_DISTRIBUTION_FILE")
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL", "http://localhost:8002")
+
+MALL_SUMMARY_QUESTION = "Give me a summary of transactions across all malls"
+
+report_store = ReportStore()
+
+
+def monthly_report_question(month: str, branch: str = "") -> str:
+    question = f"Generate a detailed financial report for {month}"
+    if branch:
+        question += f" at {branch}"
+    return question
+
+
+def is_closed(period: str, now: Optional[datetime] = None) -> bool:
+    """A period is closed once its calendar month has ended"""
+    now = now or datetime.now()
+    return period < now.strftime("%Y-%m")
+
+
+def monthly_report(month: str, branch: str = "") -> str:
+    """
+    Serve a monthly report, from the report store when it has been pre-generated.
+
+    Reports for closed periods are written back to the store on a miss, so
+    each (period, branch) is only generated once per dataset version.
+    """
+    # Look up, generate and store the report against one dataset version
+    with rag_pipeline.pinned_dataset() as dataset:
+        period = normalize_period(month, rag_pipeline.available_periods())
+        if branch:
+            branch = next((b for b in dataset["branch_names"] if b.lower() == branch.strip().lower()), branch)
+        if period is None:
+            return rag_pipeline.ask_from_csv(monthly_report_question(month, branch))
+
+        version = rag_pipeline.period_version(period, dataset)
+        cached = report_store.get("monthly", period, branch, version)
+        if cached is not None:
+            return cached
+
+        report = rag_pipeline.ask_from_csv(monthly_report_question(period_label(period), branch))
+        if is_closed(period):
+            report_store.put("monthly", period, branch, version, report)
+        return report
+
+
+def mall_summary() -> str:
+    """Serve the all-malls summary, from the report store when available"""
+    with rag_pipeline.pinned_dataset() as dataset:
+        cached = report_store.get("mall_summary", "all", "", dataset["version"])
+        if cached is not None:
+            return cached
+        summary = rag_pipeline.ask_from_csv(MALL_SUMMARY_QUESTION)
+        report_store.put("mall_summary", "all", "", dataset["version"], summary)
+        return summary
+
+
+def parse_hours(spec: str) -> Tuple[int, int]:
+    start, end = spec.split("-")
+    return int(start) % 24, int(end) % 24
+
+
+def load_distribution() -> Dict[str, Dict[str, List[str]]]:
+    if not DISTRIBUTION_FILE or not os.path.exists(DISTRIBUTION_FILE):
+        return {}
+    with open(DISTRIBUTION_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ReportScheduler:
+    """
+    Background job that pre-generates routine reports during off-peak hours.
+
+    For every closed period it produces the all-branches monthly report and
+    one per branch, plus the mall summary, and stores them with the dataset
+    version. Reports already in the store are skipped, so a run after a data
+    refresh only regenerates what changed. Newly generated reports for the
+    most recent closed period can be pushed to managers by email and WhatsApp.
+    """
+
+    def __init__(self, store: ReportStore = report_store, offpeak_hours: str = DEFAULT_OFFPEAK_HOURS,
+                 interval: int = DEFAULT_INTERVAL, distribute: bool = bool(DISTRIBUTION_FILE)):
+        self.store = store
+        self.offpeak_start, self.offpeak_end = parse_hours(offpeak_hours)
+        self.interval = interval
+        self.distribute = distribute
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.stats = {"runs": 0, "generated": 0, "failed": 0, "distributed": 0, "last_run": None}
+
+    def in_offpeak(self, now: Optional[datetime] = None) -> bool:
+        hour = (now or datetime.now()).hour
+        if self.offpeak_start <= self.offpeak_end:
+            return self.offpeak_start <= hour < self.offpeak_end
+        return hour >= self.offpeak_start or hour < self.offpeak_end
+
+    def pending_jobs(self) -> List[Tuple[str, str, str]]:
+        """(kind, period, branch) reports missing for the current dataset version"""
+        version = rag_pipeline.current_dataset()["version"]
+        jobs = []
+        if not self.store.has("mall_summary", "all", "", version):
+            jobs.append(("mall_summary", "all", ""))
+        for period in reversed(rag_pipeline.available_periods()):
+            if not is_closed(period):
+                continue
+            period_version = rag_pipeline.period_version(period)
+            for branch in [""] + list(rag_pipeline.current_dataset()["branch_names"]):
+                if not self.store.has("monthly", period, branch, period_version):
+                    jobs.append(("monthly", period, branch))
+        return jobs
+
+    def run_once(self, force: bool = False) -> int:
+        """Generate missing reports. Stops early if the off-peak window closes, unless forced"""
+        # A pass generates every report from one dataset version, even if a new one is published meanwhile
+        with rag_pipeline.pinned_dataset():
+            return self._run_pass(force)
+
+    def _run_pass(self, force: bool) -> int:
+        self.stats["runs"] += 1
+        self.stats["last_run"] = time.time()
+        version = rag_pipeline.current_dataset()["version"]
+        periods = [p for p in rag_pipeline.available_periods() if is_closed(p)]
+        latest_closed = periods[-1] if periods else None
+
+        generated = 0
+        for kind, period, branch in self.pending_jobs():
+            if self._stopping.is_set() or (not force and not self.in_offpeak()):
+                print("Off-peak window closed, pausing report pre-generation")
+                break
+            try:
+                if kind == "mall_summary":
+                    content = rag_pipeline.ask_from_csv(MALL_SUMMARY_QUESTION)
+                else:
+                    content = rag_pipeline.ask_from_csv(monthly_report_question(period_label(period), branch))
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Error pre-generating {kind} report for {period} {branch}: {str(e)}")
+                continue
+            self.store.put(kind, period, branch,
+                           version if kind == "mall_summary" else rag_pipeline.period_version(period), content)
+            generated += 1
+            self.stats["generated"] += 1
+            print(f"Pre-generated {kind} report for {period} {branch or '(all branches)'}")
+
+            if self.distribute and kind == "monthly" and period == latest_closed:
+                self._distribute(period, branch, content)
+        else:
+            # Finished the full pass, drop reports from older dataset versions
+            removed = self.store.prune([version] + [rag_pipeline.period_version(p)
+                                                    for p in rag_pipeline.available_periods()])
+            if removed:
+                print(f"Removed {removed} report(s) from older dataset versions")
+        return generated
+
+    def _distribute(self, period: str, branch: str, content: str):
+        distribution = load_distribution()
+        recipients = distribution.get(branch or "*", {})
+        subject = f"Monthly report: {period_label(period)}" + (f" - {branch}" if branch else "")
+
+        emails = recipients.get("email", [])
+        if emails:
+            # Imported lazily so the scheduler can run without SMTP settings
+            from email_outbox import outbox
+            for address in emails:
+                outbox.enqueue(address, subject, content)
+            self.stats["distributed"] += len(emails)
+
+        numbers = recipients.get("whatsapp", [])
+        if numbers:
+            try:
+                response = requests.post(
+                    f"{WHATSAPP_API_URL}/broadcast",
+                    json={"recipients": numbers, "message": f"{subject}\n\n{content}"},
+                    timeout=300,
+                )
+                response.raise_for_status()
+                self.stats["distributed"] += response.json().get("sent", 0)
+            except Exception as e:
+                print(f"Error sending {subject} over WhatsApp: {str(e)}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self.in_offpeak():
+                self.run_once()
+            self._stopping.wait(self.interval)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="report-scheduler", daemon=True)
+        self._thread.start()
+        print(f"Report scheduler started (off-peak hours {self.offpeak_start}:00-{self.offpeak_end}:00)")
+
+    def stop(self):
+        self._stopping.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate and distribute routine financial reports")
+    parser.add_argument("--now", action="store_true", help="Run one pass immediately, ignoring the off-peak window")
+    parser.add_argument("--list", action="store_true", help="List stored reports and exit")
+    args = parser.parse_args()
+
+    scheduler = ReportScheduler()
+    if args.list:
+        for report in report_store.list(rag_pipeline.dataset_version):
+            print(f"{report['kind']:<13} {report['period']:<8} {report['branch'] or '(all branches)'}")
+    elif args.now:
+        print(f"Pending reports: {len(scheduler.pending_jobs())}")
+        print(f"Generated {scheduler.run_once(force=True)} report(s)")
+        if "email_outbox" in sys.modules:
+            # Anything not delivered stays in the spool for the MCP server to send
+            sys.modules["email_outbox"].outbox.flush()
+    else:
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,130 @@
+import calendar
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+# SQLite file shared by the MCP server and the report scheduler
+DEFAULT_STORE_PATH = os.getenv("REPORT_STORE_PATH", os.path.join(os.getcwd(), "reports.db"))
+
+MONTH_NAMES = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_ABBREVIATIONS = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+
+
+def normalize_period(month: str, periods: List[str]) -> Optional[str]:
+    """
+    Resolve a user-supplied month ("February", "feb 2025", "2025-02", "Latest")
+    to a 'YYYY-MM' period present in the data.
+
+    A month without a year resolves to the most recent matching period.
+    Returns None when the month can't be matched to the data.
+    """
+    if not periods:
+        return None
+    text = (month or "").strip().lower()
+
+    match = re.search(r"(\d{4})-(\d{1,2})", text)
+    if match:
+        period = f"{int(match.group(1)):04d}-{int(match.group(2)):02d}"
+        return period if period in periods else None
+
+    if text in ("latest", "recent", "last", "last month"):
+        return periods[-1]
+
+    month_number = None
+    for word in re.findall(r"[a-z]+", text):
+        month_number = MONTH_NAMES.get(word) or MONTH_ABBREVIATIONS.get(word)
+        if month_number:
+            break
+    if not month_number:
+        return None
+
+    year_match = re.search(r"\b(\d{4})\b", text)
+    candidates = [p for p in periods if int(p[5:7]) == month_number]
+    if year_match:
+        candidates = [p for p in candidates if p.startswith(year_match.group(1))]
+    return candidates[-1] if candidates else None
+
+
+def period_label(period: str) -> str:
+    """'2025-02' -> 'February 2025'"""
+    year, month = period.split("-")
+    return f"{calendar.month_name[int(month)]} {year}"
+
+
+class ReportStore:
+    """
+    Persistent store of generated reports keyed by (kind, period, branch, dataset_version).
+
+    Reports are only served for the dataset version they were generated from,
+    so a data refresh naturally invalidates them. Monthly reports of a
+    partitioned dataset use their month's version instead (see
+    rag_pipeline.period_version), so ingesting rows into one month leaves the
+    other months' reports valid.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_STORE_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "kind TEXT NOT NULL, period TEXT NOT NULL, branch TEXT NOT NULL, "
+            "dataset_version TEXT NOT NULL, content TEXT NOT NULL, generated_at REAL NOT NULL, "
+            "PRIMARY KEY (kind, period, branch, dataset_version))"
+        )
+        self._db.commit()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+
+    def get(self, kind: str, period: str, branch: str, dataset_version: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content FROM reports WHERE kind = ? AND period = ? AND branch = ? AND dataset_version = ?",
+                (kind, period, branch, dataset_version),
+            ).fetchone()
+        self.stats["hits" if row else "misses"] += 1
+        return row[0] if row else None
+
+    def hit_ratio(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+
+    def has(self, kind: str, period: str, branch: str, dataset_version: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM reports WHERE kind = ? AND period = ? AND branch = ? AND dataset_version = ?",
+                (kind, period, branch, dataset_version),
+            ).fetchone()
+        return row is not None
+
+    def put(self, kind: str, period: str, branch: str, dataset_version: str, content: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO reports (kind, period, branch, dataset_version, content, generated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, period, branch, dataset_version, content, time.time()),
+            )
+            self._db.commit()
+        self.stats["writes"] += 1
+
+    def list(self, dataset_version: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "SELECT kind, period, branch, dataset_version, generated_at FROM reports"
+        params = ()
+        if dataset_version:
+            query += " WHERE dataset_version = ?"
+            params = (dataset_version,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY period, kind, branch", params).fetchall()
+        return [dict(zip(("kind", "period", "branch", "dataset_version", "generated_at"), row)) for row in rows]
+
+    def prune(self, keep_versions: Iterable[str]) -> int:
+        """Delete reports generated from any other dataset (or period) version"""
+        keep = sorted(set(keep_versions))
+        with self._lock:
+            cursor = self._db.execute(
+                f"DELETE FROM reports WHERE dataset_version NOT IN ({', '.join('?' * len(keep))})", keep)
+            self._db.commit()
+        return cursor.rowcount
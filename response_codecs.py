@@ -0,0 +1,155 @@
+import gzip
+import importlib.util
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# Content negotiation and compression for the bridge's tool and analytics responses.
+#
+# Clients choose the body format with Accept:
+#   application/json                       default
+#   application/msgpack                    same structure, binary (needs ormsgpack or msgpack)
+#   application/vnd.apache.arrow.stream    columnar results as an Arrow IPC stream (needs pyarrow)
+# and the compression with Accept-Encoding (br if brotli is installed, else gzip).
+# Bodies smaller than COMPRESS_MIN_BYTES are sent uncompressed, where the
+# CPU time would cost more than the bytes saved.
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+# Other names clients use for MessagePack
+_MSGPACK_ALIASES = {"application/x-msgpack", "application/vnd.msgpack"}
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 5))
+
+try:
+    import ormsgpack
+
+    def _packb(obj) -> bytes:
+        return ormsgpack.packb(obj)
+
+    def _unpackb(data: bytes):
+        return ormsgpack.unpackb(data)
+except ImportError:
+    try:
+        import msgpack
+
+        def _packb(obj) -> bytes:
+            return msgpack.packb(obj, use_bin_type=True)
+
+        def _unpackb(data: bytes):
+            return msgpack.unpackb(data, raw=False)
+    except ImportError:
+        _packb = _unpackb = None
+
+# pyarrow (and numpy with it) is imported on the first Arrow response, not at startup
+HAS_ARROW = importlib.util.find_spec("pyarrow") is not None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _parse_accept(header: str) -> List[Tuple[str, float]]:
+    """Media types from an Accept header with their q values, best first"""
+    ranges = []
+    for position, part in enumerate(filter(None, (p.strip() for p in (header or "").split(",")))):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = MSGPACK if media_type.lower() in _MSGPACK_ALIASES else media_type.lower()
+        ranges.append((media_type, quality, position))
+    ranges.sort(key=lambda r: (-r[1], r[2]))
+    return [(media_type, quality) for media_type, quality, _ in ranges]
+
+
+def negotiate(accept: str, tabular: bool = False) -> str:
+    """The response format for an Accept header; JSON unless the client prefers one we can produce"""
+    available = {JSON, "*/*", "application/*"}
+    if _packb is not None:
+        available.add(MSGPACK)
+    if tabular and HAS_ARROW:
+        available.add(ARROW)
+    for media_type, quality in _parse_accept(accept):
+        if quality > 0 and media_type in available:
+            return JSON if "*" in media_type else media_type
+    return JSON
+
+
+def to_arrow(columns: Dict[str, list], metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """Columns as an Arrow IPC stream; `metadata` values are stored JSON-encoded in the schema"""
+    import pyarrow
+    import pyarrow.ipc
+
+    # Repeated labels (branch names, statuses) are dictionary-encoded, as pandas categoricals are
+    table = pyarrow.table({name: pyarrow.array(values).dictionary_encode()
+                           if values and all(isinstance(v, str) for v in values) else values
+                           for name, values in columns.items()})
+    if metadata:
+        table = table.replace_schema_metadata({key: json.dumps(value) for key, value in metadata.items()})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(payload: Any, media_type: str, table: Optional[Dict[str, Any]] = None,
+           json_text: Optional[str] = None) -> bytes:
+    """
+    Serialize a response body. `table` ({"columns": ..., other fields as metadata})
+    is what Arrow encodes; `json_text` is sent as is for JSON instead of re-encoding.
+    """
+    if media_type == MSGPACK:
+        return _packb(payload)
+    if media_type == ARROW:
+        table = table or payload
+        return to_arrow(table["columns"], {key: value for key, value in table.items() if key != "columns"})
+    if json_text is not None:
+        return json_text.encode()
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def compress(body: bytes, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    """Compress `body` if it is large enough and the client accepts br or gzip"""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in accepted:
+        # Brotli quality 0-11; map the shared 1-9 level onto it
+        return brotli.compress(body, quality=min(11, COMPRESS_LEVEL)), "br"
+    if "gzip" in accepted:
+        return gzip.compress(body, compresslevel=COMPRESS_LEVEL), "gzip"
+    return body, None
+
+
+def respond(request, payload: Any, table: Optional[Dict[str, Any]] = None, json_text: Optional[str] = None):
+    """A FastAPI Response with the format and compression the request asked for"""
+    from fastapi import Response
+
+    media_type = negotiate(request.headers.get("accept", ""), tabular=table is not None)
+    body, encoding = compress(encode(payload, media_type, table, json_text),
+                              request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def decode(body: bytes, media_type: str) -> Any:
+    """Client side: parse a JSON or MessagePack body (transport compression is undone by the HTTP client)"""
+    if media_type.split(";")[0].strip().lower() in {MSGPACK, *_MSGPACK_ALIASES}:
+        return _unpackb(body)
+    return json.loads(body)
+
+
+def accept_header() -> str:
+    """Accept value for Python clients: MessagePack when it can be decoded here, JSON otherwise"""
+    return f"{MSGPACK}, {JSON};q=0.9" if _unpackb is not None else JSON
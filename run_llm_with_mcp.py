@@ -2,7 +2,6 @@ import asyncio
 from contextlib import AsyncExitStack
 from mcp import ClientSession
 from mcp.client.sse import sse_client
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 import json
@@ -12,13 +11,11 @@ import sys
 from datetime import datetime
 import base64
 import time
+from agent_loop import DEFAULT_SYSTEM_PROMPT, model, openai_tools, run_agent
 
 # Load .env
 load_dotenv()
 
-client = OpenAI()
-model = os.environ.get("MODEL", "gpt-4.1-nano")
-
 class ConnectionManager:
     def __init__(self, sse_server_map):
         self.sse_server_map = sse_server_map
@@ -80,53 +77,23 @@ class ConnectionManager:
             await self.exit_stack.aclose()
 
 
-# Chat function with OpenAI and tool calling
+# Chat function with OpenAI and tool calling (the loop itself lives in agent_loop.py)
 async def chat(input_messages, tool_map, tools, max_turns=3, connection_manager=None):
-    chat_messages = input_messages[:]
-
-    for _ in range(max_turns):
-        result = client.chat.completions.create(
-            model=model,
-            messages=chat_messages,
-            tools=tools,
-        )
-
-        if result.choices[0].finish_reason == "tool_calls":
-            chat_messages.append(result.choices[0].message)
-
-            for tool_call in result.choices[0].message.tool_calls:
-                tool_name = tool_call.function.name
-                tool_args = json.loads(tool_call.function.arguments)
-                server_name = tool_map.get(tool_name, "")
-
-                print(f"\n Tool Call: `{tool_name}` from `{server_name}`")
-                print("Arguments:")
-                print(json.dumps(tool_args, indent=2))
+    async def call_tool(tool_name, tool_args):
+        print(f"\n Tool Call: `{tool_name}` from `{tool_map.get(tool_name, '')}`")
+        print("Arguments:")
+        print(json.dumps(tool_args, indent=2))
+        observation = await connection_manager.call_tool(tool_name, tool_args, tool_map)
+        print("\n Tool Observation:")
+        print(json.dumps(observation, indent=2))
+        return observation
 
-                observation = await connection_manager.call_tool(
-                    tool_name, tool_args, tool_map
-                )
-
-                print("\n Tool Observation:")
-                print(json.dumps(observation, indent=2))
-
-                chat_messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": str(observation),
-                })
-        else:
+    async for event in run_agent(input_messages, tools, call_tool, max_turns=max_turns):
+        if event["type"] == "done":
+            print(f"\n History compaction saved {event['tokens_saved']} tokens")
             print("\n Assistant:")
-            print(result.choices[0].message.content)
-            return result.choices[0].message.content
-
-    # Final response
-    result = client.chat.completions.create(
-        model=model,
-        messages=chat_messages,
-    )
-    print("\n Final Assistant Response:")
-    return str(result.choices[0].message.content)
+            print(event["content"])
+            return event["content"]
 
 # Helper function for background images
 def add_bg_from_local(image_file):
@@ -415,17 +382,7 @@ if __name__ == "__main__":
             if not tool_objects:
                 st.warning("No tools were found on the MCP server. Make sure the server is properly configured.")
 
-            tools_json = [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": tool.inputSchema,
-                    },
-                }
-                for tool in tool_objects
-            ]
+            tools_json = openai_tools(tool_objects)
             
             # Display chat container
             chat_container = st.container()
@@ -473,7 +430,7 @@ if __name__ == "__main__":
                     
                     with st.spinner("Processing your request..."):
                         input_messages = [
-                            {"role": "system", "content": "You are a Smart Financial Advisor specialized in analyzing retail transaction data from Jordan malls. You can analyze sales performance, identify patterns, and generate insights from transaction data. You should respond with specific data and insights, and suggest actionable business recommendations when appropriate."},
+                            {"role": "system", "content": DEFAULT_SYSTEM_PROMPT},
                             {"role": "user", "content": question},
                         ]
 
@@ -12,9 +12,8 @@ WHATSAPP_PORT = 8002
 def start_whatsapp_server():
     """Start the WhatsApp integration server as a subprocess"""
     print("Starting WhatsApp Integration server...")
-    process = subprocess.Popen([sys.executable, "whatsapp_integration.py"], 
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE)
+    # Output goes straight to this console; an unread PIPE would block the server once its buffer filled
+    process = subprocess.Popen([sys.executable, "whatsapp_integration.py"])
     return process
 
 def setup_ngrok_tunnel(port):
@@ -42,18 +41,21 @@ def update_twilio_webhook(webhook_url):
     return webhook_endpoint
 
 def check_whatsapp_server(timeout=60):
-    """Check if the WhatsApp server is running"""
+    """Wait until the WhatsApp server answers /livez, then report whether it is ready"""
     start_time = time.time()
     while time.time() - start_time < timeout:
         try:
-            response = requests.get(f"http://localhost:{WHATSAPP_PORT}/status")
+            response = requests.get(f"http://localhost:{WHATSAPP_PORT}/livez", timeout=1)
             if response.status_code == 200:
                 print("WhatsApp server is running!")
+                # The tunnel can open now; replies need the bridge too, which /readyz checks
+                ready = requests.get(f"http://localhost:{WHATSAPP_PORT}/readyz", timeout=2)
+                if ready.status_code != 200:
+                    print("Note: the Next.js bridge is not ready yet; messages will fail until it is.")
                 return True
-        except:
+        except requests.RequestException:
             pass
-        time.sleep(1)
-        print("Waiting for WhatsApp server to start...")
+        time.sleep(0.2)
     
     print("Failed to connect to WhatsApp server within timeout period.")
     return False
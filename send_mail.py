@@ -4,25 +4,56 @@ from email.message import EmailMessage
 import os
 from dotenv import load_dotenv
 
-def send_email(receiver: str, subject: str, body: str) -> str:
-    """Send an Email to a given recipient with a subject and message"""
-    load_dotenv()
+load_dotenv()
 
-    sender_email = os.getenv("SENDER_EMAIL")
-    app_password = os.getenv("APP_PASSWORD")
 
-    if not sender_email or not app_password:
-        return "❌ Error: Sender email or app password not found in environment variables."
+def smtp_settings() -> dict:
+    """SMTP connection settings. Defaults to Gmail over SSL; override for a local stand-in"""
+    return {
+        "host": os.getenv("SMTP_HOST", "smtp.gmail.com"),
+        "port": int(os.getenv("SMTP_PORT", 465)),
+        # "ssl" (implicit TLS), "starttls" or "none"
+        "security": os.getenv("SMTP_SECURITY", "ssl").lower(),
+        "sender_email": os.getenv("SENDER_EMAIL"),
+        "app_password": os.getenv("APP_PASSWORD"),
+        "timeout": float(os.getenv("SMTP_TIMEOUT", 30)),
+    }
+
 
+def open_smtp_connection(settings: dict) -> smtplib.SMTP:
+    """Open and authenticate an SMTP connection that can send many messages"""
+    if settings["security"] == "ssl":
+        server = smtplib.SMTP_SSL(settings["host"], settings["port"], timeout=settings["timeout"])
+    else:
+        server = smtplib.SMTP(settings["host"], settings["port"], timeout=settings["timeout"])
+        if settings["security"] == "starttls":
+            server.starttls()
+    if settings["app_password"]:
+        server.login(settings["sender_email"], settings["app_password"])
+    return server
+
+
+def build_message(sender_email: str, receiver: str, subject: str, body: str) -> EmailMessage:
     msg = EmailMessage()
     msg["From"] = sender_email
     msg["To"] = receiver
     msg["Subject"] = subject
     msg.set_content(body)
+    return msg
+
+
+def send_email(receiver: str, subject: str, body: str) -> str:
+    """Send an Email to a given recipient with a subject and message"""
+    settings = smtp_settings()
+    sender_email = settings["sender_email"]
+
+    if not sender_email or (settings["security"] == "ssl" and not settings["app_password"]):
+        return "❌ Error: Sender email or app password not found in environment variables."
+
+    msg = build_message(sender_email, receiver, subject, body)
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, app_password)
+        with open_smtp_connection(settings) as server:
             server.send_message(msg)
         return "✅ Email sent successfully! write the inform to confirm"
     except Exception as e:
@@ -0,0 +1,288 @@
+import math
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from timeseries import DIMENSIONS, VALUES, bucket_end, bucket_start, dimension_codes, dimension_labels
+
+# Mergeable sketches for percentiles and distinct counts.
+#
+# Exact percentiles and distinct counts need a sort or a hash set over every
+# matching row. Alongside the rollups, each dataset keeps small summaries per
+# (day or month, mall, branch, status, type) that combine by simple arithmetic:
+#   quantiles  a log-bucketed histogram of amount and of tax (the DDSketch
+#              scheme): bin i counts values in (gamma^(i-1), gamma^i], with
+#              gamma = (1 + a) / (1 - a). Any quantile read from merged bins is
+#              within a = SKETCH_RELATIVE_ACCURACY (default 1%) of the true
+#              value at that rank. Merging adds counts per bin.
+#   distinct   HyperLogLog registers (2^SKETCH_HLL_PRECISION of them, default
+#              4096) of transaction ids and of id prefixes (the id without its
+#              last "-" part). The relative standard error is 1.04 / sqrt(m),
+#              1.6% by default. Merging takes the maximum per register.
+# Both are kept as long tables (one row per group and non-empty bin or
+# register), so selecting labels is a mask and merging across days, branches,
+# malls and partitions is one vectorized group-and-reduce. Like the rollups,
+# there is a daily and a monthly level: a range reads whole months from the
+# monthly tables and only its edge days from the daily ones. A table holds at
+# most one row per group and bin/register, however many transactions the
+# group has, so the rows a query reads stop growing with the data. The
+# query_engine.py median, pNN and distinct aggregates are answered from them.
+
+RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", 0.01))
+HLL_PRECISION = int(os.getenv("SKETCH_HLL_PRECISION", 12))
+# Rows hashed and binned at a time while building, which bounds the temporary copies
+BUILD_CHUNK_ROWS = int(os.getenv("SKETCH_CHUNK_ROWS", 1_000_000))
+
+DISTINCT_FIELDS = ["id", "prefix"]
+KEYS = ["t", *DIMENSIONS]
+
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+# Values at or below MIN_VALUE (zero tax, say) share one bin that reads back as 0
+MIN_VALUE = 1e-9
+ZERO_BIN = np.iinfo(np.int32).min
+
+REGISTERS = 1 << HLL_PRECISION
+DISTINCT_ERROR = 1.04 / math.sqrt(REGISTERS)
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+_SEED = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def error_bound(fn: str) -> Dict[str, float]:
+    """The stated error of a sketch aggregate, for responses"""
+    if fn == "distinct":
+        return {"relative_standard_error": round(DISTINCT_ERROR, 4), "relative_error_95": round(2 * DISTINCT_ERROR, 4)}
+    return {"relative_error": RELATIVE_ACCURACY}
+
+
+# ---- quantile bins ----
+
+def value_bins(values: np.ndarray) -> np.ndarray:
+    bins = np.full(len(values), ZERO_BIN, dtype=np.int32)
+    positive = values > MIN_VALUE
+    bins[positive] = np.ceil(np.log(values[positive]) / _LOG_GAMMA).astype(np.int32)
+    return bins
+
+
+def bin_values(bins: np.ndarray) -> np.ndarray:
+    """The value each bin stands for: within RELATIVE_ACCURACY of everything it counted"""
+    values = np.zeros(len(bins))
+    nonzero = bins != ZERO_BIN
+    values[nonzero] = 2 * np.power(GAMMA, bins[nonzero].astype(np.float64)) / (GAMMA + 1)
+    return values
+
+
+# ---- distinct counts ----
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer; uint64 arithmetic wraps
+    x = (x ^ (x >> np.uint64(30))) * _MIX1
+    x = (x ^ (x >> np.uint64(27))) * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_ids(ids: np.ndarray, prefix: bool = False) -> np.ndarray:
+    """64-bit hashes of transaction ids (bytes or str); of the id up to its last "-" with `prefix`"""
+    if ids.dtype.kind != "S":
+        ids = np.char.encode(np.asarray(ids, dtype=str), "utf-8")
+    # Ids up to 32 bytes hash the same whatever width their array has
+    width = max(32, -(-ids.dtype.itemsize // 8) * 8)
+    raw = np.ascontiguousarray(ids, dtype=f"S{width}").view(np.uint8).reshape(len(ids), width)
+    if prefix:
+        dash = raw == ord("-")
+        last = width - 1 - np.argmax(dash[:, ::-1], axis=1)
+        cut = np.where(dash.any(axis=1), last, width)
+        raw = np.where(np.arange(width) < cut[:, None], raw, 0).astype(np.uint8)
+    words = np.ascontiguousarray(raw).view(np.uint64)
+    hashes = np.full(len(ids), _SEED, dtype=np.uint64)
+    for column in words.T:
+        hashes = _mix(hashes ^ column)
+    return hashes
+
+
+def hll_registers(hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Register (top bits) and rank (position of the first 1 in the remaining bits) of each hash"""
+    width = 64 - HLL_PRECISION
+    registers = (hashes >> np.uint64(width)).astype(np.int32)
+    rest = hashes & np.uint64((1 << width) - 1)
+    bits = np.zeros(len(hashes), dtype=np.int64)
+    nonzero = rest > 0
+    bits[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+    return registers, (width - bits + 1).astype(np.uint8)
+
+
+def _groups(frame: pd.DataFrame, keys: List[str]) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Frame sorted so each group of `keys` is contiguous, and each row's group number"""
+    if not keys:
+        return frame, np.zeros(len(frame), dtype=np.int64)
+    frame = frame.sort_values(keys, kind="stable", ignore_index=True)
+    return frame, frame.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+
+
+def quantiles(frame: pd.DataFrame, keys: List[str], wanted: Dict[str, float]) -> pd.DataFrame:
+    """
+    Per group of `keys`, from merged bin counts (columns keys, bin, count): the value at rank
+    floor(q * (n - 1)) for each column name -> q in `wanted`
+    """
+    frame, group = _groups(frame.sort_values("bin", kind="stable"), keys)
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(frame) else np.empty(0, dtype=np.int64)
+    cumulative = np.cumsum(frame["count"].to_numpy(dtype=np.int64))
+    before = np.r_[0, cumulative][starts]
+    totals = np.r_[cumulative[starts[1:] - 1], cumulative[-1:]] - before
+    result = frame.iloc[starts][keys].reset_index(drop=True)
+    bins = frame["bin"].to_numpy()
+    for name, q in wanted.items():
+        rank = np.floor(q * (totals - 1))
+        result[name] = bin_values(bins[np.searchsorted(cumulative, before + rank, side="right")])
+    return result
+
+
+def distinct_counts(frame: pd.DataFrame, keys: List[str], name: str) -> pd.DataFrame:
+    """Per group of `keys`, the HyperLogLog estimate from merged registers (columns keys, register, rank)"""
+    frame, group = _groups(frame, keys)
+    n = int(group.max()) + 1 if len(group) else 0
+    present = np.bincount(group, minlength=n)
+    empty = REGISTERS - present
+    total = np.bincount(group, weights=np.power(2.0, -frame["rank"].to_numpy(dtype=np.float64)), minlength=n) + empty
+    estimate = _HLL_ALPHA * REGISTERS ** 2 / total
+    # Few distinct values: linear counting over the empty registers is more accurate
+    small = (estimate <= 2.5 * REGISTERS) & (empty > 0)
+    estimate[small] = REGISTERS * np.log(REGISTERS / empty[small])
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(frame) else np.empty(0, dtype=np.int64)
+    result = frame.iloc[starts][keys].reset_index(drop=True)
+    result[name] = np.round(estimate).astype(np.int64)
+    return result
+
+
+# ---- per-dataset sketches ----
+
+# How each kind of sketch table merges: (bin or register column, its value, how values combine)
+REDUCE = {"quantile": ("bin", "count", "sum"), "distinct": ("register", "rank", "max")}
+LEVELS = ["day", "month"]
+
+
+def _reduce(frame: pd.DataFrame, kind: str) -> pd.DataFrame:
+    column, value, how = REDUCE[kind]
+    return frame.groupby(KEYS + [column], sort=False)[value].agg(how).reset_index()
+
+
+class Sketches:
+    """Quantile and distinct-count sketches per day and per month, mall, branch, status and type"""
+
+    def __init__(self, labels: Dict[str, List[str]]):
+        # Category labels per dimension, as in the rollups; tables store codes
+        self.labels = labels
+        # (kind, field) -> {"day": table, "month": table}, where a table has the key columns
+        # t, mall, branch, status, type plus bin, count (quantile) or register, rank (distinct)
+        self.tables: Dict[Tuple[str, str], Dict[str, pd.DataFrame]] = {}
+        # Distinct counts are only kept while every added row came with its id
+        self.has_ids = True
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, ids: Optional[np.ndarray] = None) -> "Sketches":
+        sketches = cls(dimension_labels(df))
+        sketches.add(df, ids)
+        return sketches
+
+    def add(self, df: pd.DataFrame, ids: Optional[np.ndarray] = None):
+        """Merge transactions into the sketches; `ids` when transaction_id is not a column of `df`"""
+        if df.empty:
+            return
+        if ids is None and "transaction_id" in df:
+            ids = df["transaction_id"].to_numpy()
+        self.add_chunks((df.iloc[start:start + BUILD_CHUNK_ROWS],
+                         None if ids is None else ids[start:start + BUILD_CHUNK_ROWS])
+                        for start in range(0, len(df), BUILD_CHUNK_ROWS))
+
+    def add_chunks(self, chunks: Iterable[Tuple[pd.DataFrame, Optional[np.ndarray]]]):
+        """Merge (rows, ids) chunks; each is reduced on its own and all are merged once at the end"""
+        with self._lock:
+            parts = {key: [tables["day"]] for key, tables in self.tables.items()}
+            has_ids = self.has_ids
+            for df, ids in chunks:
+                ns = df["transaction_date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+                base = {"t": bucket_start(ns, "day"), **dimension_codes(df, self.labels)}
+                for measure, column in VALUES.items():
+                    rows = pd.DataFrame({**base, "bin": value_bins(df[column].to_numpy(dtype=np.float64)), "count": 1})
+                    parts.setdefault(("quantile", measure), []).append(_reduce(rows, "quantile"))
+                has_ids = has_ids and ids is not None
+                if has_ids:
+                    for field in DISTINCT_FIELDS:
+                        registers, ranks = hll_registers(hash_ids(ids, prefix=field == "prefix"))
+                        rows = pd.DataFrame({**base, "register": registers, "rank": ranks})
+                        parts.setdefault(("distinct", field), []).append(_reduce(rows, "distinct"))
+            tables = {}
+            for (kind, field), frames in parts.items():
+                if kind == "distinct" and not has_ids:
+                    continue
+                day = frames[0] if len(frames) == 1 else _reduce(pd.concat(frames, ignore_index=True), kind)
+                month = _reduce(day.assign(t=bucket_start(day["t"].to_numpy(), "month")), kind)
+                tables[(kind, field)] = {"day": day, "month": month}
+            # Swap all tables at once so queries never mix old and new sketches
+            self.tables = tables
+            self.has_ids = has_ids
+
+    def rows(self, kind: str, field: str, start: Optional[int] = None, end: Optional[int] = None,
+             daily: bool = False) -> pd.DataFrame:
+        """
+        Sketch rows covering exactly [start, end) (epoch ns, day-aligned), t set to each row's day
+        or month start: whole months from the monthly table unless `daily`, the rest from the daily one
+        """
+        if (kind, field) not in self.tables:
+            if kind == "distinct":
+                raise ValueError("Distinct counts need transaction ids, which this dataset does not have")
+            return pd.DataFrame({c: [] for c in KEYS + list(REDUCE[kind][:2])})
+        tables = self.tables[(kind, field)]
+        if start is None and end is None:
+            return tables["day" if daily else "month"]
+        day = tables["day"]
+        dt = day["t"].to_numpy()
+        in_range = np.ones(len(day), dtype=bool)
+        if start is not None:
+            in_range &= dt >= start
+        if end is not None:
+            in_range &= dt < end
+        if daily:
+            return day[in_range]
+        month = tables["month"]
+        mt = month["t"].to_numpy()
+        inside = np.ones(len(month), dtype=bool)
+        if start is not None:
+            inside &= mt >= start
+        if end is not None:
+            inside &= bucket_end(mt, "month") <= end
+        if not inside.any():
+            return day[in_range]
+        # The whole months are contiguous; days before and after them come from the daily table
+        first, last = mt[inside].min(), bucket_end(mt[inside].max(keepdims=True), "month")[0]
+        edge = in_range & ((dt < first) | (dt >= last))
+        return pd.concat([month[inside], day[edge]], ignore_index=True)
+
+    def nbytes(self) -> int:
+        return sum(int(table.memory_usage(index=False).sum())
+                   for tables in self.tables.values() for table in tables.values())
+
+
+_build_lock = threading.Lock()
+
+
+def sketches_for(dataset: Dict[str, Any]) -> Sketches:
+    """The dataset's sketches, built on first use and kept with the dataset"""
+    if "sketches" not in dataset:
+        with _build_lock:
+            if "sketches" not in dataset:
+                if dataset["db"] is not None:
+                    # Read through once in chunks; the sketches stay in memory, the rows do not
+                    sketches = Sketches({dimension: [] for dimension in DIMENSIONS})
+                    sketches.add_chunks((chunk, chunk["transaction_id"].to_numpy()) for chunk in dataset["db"].chunks())
+                else:
+                    sketches = Sketches.build(dataset["df"], dataset.get("ids"))
+                dataset["sketches"] = sketches
+    return dataset["sketches"]
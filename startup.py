@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Fast start: bind the port first, warm up afterwards.
+#
+# Importing pandas, the LLM clients and the transactions data takes seconds,
+# and until now it all happened before a server listened, so supervisors and
+# health checks saw a dead port. Servers now import those modules where they
+# are first used and run a Warmup in a background thread once they listen:
+# named steps that load the dataset, build indexes and fill caches.
+#
+#   /livez   200 as soon as the process serves HTTP (restart it if this fails)
+#   /readyz  503 until every warmup step finished, then 200 (send traffic once this passes)
+#
+# A request that arrives before its step ran simply does the work itself;
+# Python's import lock and the dataset's load lock make it wait for a step
+# already in progress instead of repeating it. FAST_START=0 runs the warmup
+# before the server starts listening, as before.
+#
+# Readiness checks may block (e.g. an HTTP call to a dependency): a probe
+# evaluates each once, off the event loop, and reuses a result for the
+# check's ttl seconds so frequent probes do not pile up calls.
+
+FAST_START = os.getenv("FAST_START", "1") != "0"
+
+
+class Warmup:
+    def __init__(self, service: str):
+        self.service = service
+        self.steps: List[Tuple[str, Callable[[], Any]]] = []
+        # Extra readiness conditions (e.g. "MCP sessions connected") checked on /readyz, with their ttl
+        self.checks: List[Tuple[str, Callable[[], bool], float]] = []
+        self._check_results: Dict[str, Tuple[float, bool]] = {}
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.time()
+        self.finished = threading.Event()
+
+    def step(self, name: str, fn: Callable[[], Any]) -> "Warmup":
+        self.steps.append((name, fn))
+        self.state[name] = {"status": "pending"}
+        return self
+
+    def check(self, name: str, fn: Callable[[], bool], ttl: float = 0) -> "Warmup":
+        """Add a readiness condition; its result is reused for `ttl` seconds"""
+        self.checks.append((name, fn, ttl))
+        return self
+
+    def run(self):
+        """Run every step in order; a failed step is reported and keeps the service unready"""
+        for name, fn in self.steps:
+            self.state[name] = {"status": "running"}
+            started = time.perf_counter()
+            try:
+                fn()
+                self.state[name] = {"status": "done", "seconds": round(time.perf_counter() - started, 3)}
+            except Exception as e:
+                traceback.print_exc()
+                self.state[name] = {"status": "failed", "error": f"{type(e).__name__}: {str(e)}"}
+        self.finished.set()
+        failed = [name for name, state in self.state.items() if state["status"] == "failed"]
+        print(f"{self.service} warmup finished in {time.time() - self.started_at:.2f}s"
+              + (f" (failed: {', '.join(failed)})" if failed else ""))
+
+    def start(self, background: Optional[bool] = None):
+        """Warm up in a background thread (FAST_START) or right here"""
+        if background if background is not None else FAST_START:
+            threading.Thread(target=self.run, name=f"{self.service}-warmup", daemon=True).start()
+        else:
+            self.run()
+
+    def _warmed(self) -> bool:
+        return self.finished.is_set() and all(s["status"] == "done" for s in self.state.values())
+
+    def ready(self) -> bool:
+        return self._warmed() and all(self._run_checks().values())
+
+    def _run_checks(self) -> Dict[str, bool]:
+        """Every check's result, each evaluated at most once per call (or taken from its ttl cache)"""
+        results = {}
+        for name, fn, ttl in self.checks:
+            cached = self._check_results.get(name)
+            if cached is not None and time.monotonic() - cached[0] < ttl:
+                results[name] = cached[1]
+                continue
+            try:
+                results[name] = bool(fn())
+            except Exception:
+                results[name] = False
+            self._check_results[name] = (time.monotonic(), results[name])
+        return results
+
+    def status(self) -> Dict[str, Any]:
+        checks = self._run_checks()
+        return {
+            "service": self.service,
+            "ready": self._warmed() and all(checks.values()),
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "steps": self.state,
+            "checks": checks,
+        }
+
+    async def livez(self, request=None):
+        from starlette.responses import JSONResponse
+
+        return JSONResponse({"status": "alive", "service": self.service})
+
+    async def readyz(self, request=None):
+        from starlette.responses import JSONResponse
+
+        # Checks may block; keep them off the event loop
+        status = await asyncio.to_thread(self.status) if self.checks else self.status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    def add_routes(self, app):
+        """Serve /livez and /readyz from a FastAPI/Starlette app"""
+        app.add_api_route("/livez", self.livez, methods=["GET"], include_in_schema=False)
+        app.add_api_route("/readyz", self.readyz, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,412 @@
+import argparse
+import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from rate_limit import TokenBucket
+
+# Online anomaly detection on the ingestion path.
+#
+# Every transaction handed to partitions.ingest() passes through per-branch
+# detectors before the batch returns, so a failure spike reaches managers
+# within seconds of being ingested rather than at the next report:
+#   failure_rate   EWMA of the failure indicator over roughly the branch's last
+#                  1/ALERT_FAST_ALPHA transactions, against a fixed floor and a
+#                  multiple of the branch's slow (long-run) EWMA failure rate
+#   failure_burst  failed transactions in a sliding event-time window, kept as
+#                  a ring of per-minute counters with a running total
+#   amount_outlier z-score of log(amount) against the branch's exponentially
+#                  weighted mean and variance
+# Each event costs O(1) and each branch holds a fixed handful of numbers plus
+# the ring; at most ALERT_MAX_BRANCHES branches are tracked (least recently
+# seen dropped), so memory is bounded whatever the stream. The state is saved
+# next to the partitioned dataset, so baselines carry over between ingests.
+#
+# Alerts are deduplicated per (kind, branch) for ALERT_DEDUP_SECONDS, capped
+# overall at ALERT_RATE_PER_MINUTE, and delivered off the ingest thread to the
+# sinks in ALERT_SINKS ("log", "whatsapp", "email"). Recipients come from
+# ALERT_DISTRIBUTION_FILE (default REPORT_DISTRIBUTION_FILE), same format:
+#   {"*": {"email": [...], "whatsapp": [...]}, "Z Mall Al Bayader": {...}}
+# A branch's alert goes to its own recipients and to those under "*".
+#
+#   python stream_alerts.py replay pdfs/jordan_transactions.csv   # tune thresholds on history
+
+STATE_FILE = "alert_state.json"
+FAILED_STATUS = "Failed"
+
+FAST_ALPHA = float(os.getenv("ALERT_FAST_ALPHA", 0.1))
+SLOW_ALPHA = float(os.getenv("ALERT_SLOW_ALPHA", 0.005))
+AMOUNT_ALPHA = float(os.getenv("ALERT_AMOUNT_ALPHA", 0.02))
+# Transactions a branch must have seen before its rate and amount detectors fire
+MIN_EVENTS = int(os.getenv("ALERT_MIN_EVENTS", 30))
+FAILURE_RATE = float(os.getenv("ALERT_FAILURE_RATE", 0.35))
+FAILURE_RATIO = float(os.getenv("ALERT_FAILURE_RATIO", 3.0))
+BURST_WINDOW_SECONDS = int(os.getenv("ALERT_BURST_WINDOW", 600))
+BURST_BUCKET_SECONDS = 60
+BURST_FAILURES = int(os.getenv("ALERT_BURST_FAILURES", 5))
+AMOUNT_Z = float(os.getenv("ALERT_AMOUNT_Z", 4.5))
+MAX_BRANCHES = int(os.getenv("ALERT_MAX_BRANCHES", 10000))
+
+DEDUP_SECONDS = float(os.getenv("ALERT_DEDUP_SECONDS", 900))
+RATE_PER_MINUTE = float(os.getenv("ALERT_RATE_PER_MINUTE", 30))
+SINKS = os.getenv("ALERT_SINKS", "log")
+DISTRIBUTION_FILE = os.getenv("ALERT_DISTRIBUTION_FILE", os.getenv("REPORT_DISTRIBUTION_FILE"))
+QUEUE_SIZE = 1000
+
+
+class BranchState:
+    """Detector state of one branch: a fixed set of numbers and the burst ring"""
+
+    __slots__ = ("mall", "events", "fail_fast", "fail_slow", "amount_mean", "amount_var",
+                 "ring", "ring_start", "ring_total")
+
+    def __init__(self, mall: str):
+        self.mall = mall
+        self.events = 0
+        self.fail_fast = 0.0
+        self.fail_slow = 0.0
+        self.amount_mean = 0.0
+        self.amount_var = 0.0
+        n = max(1, BURST_WINDOW_SECONDS // BURST_BUCKET_SECONDS)
+        self.ring = [0] * n
+        # Minute number of ring[0]'s current slot owner; the window is [ring_start, ring_start + n)
+        self.ring_start = 0
+        self.ring_total = 0
+
+    def add_failure(self, minute: int) -> int:
+        """Count a failure at `minute`; returns the failures in the window ending there"""
+        n = len(self.ring)
+        newest = self.ring_start + n - 1
+        if minute > newest:
+            # Slide forward, clearing at most n slots
+            shift = minute - newest
+            if shift >= n:
+                self.ring = [0] * n
+                self.ring_total = 0
+            else:
+                for m in range(newest + 1, minute + 1):
+                    slot = m % n
+                    self.ring_total -= self.ring[slot]
+                    self.ring[slot] = 0
+            self.ring_start = minute - n + 1
+        elif minute < self.ring_start:
+            # Older than the window: too late to be part of a burst
+            return self.ring_total
+        self.ring[minute % n] += 1
+        self.ring_total += 1
+        return self.ring_total
+
+    def to_list(self) -> list:
+        return [self.mall, self.events, self.fail_fast, self.fail_slow, self.amount_mean,
+                self.amount_var, self.ring, self.ring_start, self.ring_total]
+
+    @classmethod
+    def from_list(cls, values: list) -> "BranchState":
+        state = cls(values[0])
+        (state.events, state.fail_fast, state.fail_slow, state.amount_mean,
+         state.amount_var, ring, state.ring_start, state.ring_total) = values[1:]
+        if len(ring) == len(state.ring):
+            state.ring = ring
+        else:
+            # Window setting changed since the state was saved
+            state.ring_start, state.ring_total = 0, 0
+        return state
+
+
+def _alert(kind: str, branch: str, state: BranchState, timestamp: int, message: str,
+           value: float, threshold: float) -> Dict[str, Any]:
+    return {"kind": kind, "branch": branch, "mall": state.mall,
+            "transaction_time": pd.Timestamp(timestamp, unit="s").strftime("%Y-%m-%d %H:%M"),
+            "value": round(value, 4), "threshold": round(threshold, 4), "message": message}
+
+
+class AnomalyDetector:
+    """Per-branch streaming detectors; observe() is O(1) per transaction"""
+
+    def __init__(self, max_branches: int = MAX_BRANCHES):
+        self.max_branches = max_branches
+        self.branches: "OrderedDict[str, BranchState]" = OrderedDict()
+
+    def _branch(self, branch: str, mall: str) -> BranchState:
+        state = self.branches.get(branch)
+        if state is None:
+            state = self.branches[branch] = BranchState(mall)
+            if len(self.branches) > self.max_branches:
+                self.branches.popitem(last=False)
+        else:
+            self.branches.move_to_end(branch)
+        return state
+
+    def observe(self, branch: str, mall: str, timestamp: int, failed: bool, amount: float) -> List[Dict[str, Any]]:
+        """Update the branch's detectors with one transaction; returns the alerts it triggers"""
+        state = self._branch(branch, mall)
+        alerts = []
+        state.events += 1
+        x = 1.0 if failed else 0.0
+        state.fail_fast += FAST_ALPHA * (x - state.fail_fast)
+        # The baseline is what the branch usually looks like, so it is compared before it absorbs x;
+        # dividing by the weight seen so far removes the EWMA's pull towards its zero start
+        seen = 1 - (1 - SLOW_ALPHA) ** (state.events - 1)
+        baseline = state.fail_slow / seen if seen > 0 else 0.0
+        state.fail_slow += SLOW_ALPHA * (x - state.fail_slow)
+        warmed = state.events >= MIN_EVENTS
+
+        if failed:
+            threshold = max(FAILURE_RATE, FAILURE_RATIO * baseline)
+            if warmed and state.fail_fast >= threshold:
+                alerts.append(_alert(
+                    "failure_rate", branch, state, timestamp,
+                    f"Failure spike at {branch} ({state.mall}): about {state.fail_fast:.0%} of recent "
+                    f"transactions failed, usually {baseline:.0%}",
+                    state.fail_fast, threshold))
+            in_window = state.add_failure(timestamp // BURST_BUCKET_SECONDS)
+            if in_window >= BURST_FAILURES:
+                alerts.append(_alert(
+                    "failure_burst", branch, state, timestamp,
+                    f"Burst of failures at {branch} ({state.mall}): {in_window} failed transactions "
+                    f"in {BURST_WINDOW_SECONDS // 60} minutes",
+                    in_window, BURST_FAILURES))
+
+        if amount > 0:
+            log_amount = math.log(amount)
+            if warmed and state.amount_var > 0:
+                z = (log_amount - state.amount_mean) / math.sqrt(state.amount_var)
+                if z >= AMOUNT_Z:
+                    alerts.append(_alert(
+                        "amount_outlier", branch, state, timestamp,
+                        f"Unusual amount at {branch} ({state.mall}): {amount:,.2f} JOD, "
+                        f"typical about {math.exp(state.amount_mean):,.2f} JOD",
+                        z, AMOUNT_Z))
+            # Exponentially weighted mean and variance (West's incremental form)
+            delta = log_amount - state.amount_mean
+            if state.events == 1:
+                state.amount_mean = log_amount
+            else:
+                state.amount_mean += AMOUNT_ALPHA * delta
+                state.amount_var = (1 - AMOUNT_ALPHA) * (state.amount_var + AMOUNT_ALPHA * delta * delta)
+        return alerts
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {branch: state.to_list() for branch, state in self.branches.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], max_branches: int = MAX_BRANCHES) -> "AnomalyDetector":
+        detector = cls(max_branches)
+        for branch, values in data.items():
+            detector.branches[branch] = BranchState.from_list(values)
+        return detector
+
+
+class AlertGate:
+    """Deduplicates alerts per (kind, branch) and caps the overall alert rate"""
+
+    def __init__(self, dedup_seconds: float = DEDUP_SECONDS, rate_per_minute: float = RATE_PER_MINUTE,
+                 clock: Callable[[], float] = time.time):
+        self.dedup_seconds = dedup_seconds
+        self.bucket = TokenBucket(rate_per_minute / 60.0, capacity=max(1.0, rate_per_minute))
+        self.clock = clock
+        self.last_sent: Dict[str, float] = {}
+        self.stats = {"passed": 0, "deduplicated": 0, "rate_limited": 0}
+
+    def allow(self, alert: Dict[str, Any]) -> bool:
+        now = self.clock()
+        key = f"{alert['kind']}|{alert['branch']}"
+        last = self.last_sent.get(key)
+        if last is not None and now - last < self.dedup_seconds:
+            self.stats["deduplicated"] += 1
+            return False
+        if self.bucket.try_acquire() > 0:
+            self.stats["rate_limited"] += 1
+            return False
+        self.last_sent[key] = now
+        if len(self.last_sent) > 2 * MAX_BRANCHES:
+            self.last_sent = {k: t for k, t in self.last_sent.items() if now - t < self.dedup_seconds}
+        self.stats["passed"] += 1
+        return True
+
+
+def load_distribution(path: Optional[str] = DISTRIBUTION_FILE) -> Dict[str, Dict[str, List[str]]]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def recipients(distribution: Dict[str, Dict[str, List[str]]], branch: str, channel: str) -> List[str]:
+    """The branch's own recipients on a channel, then those listed under "*" """
+    found = []
+    for key in (branch, "*"):
+        for recipient in distribution.get(key, {}).get(channel, []):
+            if recipient not in found:
+                found.append(recipient)
+    return found
+
+
+def alert_subject(alert: Dict[str, Any]) -> str:
+    return f"Alert: {alert['kind'].replace('_', ' ')} at {alert['branch']}"
+
+
+class LogSink:
+    def send(self, alert: Dict[str, Any]):
+        print(f"ALERT [{alert['kind']}] {alert['transaction_time']} {alert['message']}")
+
+
+class WhatsAppSink:
+    """Sends alerts with whatsapp_integration.send_direct_whatsapp_message (Twilio settings from the environment)"""
+
+    def __init__(self, distribution: Dict[str, Dict[str, List[str]]]):
+        self.distribution = distribution
+
+    def send(self, alert: Dict[str, Any]):
+        # Imported on first alert; it loads the Twilio settings and the WhatsApp app
+        from whatsapp_integration import send_direct_whatsapp_message
+        for number in recipients(self.distribution, alert["branch"], "whatsapp"):
+            send_direct_whatsapp_message(number, f"{alert_subject(alert)}\n\n{alert['message']}")
+
+
+class EmailSink:
+    """Queues alerts in the email outbox (send_mail's SMTP settings), which retries failed deliveries"""
+
+    def __init__(self, distribution: Dict[str, Dict[str, List[str]]]):
+        self.distribution = distribution
+
+    def send(self, alert: Dict[str, Any]):
+        from email_outbox import outbox
+        body = f"{alert['message']}\n\nTransaction time: {alert['transaction_time']}\n" \
+               f"Detector: {alert['kind']} (value {alert['value']}, threshold {alert['threshold']})"
+        for address in recipients(self.distribution, alert["branch"], "email"):
+            outbox.enqueue(address, alert_subject(alert), body)
+
+
+def sinks_from_env(spec: str = SINKS) -> List[Any]:
+    distribution = load_distribution()
+    factories = {"log": lambda: LogSink(), "whatsapp": lambda: WhatsAppSink(distribution),
+                 "email": lambda: EmailSink(distribution)}
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    unknown = [name for name in names if name not in factories]
+    if unknown:
+        raise ValueError(f"Unknown alert sinks: {', '.join(unknown)} (choose from {', '.join(factories)})")
+    return [factories[name]() for name in names]
+
+
+class AlertDispatcher:
+    """Delivers alerts to the sinks on a background thread so ingestion never waits on Twilio or SMTP"""
+
+    def __init__(self, sinks: List[Any], queue_size: int = QUEUE_SIZE):
+        self.sinks = sinks
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"delivered": 0, "sink_errors": 0, "dropped": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, alert: Dict[str, Any]):
+        self.start()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def flush(self, timeout: float = 60.0) -> bool:
+        """Wait until every submitted alert has been handed to the sinks. Returns False on timeout"""
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        if "email_outbox" in sys.modules:
+            # Email sinks only queue; wait for the outbox to attempt delivery too
+            return sys.modules["email_outbox"].outbox.flush(max(0.0, deadline - time.time()))
+        return not self._queue.unfinished_tasks
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            try:
+                for sink in self.sinks:
+                    try:
+                        sink.send(alert)
+                        self.stats["delivered"] += 1
+                    except Exception as e:
+                        self.stats["sink_errors"] += 1
+                        print(f"Error delivering alert with {type(sink).__name__}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+
+class StreamMonitor:
+    """The detection stage: detectors, gate and dispatcher, with state saved between ingests"""
+
+    def __init__(self, sinks: Optional[List[Any]] = None, state_path: Optional[str] = None,
+                 gate: Optional[AlertGate] = None):
+        self.state_path = state_path
+        self.detector = AnomalyDetector()
+        self.gate = gate or AlertGate()
+        self.dispatcher = AlertDispatcher(sinks_from_env() if sinks is None else sinks)
+        self.stats = {"events": 0, "alerts": 0}
+        if state_path and os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.detector = AnomalyDetector.from_dict(state.get("branches", {}))
+            self.gate.last_sent = state.get("last_sent", {})
+
+    def observe(self, rows: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Run a batch of transactions (CSV schema, parsed dates) through the detectors in time order"""
+        rows = rows.sort_values("transaction_date", kind="stable")
+        seconds = rows["transaction_date"].to_numpy("datetime64[s]").astype(np.int64)
+        failed = (rows["transaction_status"] == FAILED_STATUS).to_numpy()
+        amounts = rows["transaction_amount"].to_numpy(dtype=float)
+        raised = []
+        for branch, mall, timestamp, is_failed, amount in zip(
+                rows["branch_name"].tolist(), rows["mall_name"].tolist(), seconds.tolist(),
+                failed.tolist(), amounts.tolist()):
+            for alert in self.detector.observe(branch, mall, timestamp, is_failed, amount):
+                if self.gate.allow(alert):
+                    self.dispatcher.submit(alert)
+                    raised.append(alert)
+        self.stats["events"] += len(rows)
+        self.stats["alerts"] += len(raised)
+        if self.state_path:
+            self.save()
+        return raised
+
+    def save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"branches": self.detector.to_dict(), "last_sent": self.gate.last_sent}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def flush(self, timeout: float = 60.0) -> bool:
+        return self.dispatcher.flush(timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming anomaly alerts on transactions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay_parser = commands.add_parser("replay", help="Run historical transactions through the detectors")
+    replay_parser.add_argument("source", help="Transactions CSV or store directory")
+    replay_parser.add_argument("--sinks", default="log", help="Comma-separated sinks (default: log only)")
+    args = parser.parse_args()
+
+    from partitions import _read_rows
+    started = time.time()
+    # No deduplication window or rate cap: show everything the thresholds would raise
+    monitor = StreamMonitor(sinks=sinks_from_env(args.sinks), gate=AlertGate(dedup_seconds=0, rate_per_minute=1e9))
+    alerts = monitor.observe(_read_rows(args.source))
+    monitor.flush()
+    counts = {}
+    for alert in alerts:
+        counts[alert["kind"]] = counts.get(alert["kind"], 0) + 1
+    print(f"{monitor.stats['events']:,} transactions, {len(alerts)} alerts {counts} ({time.time() - started:.2f}s)")
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+# Local OpenAI-compatible stand-in for chat completions and embeddings.
+# Point clients at it with OPENAI_BASE_URL=http://localhost:8011/v1 OPENAI_API_KEY=fake
+
+app = FastAPI(title="Fake OpenAI API")
+
+config = {
+    # Fixed latency before the first token, in seconds
+    "latency": float(os.getenv("FAKE_OPENAI_LATENCY", 0.2)),
+    # Completion tokens generated per second (0 = instant)
+    "token_rate": float(os.getenv("FAKE_OPENAI_TOKEN_RATE", 200)),
+    # Length of each canned answer, in tokens
+    "completion_tokens": int(os.getenv("FAKE_OPENAI_COMPLETION_TOKENS", 120)),
+    # Fraction of requests answered with a 500
+    "failure_rate": float(os.getenv("FAKE_OPENAI_FAILURE_RATE", 0.0)),
+    # Call the first offered tool when the last message is from the user
+    "use_tools": os.getenv("FAKE_OPENAI_USE_TOOLS", "1") == "1",
+    "embedding_dimensions": 1536,
+}
+
+stats = {"chat_requests": 0, "embedding_requests": 0, "failed": 0,
+         "prompt_tokens": 0, "completion_tokens": 0, "busy_seconds": 0.0}
+
+
+def count_tokens(text: str) -> int:
+    # Roughly four characters per token, which is what the real tokenizer averages for English
+    return max(1, len(text) // 4)
+
+
+def message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def canned_answer(question: str, tokens: int) -> str:
+    words = ["Revenue", "at", "the", "branch", "was", "stable", "with", "a", "completion", "rate", "of",
+             "93%", "and", "an", "average", "basket", "of", "8.36", "JOD."]
+    body = " ".join(words[i % len(words)] for i in range(tokens))
+    return f"Analysis for: {question[:80]}\n{body}"
+
+
+async def simulate_generation(completion_tokens: int):
+    delay = config["latency"]
+    if config["token_rate"] > 0:
+        delay += completion_tokens / config["token_rate"]
+    await asyncio.sleep(delay)
+    stats["busy_seconds"] += delay
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["chat_requests"] += 1
+    messages = body.get("messages", [])
+    prompt_tokens = sum(count_tokens(message_text(m)) for m in messages)
+    stats["prompt_tokens"] += prompt_tokens
+
+    if random.random() < config["failure_rate"]:
+        stats["failed"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Simulated failure", "type": "server_error"}})
+
+    last = messages[-1] if messages else {}
+    tools = body.get("tools") or []
+    question = message_text(last)
+
+    if config["use_tools"] and tools and last.get("role") == "user":
+        function = tools[0]["function"]
+        properties = (function.get("parameters") or {}).get("properties", {})
+        arguments = {name: question for name, schema in properties.items() if schema.get("type", "string") == "string"}
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+            }],
+        }
+        completion_tokens = count_tokens(json.dumps(arguments))
+        finish_reason = "tool_calls"
+    else:
+        completion_tokens = config["completion_tokens"]
+        message = {"role": "assistant", "content": canned_answer(question, completion_tokens)}
+        finish_reason = "stop"
+
+    await simulate_generation(completion_tokens)
+    stats["completion_tokens"] += completion_tokens
+
+    response = {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4.1-nano"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+    if body.get("stream"):
+        async def event_stream():
+            chunk = {**response, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": message, "finish_reason": finish_reason}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return response
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    stats["embedding_requests"] += 1
+    inputs = body.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimensions = body.get("dimensions") or config["embedding_dimensions"]
+
+    data = []
+    total_tokens = 0
+    for index, text in enumerate(inputs):
+        text = text if isinstance(text, str) else json.dumps(text)
+        total_tokens += count_tokens(text)
+        # Deterministic pseudo-embedding so identical inputs give identical vectors
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        data.append({"object": "embedding", "index": index,
+                     "embedding": [rng.uniform(-1, 1) for _ in range(dimensions)]})
+    await asyncio.sleep(config["latency"] / 4)
+    stats["prompt_tokens"] += total_tokens
+    return {"object": "list", "data": data, "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens}}
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "gpt-4.1-nano", "object": "model", "owned_by": "fake"}]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {"config": config, "stats": stats}
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    """Change latency / token_rate / completion_tokens / failure_rate / use_tools at runtime"""
+    data = await request.json()
+    for key, value in data.items():
+        if key not in config:
+            continue
+        if isinstance(config[key], bool):
+            config[key] = str(value).lower() in ("1", "true", "yes")
+        else:
+            config[key] = type(config[key])(value)
+    return config
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("FAKE_OPENAI_PORT", 8011))
+    print(f"Starting fake OpenAI API on port {port}...")
+    uvicorn.run(app, host="0.0.0.0", port=port)
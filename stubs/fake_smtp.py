@@ -0,0 +1,62 @@
+import asyncio
+import os
+import time
+
+from aiosmtpd.controller import Controller
+
+# Local stand-in for the SMTP server (requires `pip install aiosmtpd`).
+# Point the outbox at it with SMTP_HOST=localhost SMTP_PORT=8025 SMTP_SECURITY=none
+
+
+class RecordingHandler:
+    """Accepts every message and keeps it in memory"""
+
+    def __init__(self, latency: float = 0.0, reject_every: int = 0):
+        self.latency = latency
+        # Reject every Nth message with a transient 451 error (0 disables)
+        self.reject_every = reject_every
+        self.messages = []
+        self.stats = {"accepted": 0, "rejected": 0, "connections": 0}
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.stats["connections"] += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.reject_every and (self.stats["accepted"] + self.stats["rejected"] + 1) % self.reject_every == 0:
+            self.stats["rejected"] += 1
+            return "451 Requested action aborted: local error in processing"
+        self.messages.append({
+            "from": envelope.mail_from,
+            "to": list(envelope.rcpt_tos),
+            "data": envelope.content.decode("utf-8", errors="replace"),
+        })
+        self.stats["accepted"] += 1
+        return "250 Message accepted for delivery"
+
+
+def start_fake_smtp(host: str = "127.0.0.1", port: int = 8025, **handler_options):
+    """Start the fake SMTP server in a background thread. Returns (controller, handler)"""
+    handler = RecordingHandler(**handler_options)
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    return controller, handler
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("FAKE_SMTP_PORT", 8025))
+    controller, handler = start_fake_smtp(
+        host="0.0.0.0",
+        port=port,
+        latency=float(os.getenv("FAKE_SMTP_LATENCY", 0.0)),
+    )
+    print(f"Fake SMTP server listening on port {port}. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"Fake SMTP stats: {handler.stats}")
+    except KeyboardInterrupt:
+        controller.stop()
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+# Local stand-in for the Twilio Messages API.
+# Point the integration at it with TWILIO_API_BASE=http://localhost:8010
+
+app = FastAPI(title="Fake Twilio Messages API")
+
+config = {
+    # Simulated API latency in seconds
+    "latency": float(os.getenv("FAKE_TWILIO_LATENCY", 0.05)),
+    # Fraction of requests answered with a 500
+    "failure_rate": float(os.getenv("FAKE_TWILIO_FAILURE_RATE", 0.0)),
+    # Requests per second before answering 429 (0 disables)
+    "rate_limit": float(os.getenv("FAKE_TWILIO_RATE_LIMIT", 0)),
+}
+
+messages = []
+recent_requests = deque()
+stats = {"requests": 0, "accepted": 0, "rate_limited": 0, "failed": 0}
+
+
+@app.post("/2010-04-01/Accounts/{account_sid}/Messages.json")
+async def create_message(account_sid: str, request: Request):
+    form = await request.form()
+    stats["requests"] += 1
+
+    now = time.monotonic()
+    if config["rate_limit"] > 0:
+        while recent_requests and now - recent_requests[0] > 1.0:
+            recent_requests.popleft()
+        if len(recent_requests) >= config["rate_limit"]:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"code": 20429, "message": "Too Many Requests"},
+                headers={"Retry-After": "1"},
+            )
+        recent_requests.append(now)
+
+    await asyncio.sleep(config["latency"])
+
+    if random.random() < config["failure_rate"]:
+        stats["failed"] += 1
+        return JSONResponse(status_code=500, content={"code": 20500, "message": "Internal Server Error"})
+
+    body = form.get("Body", "")
+    if len(body) > 1600:
+        return JSONResponse(status_code=400, content={"code": 21617, "message": "Body exceeds 1600 characters"})
+
+    message = {
+        "sid": f"SM{uuid.uuid4().hex}",
+        "account_sid": account_sid,
+        "to": form.get("To"),
+        "from": form.get("From"),
+        "body": body,
+        "status": "queued",
+        "date_created": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime()),
+    }
+    messages.append(message)
+    stats["accepted"] += 1
+    return JSONResponse(status_code=201, content=message)
+
+
+@app.get("/messages")
+async def list_messages():
+    """Messages accepted so far, for assertions in tests and benchmarks"""
+    return {"messages": messages, "stats": stats}
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    """Change latency / failure_rate / rate_limit at runtime"""
+    data = await request.json()
+    for key in config:
+        if key in data:
+            config[key] = float(data[key])
+    return config
+
+
+@app.post("/reset")
+async def reset():
+    messages.clear()
+    recent_requests.clear()
+    for key in stats:
+        stats[key] = 0
+    return {"status": "reset"}
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("FAKE_TWILIO_PORT", 8010))
+    print(f"Starting fake Twilio API on port {port}...")
+    uvicorn.run(app, host="0.0.0.0", port=port)
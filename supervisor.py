@@ -0,0 +1,416 @@
+import argparse
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+# Starts and watches the whole stack, on any OS (replaces start_servers.bat).
+#
+#   python supervisor.py                          # MCP server, bridge, WhatsApp integration
+#   python supervisor.py --replicas mcp=4 --frontend
+#   python supervisor.py --only mcp,bridge
+#
+# A service starts as soon as every service it depends on passes /readyz (see
+# startup.py); services that do not depend on each other start together, and
+# all replicas of a service start at once. Replica N of a service listens on
+# its base port + N * SUPERVISOR_PORT_STRIDE. Every child's output is read
+# continuously (a full pipe would block the child), echoed with a [name]
+# prefix and written to a rotating log file in LOG_DIR. A replica that exits,
+# or stops answering /livez, is restarted with exponential backoff; the
+# backoff resets once it has run for SUPERVISOR_STABLE_SECONDS.
+
+load_dotenv()
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PORT_STRIDE = int(os.getenv("SUPERVISOR_PORT_STRIDE", 10))
+READY_TIMEOUT = float(os.getenv("SUPERVISOR_READY_TIMEOUT", 60))
+LIVENESS_INTERVAL = float(os.getenv("SUPERVISOR_LIVENESS_INTERVAL", 5))
+LIVENESS_FAILURES = int(os.getenv("SUPERVISOR_LIVENESS_FAILURES", 3))
+RESTART_BASE_DELAY = float(os.getenv("SUPERVISOR_RESTART_BASE_DELAY", 1))
+RESTART_MAX_DELAY = float(os.getenv("SUPERVISOR_RESTART_MAX_DELAY", 30))
+STABLE_SECONDS = float(os.getenv("SUPERVISOR_STABLE_SECONDS", 60))
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(ROOT, "logs"))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+
+
+class Service:
+    def __init__(self, name: str, command: List[str], port_env: str, base_port: int,
+                 depends_on: List[str] = (), cwd: str = ROOT, ready_path: str = "/readyz",
+                 live_path: Optional[str] = "/livez",
+                 env: Optional[Callable[[int, "Supervisor"], Dict[str, str]]] = None):
+        self.name = name
+        self.command = command
+        self.port_env = port_env
+        self.base_port = base_port
+        self.depends_on = list(depends_on)
+        self.cwd = cwd
+        self.ready_path = ready_path
+        self.live_path = live_path
+        self.extra_env = env
+        self.replicas: List["Replica"] = []
+
+    def port(self, index: int) -> int:
+        return self.base_port + index * PORT_STRIDE
+
+    def url(self, index: int) -> str:
+        return f"http://localhost:{self.port(index)}"
+
+    def ready(self) -> bool:
+        return bool(self.replicas) and all(replica.ready for replica in self.replicas)
+
+
+class Replica:
+    def __init__(self, service: Service, index: int, supervisor: "Supervisor"):
+        self.service = service
+        self.index = index
+        self.supervisor = supervisor
+        self.name = service.name if supervisor.replica_count(service.name) == 1 else f"{service.name}-{index}"
+        self.process: Optional[subprocess.Popen] = None
+        self.ready = False
+        self.started_at = 0.0
+        self.crashes = 0
+        self.restart_at: Optional[float] = None
+        self.liveness_failures = 0
+        self.logger = self._logger()
+
+    def _logger(self) -> logging.Logger:
+        logger = logging.getLogger(f"supervisor.{self.name}")
+        logger.propagate = False
+        if not logger.handlers:
+            handler = RotatingFileHandler(os.path.join(self.supervisor.log_dir, f"{self.name}.log"),
+                                          maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        return logger
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({self.service.port_env: str(self.service.port(self.index)), "PYTHONUNBUFFERED": "1"})
+        if self.service.extra_env:
+            env.update(self.service.extra_env(self.index, self.supervisor))
+        return env
+
+    def start(self):
+        kwargs = {}
+        if os.name == "nt":
+            # Ctrl+C goes to the supervisor only; it stops the children in order
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        self.process = subprocess.Popen(self.service.command, cwd=self.service.cwd, env=self.env(),
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, **kwargs)
+        self.ready = False
+        self.started_at = time.time()
+        self.restart_at = None
+        self.liveness_failures = 0
+        self.supervisor.say(self.name, f"started (pid {self.process.pid}, port {self.service.port(self.index)})")
+        threading.Thread(target=self._pump, args=(self.process,), name=f"log-{self.name}", daemon=True).start()
+
+    def _pump(self, process: subprocess.Popen):
+        for raw in iter(process.stdout.readline, b""):
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            self.logger.info(line)
+            if self.supervisor.echo:
+                self.supervisor.say(self.name, line)
+        process.stdout.close()
+
+    def probe(self, path: str) -> bool:
+        try:
+            return requests.get(f"{self.service.url(self.index)}{path}", timeout=1).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout: float = 10):
+        if self.process is None:
+            return
+        if os.name == "nt":
+            if not self.running():
+                return
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            return
+        # The replica leads its own session (start_new_session), so its process group
+        # also holds whatever it spawned (npm's node server); signal all of them, even
+        # when the replica itself has already exited and left them holding its port
+        self._signal_group(signal.SIGTERM)
+        deadline = time.time() + timeout
+        while self._group_alive() and time.time() < deadline:
+            self.process.poll()  # reap the replica so it stops counting as alive
+            time.sleep(0.1)
+        if self._group_alive():
+            self._signal_group(signal.SIGKILL)
+        self.process.wait()
+
+    def _signal_group(self, sig: int):
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _group_alive(self) -> bool:
+        try:
+            os.killpg(self.process.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        if not os.path.isdir("/proc"):
+            return True
+        # Exited children stay in the group as zombies until reaped, which an init that
+        # does not reap (a container started without --init) never does; skip them
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            if int(fields[2]) == self.process.pid and fields[0] != "Z":
+                return True
+        return False
+
+    def schedule_restart(self, reason: str):
+        # Backoff grows with consecutive crashes; a replica that ran long enough starts over
+        if time.time() - self.started_at >= STABLE_SECONDS:
+            self.crashes = 0
+        delay = min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * 2 ** self.crashes)
+        self.crashes += 1
+        self.ready = False
+        self.restart_at = time.time() + delay
+        self.supervisor.say(self.name, f"{reason}, restarting in {delay:.0f}s")
+
+
+class Supervisor:
+    def __init__(self, services: List[Service], replicas: Dict[str, int], log_dir: str = LOG_DIR,
+                 echo: bool = True):
+        self.services = {service.name: service for service in services}
+        self.replicas = replicas
+        self.log_dir = log_dir
+        self.echo = echo
+        self.stopping = threading.Event()
+        self._print_lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def replica_count(self, name: str) -> int:
+        return max(1, self.replicas.get(name, 1))
+
+    def urls(self, name: str) -> List[str]:
+        service = self.services[name]
+        return [service.url(i) for i in range(self.replica_count(name))]
+
+    def say(self, name: str, message: str):
+        with self._print_lock:
+            print(f"[{name}] {message}", flush=True)
+
+    def start(self) -> bool:
+        """Start every service once its dependencies are ready. Returns True when all are ready"""
+        started = time.time()
+        pending = list(self.services.values())
+        waiting: List[Service] = []
+        # Services still not ready after READY_TIMEOUT; their dependents are started anyway
+        released = set()
+
+        def unblocked(service: Service) -> bool:
+            return all(self.services[d].ready() or d in released for d in service.depends_on if d in self.services)
+
+        while (pending or waiting) and not self.stopping.is_set():
+            for service in [s for s in pending if unblocked(s)]:
+                pending.remove(service)
+                service.replicas = [Replica(service, i, self) for i in range(self.replica_count(service.name))]
+                for replica in service.replicas:
+                    replica.start()
+                waiting.append(service)
+            for service in waiting[:]:
+                for replica in service.replicas:
+                    if not replica.ready and replica.running() and replica.probe(service.ready_path):
+                        replica.ready = True
+                        self.say(replica.name, f"ready after {time.time() - replica.started_at:.2f}s")
+                if service.ready():
+                    waiting.remove(service)
+                elif service.name not in released and time.time() - started > READY_TIMEOUT:
+                    released.add(service.name)
+                    self.say(service.name, f"not ready after {READY_TIMEOUT:.0f}s, starting its dependents anyway")
+            self.check_processes()
+            time.sleep(0.05)
+        ready = all(service.ready() for service in self.services.values())
+        if ready:
+            print(f"All services ready in {time.time() - started:.2f}s", flush=True)
+        return ready
+
+    def check_processes(self):
+        """Restart replicas that exited, once their backoff has passed"""
+        for service in self.services.values():
+            for replica in service.replicas:
+                if self.stopping.is_set():
+                    return
+                if replica.restart_at is not None:
+                    if time.time() >= replica.restart_at:
+                        replica.start()
+                elif replica.process is not None and replica.process.poll() is not None:
+                    replica.stop(timeout=5)  # children it left behind would keep its port
+                    replica.schedule_restart(f"exited with code {replica.process.returncode}")
+
+    def check_liveness(self):
+        """Restart replicas that are running but stopped answering /livez"""
+        for service in self.services.values():
+            if not service.live_path:
+                continue
+            for replica in service.replicas:
+                if not replica.running() or replica.restart_at is not None:
+                    continue
+                if replica.probe(service.live_path):
+                    replica.liveness_failures = 0
+                    if not replica.ready and replica.probe(service.ready_path):
+                        replica.ready = True
+                        self.say(replica.name, "ready")
+                    continue
+                replica.liveness_failures += 1
+                if replica.liveness_failures >= LIVENESS_FAILURES:
+                    replica.stop(timeout=5)
+                    replica.schedule_restart(f"no answer on {service.live_path} {replica.liveness_failures} times")
+
+    def run(self):
+        def stop(*_):
+            self.stopping.set()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            self.start()
+            next_liveness = time.time() + LIVENESS_INTERVAL
+            while not self.stopping.is_set():
+                self.check_processes()
+                if time.time() >= next_liveness:
+                    self.check_liveness()
+                    next_liveness = time.time() + LIVENESS_INTERVAL
+                self.stopping.wait(0.2)
+        finally:
+            self.stop()
+
+    def stop(self):
+        print("Stopping services...", flush=True)
+        self.stopping.set()
+        # Dependents first, so nothing sees its upstream vanish while still serving
+        for service in reversed(self.start_order()):
+            threads = [threading.Thread(target=replica.stop) for replica in service.replicas]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def start_order(self) -> List[Service]:
+        order, seen = [], set()
+
+        def visit(service: Service):
+            if service.name in seen:
+                return
+            seen.add(service.name)
+            for dependency in service.depends_on:
+                if dependency in self.services:
+                    visit(self.services[dependency])
+            order.append(service)
+
+        for service in self.services.values():
+            visit(service)
+        return order
+
+
+def mcp_env(index: int, supervisor: Supervisor) -> Dict[str, str]:
+    env = {"MCP_WORKER_ID": str(index),
+           "MCP_METRICS_PORT": str(int(os.getenv("MCP_METRICS_PORT", 9101)) + index)}
+    if supervisor.replica_count("mcp") > 1:
+        # Same layout as mcp_workers.py: own spool and message ids per worker, one report scheduler
+        env["EMAIL_SPOOL_DIR"] = os.path.join(os.getenv("EMAIL_SPOOL_DIR", os.path.join(ROOT, "email_spool")),
+                                              f"worker-{index}")
+        env["EMAIL_ID_PREFIX"] = f"w{index}-"
+        if index != 0:
+            env["REPORT_SCHEDULER"] = "0"
+    return env
+
+
+def bridge_env(index: int, supervisor: Supervisor) -> Dict[str, str]:
+    if "mcp" not in supervisor.services:
+        return {}
+    return {"MCP_SERVER_URLS": ",".join(f"{url}/sse" for url in supervisor.urls("mcp"))}
+
+
+def whatsapp_env(index: int, supervisor: Supervisor) -> Dict[str, str]:
+    if "bridge" not in supervisor.services:
+        return {}
+    bridges = supervisor.urls("bridge")
+    return {"MCP_API_URL": bridges[index % len(bridges)]}
+
+
+def frontend_env(index: int, supervisor: Supervisor) -> Dict[str, str]:
+    if "bridge" not in supervisor.services:
+        return {}
+    return {"NEXT_PUBLIC_MCP_SERVER_URL": supervisor.urls("bridge")[0]}
+
+
+def stack(frontend: bool = False) -> List[Service]:
+    services = [
+        Service("mcp", [sys.executable, "mcp_server.py"], "MCP_PORT", int(os.getenv("MCP_PORT", 8000)),
+                env=mcp_env),
+        Service("bridge", [sys.executable, "next_mcp_server.py"], "NEXTJS_MCP_SERVER_PORT",
+                int(os.getenv("NEXTJS_MCP_SERVER_PORT", 8001)), depends_on=["mcp"], env=bridge_env),
+        Service("whatsapp", [sys.executable, "whatsapp_integration.py"], "WHATSAPP_SERVER_PORT",
+                int(os.getenv("WHATSAPP_SERVER_PORT", 8002)), depends_on=["bridge"], env=whatsapp_env),
+    ]
+    if frontend:
+        npm = shutil.which("npm")
+        if npm is None:
+            print("npm was not found; install Node.js 16 or later to run the frontend")
+        else:
+            # The dashboard has no probes of its own; its home page answering means it is up
+            services.append(Service("frontend", [npm, "run", "dev"], "PORT", int(os.getenv("FRONTEND_PORT", 3000)),
+                                    depends_on=["bridge"], cwd=os.path.join(ROOT, "financial-advisor-nextjs"),
+                                    ready_path="/", live_path=None, env=frontend_env))
+    return services
+
+
+def parse_replicas(values: List[str]) -> Dict[str, int]:
+    replicas = {}
+    for value in values:
+        for part in value.split(","):
+            name, _, count = part.partition("=")
+            replicas[name.strip()] = int(count)
+    return replicas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start the Financial Advisor services and keep them running")
+    parser.add_argument("--replicas", action="append", default=[os.getenv("SUPERVISOR_REPLICAS", "")],
+                        help="Replicas per service, e.g. mcp=4,bridge=2 (default 1 each)")
+    parser.add_argument("--only", help="Comma-separated subset of services to run (mcp, bridge, whatsapp, frontend)")
+    parser.add_argument("--frontend", action="store_true", help="Also run the Next.js dashboard (npm run dev)")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="Where the rotating per-replica log files go")
+    parser.add_argument("--quiet", action="store_true", help="Only write service output to the log files")
+    args = parser.parse_args()
+
+    services = stack(frontend=args.frontend or bool(args.only and "frontend" in args.only))
+    if args.only:
+        wanted = {name.strip() for name in args.only.split(",")}
+        services = [service for service in services if service.name in wanted]
+    Supervisor(services, parse_replicas([r for r in args.replicas if r]), log_dir=args.log_dir,
+               echo=not args.quiet).run()
@@ -0,0 +1,235 @@
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import rag_pipeline
+from tracing import traced
+
+# Time-bucketed series for dashboard charts, served without the LLM.
+#
+# Each dataset gets rollups: transaction counts and amount/tax sums per
+# (bucket start, mall, branch, status, type), one table per bucket size. They
+# are built once per dataset version, on first use, and rows ingested later
+# can be merged in with Rollups.add(). A query re-aggregates the rollup of its
+# bucket size over the requested groups. Ranges are in epoch milliseconds;
+# buckets only partly inside a range are recomputed from the minute rollup,
+# so any range gives exact numbers.
+
+BUCKETS = ["minute", "hour", "day", "week", "month"]
+DIMENSIONS = {"mall": "mall_name", "branch": "branch_name", "status": "transaction_status",
+              "type": "transaction_type"}
+VALUES = {"amount": "transaction_amount", "tax": "tax_amount"}
+METRICS = ["count", "sum", "avg"]
+
+_NS_PER = {"minute": 60 * 10**9, "hour": 3600 * 10**9, "day": 86400 * 10**9, "week": 7 * 86400 * 10**9}
+# 1970-01-05 was a Monday; weeks start on Monday
+_WEEK_OFFSET = 4 * 86400 * 10**9
+
+
+def bucket_start(ns: np.ndarray, bucket: str) -> np.ndarray:
+    """Start of each timestamp's bucket, in epoch nanoseconds"""
+    if bucket == "month":
+        return ns.view("datetime64[ns]").astype("datetime64[M]").astype("datetime64[ns]").view(np.int64)
+    if bucket == "week":
+        return (ns - _WEEK_OFFSET) // _NS_PER["week"] * _NS_PER["week"] + _WEEK_OFFSET
+    return ns // _NS_PER[bucket] * _NS_PER[bucket]
+
+
+def bucket_end(starts: np.ndarray, bucket: str) -> np.ndarray:
+    """End (exclusive) of buckets starting at `starts`, in epoch nanoseconds"""
+    if bucket == "month":
+        return (starts.view("datetime64[ns]").astype("datetime64[M]") + 1).astype("datetime64[ns]").view(np.int64)
+    return starts + _NS_PER[bucket]
+
+
+def dimension_labels(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """Category labels of every dimension, in code order"""
+    labels = {}
+    for dimension, column in DIMENSIONS.items():
+        values = df[column]
+        labels[dimension] = ([str(c) for c in values.cat.categories] if isinstance(values.dtype, pd.CategoricalDtype)
+                             else sorted(str(v) for v in values.unique()))
+    return labels
+
+
+def dimension_codes(df: pd.DataFrame, labels: Dict[str, List[str]]) -> Dict[str, np.ndarray]:
+    """Codes of every dimension of `df` against `labels`, appending labels not seen before"""
+    codes = {}
+    for dimension, column in DIMENSIONS.items():
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) and [str(c) for c in values.cat.categories] == labels[dimension]:
+            codes[dimension] = values.cat.codes.to_numpy()
+            continue
+        # Labels not seen before (e.g. a new branch in ingested rows) are appended
+        known = {label: i for i, label in enumerate(labels[dimension])}
+        for label in values.astype(str).unique():
+            if label not in known:
+                known[label] = len(labels[dimension])
+                labels[dimension].append(label)
+        codes[dimension] = values.astype(str).map(known).to_numpy(dtype=np.int32)
+    return codes
+
+
+class Rollups:
+    """Count and sums per bucket and dimension combination, for every bucket size"""
+
+    def __init__(self, labels: Dict[str, List[str]]):
+        # Category labels per dimension; rollups store codes
+        self.labels = labels
+        self.tables: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> "Rollups":
+        rollups = cls(dimension_labels(df))
+        rollups.add(df)
+        return rollups
+
+    def add(self, df: pd.DataFrame):
+        """Merge the rows of `df` (transactions schema) into every rollup"""
+        if df.empty:
+            return
+        with self._lock:
+            ns = df["transaction_date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+            base = pd.DataFrame({**dimension_codes(df, self.labels), "count": 1,
+                                 "amount": df["transaction_amount"].to_numpy(dtype=np.float64),
+                                 "tax": df["tax_amount"].to_numpy(dtype=np.float64)})
+            keys = ["t", *DIMENSIONS]
+            tables = {}
+            for bucket in BUCKETS:
+                rows = base.assign(t=bucket_start(ns, bucket))
+                table = rows.groupby(keys, sort=False, observed=True)[["count", "amount", "tax"]].sum()
+                if bucket in self.tables:
+                    table = pd.concat([self.tables[bucket].set_index(keys), table])
+                    table = table.groupby(level=keys, sort=False).sum()
+                tables[bucket] = table.reset_index().sort_values("t", kind="stable", ignore_index=True)
+            # Swap all tables at once so queries never mix old and new rollups
+            self.tables = tables
+
+    def rows(self, bucket: str, start: Optional[int] = None, end: Optional[int] = None) -> pd.DataFrame:
+        """
+        Rollup rows of `bucket` covering exactly [start, end) (epoch ns, minute-aligned),
+        with t set to each row's bucket start
+        """
+        tables = self.tables
+        table = tables[bucket]
+        t = table["t"].to_numpy()
+        # Whole buckets inside [start, end) come from this bucket's rollup
+        inside = np.ones(len(table), dtype=bool)
+        if start is not None:
+            inside &= t >= start
+        if end is not None:
+            inside &= bucket_end(t, bucket) <= end
+        parts = [table[inside]]
+        # Partial buckets at either edge are rebuilt from minute rows, which the timestamps never split
+        if bucket != "minute" and (start is not None or end is not None):
+            minutes = tables["minute"]
+            mt = minutes["t"].to_numpy()
+            edge = np.ones(len(minutes), dtype=bool)
+            if start is not None:
+                edge &= mt >= start
+            if end is not None:
+                edge &= mt < end
+            edge_rows = minutes[edge]
+            edge_rows = edge_rows.assign(t=bucket_start(edge_rows["t"].to_numpy(), bucket))
+            parts.append(edge_rows[~edge_rows["t"].isin(table["t"][inside])])
+        return pd.concat(parts, ignore_index=True)
+
+    def query(self, bucket: str = "day", group_by: Optional[str] = None, start_ms: Optional[int] = None,
+              end_ms: Optional[int] = None, value: str = "amount",
+              filters: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """Series as a long frame with columns t (bucket start, ms), group, count, sum, avg"""
+        check_query(bucket, group_by, value, filters)
+
+        start = None if start_ms is None else int(start_ms) * 10**6
+        end = None if end_ms is None else int(end_ms) * 10**6
+        rows = self.rows(bucket, start, end)
+
+        for dimension, label in (filters or {}).items():
+            code = self.labels[dimension].index(label) if label in self.labels[dimension] else -1
+            rows = rows[rows[dimension] == code]
+
+        keys = ["t", group_by] if group_by else ["t"]
+        series = rows.groupby(keys, sort=True)[["count", value]].sum().reset_index()
+        series = series.rename(columns={value: "sum"})
+        series["avg"] = series["sum"] / series["count"]
+        series["group"] = (np.array(self.labels[group_by], dtype=object)[series[group_by].to_numpy()]
+                           if group_by else "all")
+        series["t"] = series["t"] // 10**6
+        return series[["t", "group", "count", "sum", "avg"]]
+
+
+def check_query(bucket: str, group_by: Optional[str], value: str, filters: Optional[Dict[str, str]]):
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', use one of: {', '.join(BUCKETS)}")
+    if group_by and group_by not in DIMENSIONS:
+        raise ValueError(f"Unknown group_by '{group_by}', use one of: {', '.join(DIMENSIONS)}")
+    if value not in VALUES:
+        raise ValueError(f"Unknown value '{value}', use one of: {', '.join(VALUES)}")
+    for dimension in filters or {}:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown filter '{dimension}', use one of: {', '.join(DIMENSIONS)}")
+
+
+_build_lock = threading.Lock()
+
+
+def rollups_for(dataset: Dict[str, Any]) -> Rollups:
+    """The dataset's rollups, built on first use and kept with the dataset"""
+    if "rollups" not in dataset:
+        with _build_lock:
+            if "rollups" not in dataset:
+                dataset["rollups"] = Rollups.build(dataset["df"])
+    return dataset["rollups"]
+
+
+def partitioned_series(store, bucket: str, group_by: Optional[str], start_ms: Optional[int],
+                       end_ms: Optional[int], value: str, filters: Optional[Dict[str, str]]) -> pd.DataFrame:
+    """Rollups.query() over the partitions the range and filters leave, merged (a week can span two)"""
+    check_query(bucket, group_by, value, filters)
+    start = None if start_ms is None else int(start_ms) * 10**6
+    end = None if end_ms is None else int(end_ms) * 10**6
+    labels = {DIMENSIONS[dimension]: {label} for dimension, label in (filters or {}).items()}
+    parts = [rollups_for(store.dataset(partition)).query(bucket, group_by, start_ms, end_ms, value, filters)
+             for partition in store.prune(start, end, labels=labels)]
+    if not parts:
+        return pd.DataFrame({"t": [], "group": [], "count": [], "sum": [], "avg": []})
+    series = pd.concat(parts).groupby(["t", "group"], sort=True)[["count", "sum"]].sum().reset_index()
+    series["avg"] = series["sum"] / series["count"]
+    return series[["t", "group", "count", "sum", "avg"]]
+
+
+def to_columns(series: pd.DataFrame, metrics: List[str]) -> Dict[str, list]:
+    """Columnar layout: one list per column, rounded for compact JSON"""
+    columns = {"t": series["t"].tolist(), "group": series["group"].tolist()}
+    for metric in metrics:
+        values = series[metric]
+        columns[metric] = values.tolist() if metric == "count" else values.round(3).tolist()
+    return columns
+
+
+@traced("timeseries.query")
+def time_series(bucket: str = "day", group_by: str = "", start_ms: Optional[int] = None,
+                end_ms: Optional[int] = None, metrics: str = "count,sum,avg", value: str = "amount",
+                filters: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Query the current dataset's rollups and return the series in columnar form"""
+    wanted = [m.strip() for m in metrics.split(",") if m.strip()] or METRICS
+    unknown = [m for m in wanted if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric(s) {', '.join(unknown)}, use: {', '.join(METRICS)}")
+    dataset = rag_pipeline.current_dataset()
+    if dataset["db"] is not None:
+        # Database-backed datasets keep no rollups; the GROUP BY runs in the database
+        check_query(bucket, group_by or None, value, filters)
+        series = dataset["db"].series(bucket, group_by or None,
+                                      None if start_ms is None else int(start_ms) * 10**6,
+                                      None if end_ms is None else int(end_ms) * 10**6, value, filters)
+    elif dataset["partitions"] is not None:
+        series = partitioned_series(dataset["partitions"], bucket, group_by or None, start_ms, end_ms, value, filters)
+    else:
+        series = rollups_for(dataset).query(bucket, group_by or None, start_ms, end_ms, value, filters)
+    return {"bucket": bucket, "group_by": group_by or None, "value": value, "version": dataset["version"],
+            "rows": len(series), "columns": to_columns(series, wanted)}
+
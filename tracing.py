@@ -0,0 +1,170 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Distributed tracing across whatsapp_integration -> next_mcp_server -> mcp_server -> rag_pipeline.
+#
+# Enabled with TRACING_ENABLED=1 (requires opentelemetry-sdk). Exporters, via TRACE_EXPORTER:
+#   file    - JSON lines appended to TRACE_FILE (default traces.jsonl), the default
+#   console - pretty-printed spans on stdout
+#   otlp    - OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (requires opentelemetry-exporter-otlp)
+# Trace context travels as W3C traceparent headers over HTTP and in the MCP
+# request _meta over MCP. When tracing is disabled every helper is a no-op.
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "0") == "1"
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:  # opentelemetry-api not installed
+    trace = None
+
+_tracer = None
+_init_lock = threading.Lock()
+
+
+class JsonLinesSpanExporter:
+    """Append finished spans to a local file, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        from opentelemetry.sdk.trace.export import SpanExportResult
+        lines = [json.dumps(json.loads(span.to_json())) for span in spans]
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000):
+        return True
+
+
+def init_tracing(service_name: str):
+    """Configure the tracer provider for this process. Safe to call more than once"""
+    global _tracer
+    if not TRACING_ENABLED or trace is None:
+        return
+    with _init_lock:
+        if _tracer is not None:
+            return
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        except ImportError:
+            print("Warning: TRACING_ENABLED=1 but opentelemetry-sdk is not installed; tracing disabled.")
+            return
+
+        exporter_name = os.getenv("TRACE_EXPORTER", "file").lower()
+        if exporter_name == "console":
+            exporter = ConsoleSpanExporter()
+        elif exporter_name == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter()
+        else:
+            exporter = JsonLinesSpanExporter(os.getenv("TRACE_FILE", os.path.join(os.getcwd(), "traces.jsonl")))
+
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _tracer = trace.get_tracer("financial-advisor")
+        print(f"Tracing enabled for {service_name} ({exporter_name} exporter)")
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, carrier: Optional[Dict[str, str]] = None):
+    """
+    Open a span as a child of the current one, or of the context in `carrier`
+    (HTTP headers / MCP meta) when given. Yields the span, or None when disabled.
+    """
+    if _tracer is None:
+        yield None
+        return
+    parent = propagate.extract(carrier) if carrier else None
+    with _tracer.start_as_current_span(name, context=parent) as current:
+        if attributes:
+            set_attributes(current, attributes)
+        try:
+            yield current
+        except Exception as e:
+            current.record_exception(e)
+            current.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+
+
+def set_attributes(current, attributes: Dict[str, Any]):
+    """Set attributes on a span from span(); ignores None spans and None values"""
+    if current is None:
+        return
+    for key, value in attributes.items():
+        if value is not None:
+            current.set_attribute(key, value)
+
+
+def traced(name: str):
+    """Decorator wrapping a sync or async function in a span"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Return headers (a new dict) carrying the current trace context"""
+    headers = dict(headers or {})
+    if _tracer is not None:
+        propagate.inject(headers)
+    return headers
+
+
+def instrument_app(app, service_name: str):
+    """Give every request to a FastAPI app a server span continuing the caller's trace"""
+    init_tracing(service_name)
+    if _tracer is None:
+        return
+
+    @app.middleware("http")
+    async def tracing_middleware(request, call_next):
+        started = time.perf_counter()
+        with span(f"{request.method} {request.url.path}", {"http.method": request.method,
+                                                           "http.route": request.url.path},
+                  carrier=dict(request.headers)) as current:
+            response = await call_next(request)
+            set_attributes(current, {"http.status_code": response.status_code,
+                                     "http.duration_ms": round((time.perf_counter() - started) * 1000, 2)})
+            return response
+
+
+def llm_usage_attributes(result) -> Dict[str, Any]:
+    """Token counts from a LangChain message or an OpenAI completion (object or JSON), as span attributes"""
+    if isinstance(result, dict):
+        usage = result.get("usage") or {}
+        return {"llm.tokens.input": usage.get("prompt_tokens"), "llm.tokens.output": usage.get("completion_tokens")}
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return {"llm.tokens.input": usage.get("input_tokens"), "llm.tokens.output": usage.get("output_tokens")}
+    usage = getattr(result, "usage", None)
+    if usage is not None:
+        return {"llm.tokens.input": getattr(usage, "prompt_tokens", None),
+                "llm.tokens.output": getattr(usage, "completion_tokens", None)}
+    return {}
@@ -0,0 +1,432 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+from transaction_store import COLUMN_ORDER, is_store, read_store
+
+# Embedded SQL storage for the transaction dataset.
+#
+# Instead of a DataFrame rebuilt from CSV in every process, transactions can
+# live in one database file that any number of processes open read-only:
+#   data/transactions.duckdb   DuckDB (pip install duckdb): columnar, runs each
+#                              query on all cores, zone maps prune by date
+#   data/transactions.sqlite   SQLite (no extra dependency): B-tree indexes,
+#                              shared through the OS page cache (mmap)
+# Neither needs the data to fit in RAM. Point TRANSACTIONS_PATH at the file and
+# rag_pipeline, the time-series API and query_transactions run their filters
+# and aggregates as SQL here (see TransactionDB).
+#
+#   python transaction_db.py import pdfs/jordan_transactions.csv data/transactions.sqlite
+#
+# transaction_date is stored as epoch seconds, indexed together with branch
+# and status. Imports write to a temporary file and rename it into place, so
+# readers never open a half-written database.
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+DUCKDB_SUFFIXES = (".duckdb", ".ddb")
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+IMPORT_CHUNK_ROWS = int(os.getenv("TRANSACTIONS_DB_CHUNK_ROWS", 200_000))
+# DuckDB worker threads per query (0 = one per core)
+DB_THREADS = int(os.getenv("TRANSACTIONS_DB_THREADS", 0))
+# SQLite: memory-map this much of the file, so processes share its pages
+SQLITE_MMAP_BYTES = int(os.getenv("TRANSACTIONS_DB_MMAP_BYTES", 1 << 30))
+
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+LABEL_COLUMNS = {"mall": "mall_name", "branch": "branch_name", "status": "transaction_status",
+                 "type": "transaction_type"}
+VALUE_COLUMNS = {"amount": "transaction_amount", "tax": "tax_amount"}
+INDEXES = {"idx_date": "transaction_date",
+           "idx_branch_date": "branch_name, transaction_date",
+           "idx_status_date": "transaction_status, transaction_date"}
+SCHEMA = """CREATE TABLE transactions (
+    transaction_id VARCHAR, mall_name VARCHAR, branch_name VARCHAR, transaction_date BIGINT,
+    tax_amount DOUBLE, transaction_amount DOUBLE, transaction_type VARCHAR, transaction_status VARCHAR)"""
+
+
+def engine_for(path: str) -> Optional[str]:
+    lower = path.lower()
+    if lower.endswith(DUCKDB_SUFFIXES):
+        return "duckdb"
+    if lower.endswith(SQLITE_SUFFIXES):
+        return "sqlite"
+    return None
+
+
+def is_database(path: str) -> bool:
+    return os.path.isfile(path) and engine_for(path) is not None
+
+
+# ---- SQL dialects ----
+
+class _SQLite:
+    @staticmethod
+    def idiv(a: str, b: int) -> str:
+        return f"(({a}) / {b})"
+
+    @staticmethod
+    def fmt(ts: str, pattern: str) -> str:
+        return f"strftime('{pattern}', {ts}, 'unixepoch')"
+
+    @staticmethod
+    def month_start(ts: str) -> str:
+        return f"CAST(strftime('%s', {ts}, 'unixepoch', 'start of month') AS INTEGER)"
+
+
+class _DuckDB:
+    @staticmethod
+    def idiv(a: str, b: int) -> str:
+        return f"(({a}) // {b})"
+
+    @staticmethod
+    def fmt(ts: str, pattern: str) -> str:
+        return f"strftime(make_timestamp(CAST({ts} AS BIGINT) * 1000000), '{pattern}')"
+
+    @staticmethod
+    def month_start(ts: str) -> str:
+        return f"CAST(epoch(date_trunc('month', make_timestamp(CAST({ts} AS BIGINT) * 1000000))) AS BIGINT)"
+
+
+_DIALECTS = {"sqlite": _SQLite, "duckdb": _DuckDB}
+_WEEK = 7 * 86400
+# 1970-01-05 was a Monday; weeks start on Monday (as in timeseries.py)
+_WEEK_OFFSET = 4 * 86400
+
+
+def _ceil_seconds(ns: int) -> int:
+    return -(-int(ns) // 10**9)
+
+
+# ---- import ----
+
+def _csv_chunks(source: str):
+    if is_store(source):
+        df = read_store(source)
+        for start in range(0, len(df), IMPORT_CHUNK_ROWS):
+            yield df.iloc[start:start + IMPORT_CHUNK_ROWS]
+        return
+    for chunk in pd.read_csv(source, chunksize=IMPORT_CHUNK_ROWS):
+        chunk["transaction_date"] = pd.to_datetime(chunk["transaction_date"], format=DATE_FORMAT)
+        yield chunk
+
+
+def _sqlite_import(source: str, target: str) -> int:
+    conn = sqlite3.connect(target)
+    # Nothing reads the file until it is renamed into place, so skip the journal
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(SCHEMA)
+    rows = 0
+    insert = f"INSERT INTO transactions VALUES ({', '.join('?' * len(COLUMN_ORDER))})"
+    for chunk in _csv_chunks(source):
+        chunk = chunk[COLUMN_ORDER].assign(
+            transaction_id=chunk["transaction_id"].astype(str),
+            transaction_date=chunk["transaction_date"].to_numpy(dtype="datetime64[s]").astype(np.int64),
+            **{c: chunk[c].astype(str) for c in LABEL_COLUMNS.values()})
+        conn.executemany(insert, chunk.itertuples(index=False, name=None))
+        rows += len(chunk)
+    # Indexes are built once after the load, much faster than maintaining them per insert
+    for name, columns in INDEXES.items():
+        conn.execute(f"CREATE INDEX {name} ON transactions ({columns})")
+    conn.execute("ANALYZE")
+    conn.commit()
+    # Readers only ever open the file read-only, so it keeps the default rollback journal
+    # (WAL would need a writable -shm file next to it)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+    return rows
+
+
+def _duckdb_import(source: str, target: str) -> int:
+    conn = duckdb.connect(target)
+    conn.execute(SCHEMA)
+    if is_store(source):
+        for chunk in _csv_chunks(source):
+            frame = chunk[COLUMN_ORDER].assign(
+                transaction_date=chunk["transaction_date"].to_numpy(dtype="datetime64[s]").astype(np.int64),
+                **{c: chunk[c].astype(str) for c in LABEL_COLUMNS.values()})
+            conn.register("chunk", frame)
+            conn.execute("INSERT INTO transactions SELECT * FROM chunk")
+            conn.unregister("chunk")
+    else:
+        # DuckDB parses the CSV itself, in parallel
+        path = source.replace("'", "''")
+        conn.execute(f"""INSERT INTO transactions
+            SELECT transaction_id, mall_name, branch_name,
+                   CAST(epoch(strptime(transaction_date, '{DATE_FORMAT}')) AS BIGINT),
+                   tax_amount, transaction_amount, transaction_type, transaction_status
+            FROM read_csv('{path}', header = true, types = {{'transaction_date': 'VARCHAR',
+                                                             'transaction_id': 'VARCHAR'}})""")
+    for name, columns in INDEXES.items():
+        conn.execute(f"CREATE INDEX {name} ON transactions ({columns})")
+    rows = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    conn.close()
+    return rows
+
+
+def import_transactions(source: str, target: str) -> int:
+    """Bulk-load a transactions CSV (or store) into a new database file at `target`; returns the row count"""
+    engine = engine_for(target)
+    if engine is None:
+        raise ValueError(f"Use a {', '.join(DUCKDB_SUFFIXES + SQLITE_SUFFIXES)} file name for the database")
+    if engine == "duckdb" and duckdb is None:
+        raise RuntimeError("DuckDB is not installed (pip install duckdb); use a .sqlite file instead")
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    staging = target + ".tmp"
+    for leftover in (staging, staging + "-journal", staging + ".wal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    rows = (_duckdb_import if engine == "duckdb" else _sqlite_import)(source, staging)
+    os.replace(staging, target)
+    return rows
+
+
+# ---- queries ----
+
+class TransactionDB:
+    """Read-only access to a transactions database, safe to share between threads"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.engine = engine_for(path)
+        if self.engine == "duckdb" and duckdb is None:
+            raise RuntimeError(f"{path} is a DuckDB file but duckdb is not installed (pip install duckdb)")
+        self.sql = _DIALECTS[self.engine]
+        self._local = threading.local()
+        self._duckdb = None
+        if self.engine == "duckdb":
+            # Read-only, so several processes can open the same file
+            self._duckdb = duckdb.connect(path, read_only=True,
+                                          config={"threads": DB_THREADS} if DB_THREADS else {})
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.engine == "duckdb":
+                conn = self._duckdb.cursor()
+            else:
+                conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.path))}?mode=ro", uri=True,
+                                       check_same_thread=False)
+                conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql: str, params: Tuple = (), timeout: Optional[float] = None) -> pd.DataFrame:
+        """Run a SELECT; raises TimeoutError if it runs longer than `timeout` seconds"""
+        conn = self._connection()
+        timer = None
+        if timeout is not None:
+            if self.engine == "duckdb":
+                timer = threading.Timer(timeout, conn.interrupt)
+                timer.start()
+            else:
+                deadline = time.perf_counter() + timeout
+                conn.set_progress_handler(lambda: time.perf_counter() > deadline, 10_000)
+        try:
+            cursor = conn.execute(sql, list(params))
+            columns = [d[0] for d in cursor.description]
+            return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+        except Exception as e:
+            if timeout is not None and "interrupt" in str(e).lower():
+                raise TimeoutError(f"query stopped after {timeout:.0f}s")
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            elif timeout is not None:
+                conn.set_progress_handler(None, 0)
+
+    def scalar(self, sql: str, params: Tuple = ()):
+        return self._connection().execute(sql, list(params)).fetchone()[0]
+
+    def row_count(self) -> int:
+        return int(self.scalar("SELECT COUNT(*) FROM transactions"))
+
+    def branch_names(self) -> List[str]:
+        return self.query("SELECT DISTINCT branch_name FROM transactions ORDER BY 1")["branch_name"].tolist()
+
+    def periods(self) -> List[str]:
+        days = self.query(f"SELECT DISTINCT {self.sql.idiv('transaction_date', 86400)} AS day FROM transactions")
+        months = np.unique(days["day"].to_numpy(np.int64).astype("datetime64[D]").astype("datetime64[M]"))
+        return [str(m) for m in months]
+
+    def summary_statistics(self) -> Dict[str, Any]:
+        """rag_pipeline's summary statistics, from one grouped pass over the table"""
+        # Grouped by day number (integer division, much cheaper than formatting dates per row);
+        # the few hundred days are turned into months afterwards
+        day = self.sql.idiv("transaction_date", 86400)
+        groups = self.query(f"""SELECT mall_name, transaction_status, transaction_type, {day} AS day,
+                                       COUNT(*) AS n, SUM(transaction_amount) AS amount
+                                FROM transactions GROUP BY 1, 2, 3, 4""")
+        groups["month"] = pd.to_datetime(groups["day"].astype(np.int64) * 86400, unit="s").dt.month
+
+        def counts(column):
+            totals = groups.groupby(column)["n"].sum()
+            # Most frequent first, as pandas value_counts orders them
+            return {k: int(v) for k, v in sorted(totals.items(), key=lambda kv: (-kv[1], str(kv[0])))}
+
+        months = groups.groupby("month")["n"].sum().sort_index()
+        return {
+            "transactions_by_mall": counts("mall_name"),
+            # Rounded past the cents, so summation order (float noise) does not show
+            "total_amount_by_mall": {k: round(float(v), 6)
+                                     for k, v in groups.groupby("mall_name")["amount"].sum().items()},
+            "transaction_status_distribution": counts("transaction_status"),
+            "transaction_types": counts("transaction_type"),
+            "transactions_by_month": {f"Month {m}": int(n) for m, n in months.items()},
+        }
+
+    def sample(self, conditions: List[Tuple[str, Any]], limit: int = 20, seed: int = 0) -> pd.DataFrame:
+        """
+        Up to `limit` random rows matching every (column, value) condition ("month" matches
+        the month number); the same seed picks the same rows
+        """
+        where, params = [], []
+        for column, value in conditions:
+            if column == "month":
+                where.append(f"CAST({self.sql.fmt('transaction_date', '%m')} AS INTEGER) = ?")
+            else:
+                where.append(f"{column} = ?")
+            params.append(value)
+        # Pick among the matching row ids with a seeded generator, then read only those rows
+        matching = self.query(f"""SELECT rowid AS _row FROM transactions
+                                  {'WHERE ' + ' AND '.join(where) if where else ''}""", tuple(params))["_row"]
+        if matching.empty:
+            return pd.DataFrame(columns=COLUMN_ORDER)
+        picked = np.random.default_rng(seed).choice(matching.to_numpy(), size=min(limit, len(matching)),
+                                                    replace=False)
+        rows = self.query(f"""SELECT rowid AS _row, {', '.join(COLUMN_ORDER)} FROM transactions
+                              WHERE rowid IN ({', '.join('?' * len(picked))})""",
+                          tuple(int(row) for row in picked))
+        rows = rows.sort_values("_row").drop(columns="_row").reset_index(drop=True)
+        rows["transaction_date"] = pd.to_datetime(rows["transaction_date"], unit="s")
+        return rows
+
+    def chunks(self, rows: int = IMPORT_CHUNK_ROWS):
+        """Every transaction, `rows` at a time in storage order, for summaries built in memory (sketches.py)"""
+        last = -1
+        while True:
+            chunk = self.query(f"""SELECT rowid AS _row, {', '.join(COLUMN_ORDER)} FROM transactions
+                                   WHERE rowid > ? ORDER BY rowid LIMIT ?""", (last, rows))
+            if chunk.empty:
+                return
+            last = int(chunk["_row"].iloc[-1])
+            chunk = chunk.drop(columns="_row")
+            chunk["transaction_date"] = pd.to_datetime(chunk["transaction_date"], unit="s")
+            yield chunk
+
+    # -- structured queries (query_engine.py) and series (timeseries.py) --
+
+    def bucket_expr(self, bucket: str) -> str:
+        """Start of each row's time bucket, in epoch seconds"""
+        ts = "transaction_date"
+        if bucket == "month":
+            return self.sql.month_start(ts)
+        if bucket == "week":
+            return f"({self.sql.idiv(f'{ts} - {_WEEK_OFFSET}', _WEEK)} * {_WEEK} + {_WEEK_OFFSET})"
+        seconds = {"minute": 60, "hour": 3600, "day": 86400}[bucket]
+        return f"({self.sql.idiv(ts, seconds)} * {seconds})"
+
+    def field_expr(self, field: str) -> str:
+        if field in LABEL_COLUMNS:
+            return LABEL_COLUMNS[field]
+        if field in VALUE_COLUMNS:
+            return VALUE_COLUMNS[field]
+        if field == "hour":
+            return f"({self.sql.idiv('transaction_date', 3600)} % 24)"
+        if field == "weekday":
+            # 1970-01-01 was a Thursday
+            return f"(({self.sql.idiv('transaction_date', 86400)} + 3) % 7)"
+        return self.sql.fmt("transaction_date", "%Y-%m-%d" if field == "day" else "%Y-%m")
+
+    @staticmethod
+    def _range(start_ns: Optional[int], end_ns: Optional[int]) -> Tuple[List[str], List[Any]]:
+        where, params = [], []
+        if start_ns is not None:
+            where.append("transaction_date >= ?")
+            params.append(_ceil_seconds(start_ns))
+        if end_ns is not None:
+            where.append("transaction_date < ?")
+            params.append(_ceil_seconds(end_ns))
+        return where, params
+
+    def where(self, filters: List[Dict[str, Any]], start_ns: Optional[int], end_ns: Optional[int]):
+        """WHERE clause and parameters for query_engine filters (date filters come as the range)"""
+        where, params = self._range(start_ns, end_ns)
+        for f in filters:
+            if f["field"] == "date":
+                continue
+            expr, op, values = self.field_expr(f["field"]), f["op"], f["values"]
+            if op in ("in", "not_in"):
+                where.append(f"{expr} {'NOT IN' if op == 'not_in' else 'IN'} ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif op == "between":
+                where.append(f"{expr} BETWEEN ? AND ?")
+                params.extend(values)
+            else:
+                where.append(f"{expr} {'<>' if op == '!=' else op} ?")
+                params.append(values[0])
+        return ("WHERE " + " AND ".join(where)) if where else "", params
+
+    def aggregate(self, query: Dict[str, Any], start_ns: Optional[int], end_ns: Optional[int],
+                  timeout: Optional[float] = None) -> pd.DataFrame:
+        """A parsed query_engine query as one GROUP BY; the bucket column is in epoch seconds"""
+        select = []
+        if query["bucket"]:
+            select.append(f"{self.bucket_expr(query['bucket'])} AS bucket")
+        select += [f"{self.field_expr(field)} AS {field}" for field in query["group_by"]]
+        keys = len(select)
+        for fn, field in query["aggregates"]:
+            if fn == "count":
+                select.append("COUNT(*) AS count")
+            elif fn == "sum":
+                select.append(f"COALESCE(SUM({VALUE_COLUMNS[field]}), 0) AS sum_{field}")
+            else:
+                select.append(f"{fn.upper()}({VALUE_COLUMNS[field]}) AS {fn}_{field}")
+        where, params = self.where(query["filters"], start_ns, end_ns)
+        group = f"GROUP BY {', '.join(str(i + 1) for i in range(keys))}" if keys else ""
+        return self.query(f"SELECT {', '.join(select)} FROM transactions {where} {group}", tuple(params), timeout)
+
+    def series(self, bucket: str, group_by: Optional[str], start_ns: Optional[int], end_ns: Optional[int],
+               value: str, filters: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """timeseries.Rollups.query() answered in SQL: columns t (ms), group, count, sum, avg"""
+        where, params = self._range(start_ns, end_ns)
+        for dimension, label in (filters or {}).items():
+            where.append(f"{LABEL_COLUMNS[dimension]} = ?")
+            params.append(label)
+        select = [f"{self.bucket_expr(bucket)} AS t"]
+        if group_by:
+            select.append(f'{LABEL_COLUMNS[group_by]} AS "group"')
+        select += ["COUNT(*) AS count", f"SUM({VALUE_COLUMNS[value]}) AS sum"]
+        keys = "1, 2" if group_by else "1"
+        series = self.query(f"""SELECT {', '.join(select)} FROM transactions
+                                {'WHERE ' + ' AND '.join(where) if where else ''}
+                                GROUP BY {keys} ORDER BY {keys}""", tuple(params))
+        if not group_by:
+            series["group"] = "all"
+        series["avg"] = series["sum"] / series["count"]
+        series["t"] = series["t"].astype(np.int64) * 1000
+        return series[["t", "group", "count", "sum", "avg"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedded SQL storage for the transactions dataset")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Bulk-load a CSV (or store) into a new database file")
+    import_parser.add_argument("source", help="Transactions CSV or store directory")
+    import_parser.add_argument("target", help="Database file: .duckdb for DuckDB, .sqlite for SQLite")
+    args = parser.parse_args()
+
+    started = time.time()
+    rows = import_transactions(args.source, args.target)
+    print(f"Imported {rows:,} rows into {args.target} in {time.time() - started:.1f}s")
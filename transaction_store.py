@@ -0,0 +1,124 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Columnar binary format for the transaction dataset.
+#
+# A store is a directory with one .npy file per column plus meta.json:
+#   transaction_id                     fixed-width bytes
+#   mall_name, branch_name,
+#   transaction_type, transaction_status   int8/int16 category codes (labels in meta.json)
+#   transaction_date                   int64 nanoseconds since the epoch
+#   tax_amount, transaction_amount     float64
+# Loading memory-maps the files, so opening a large store is almost free and
+# the pages are shared between every process that reads it. Only decoded
+# transaction ids are private; read_ids()/decode_ids() avoid even that copy.
+
+FORMAT_VERSION = 1
+
+CATEGORY_COLUMNS = ["mall_name", "branch_name", "transaction_type", "transaction_status"]
+NUMERIC_COLUMNS = ["tax_amount", "transaction_amount"]
+COLUMN_ORDER = ["transaction_id", "mall_name", "branch_name", "transaction_date",
+                "tax_amount", "transaction_amount", "transaction_type", "transaction_status"]
+
+
+def is_store(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "meta.json"))
+
+
+def _codes_dtype(n_categories: int):
+    return np.int8 if n_categories < 127 else np.int16
+
+
+class StoreWriter:
+    """
+    Write a store in chunks without holding the whole dataset in memory.
+
+    The row count and category labels must be known up front; each chunk is a
+    DataFrame in the CSV schema with transaction_date already parsed.
+    """
+
+    def __init__(self, path: str, n_rows: int, categories: Dict[str, List[str]], id_width: int = 18):
+        self.path = path
+        self.n_rows = n_rows
+        self.categories = {name: list(labels) for name, labels in categories.items()}
+        self.offset = 0
+        os.makedirs(path, exist_ok=True)
+
+        def column(name, dtype):
+            return np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+",
+                                             dtype=dtype, shape=(n_rows,))
+
+        self._columns = {"transaction_id": column("transaction_id", f"S{id_width}"),
+                         "transaction_date": column("transaction_date", np.int64)}
+        for name in NUMERIC_COLUMNS:
+            self._columns[name] = column(name, np.float64)
+        for name in CATEGORY_COLUMNS:
+            self._columns[name] = column(name, _codes_dtype(len(self.categories[name])))
+
+    def write(self, chunk: pd.DataFrame):
+        end = self.offset + len(chunk)
+        if end > self.n_rows:
+            raise ValueError(f"Store was sized for {self.n_rows} rows, got at least {end}")
+        rows = slice(self.offset, end)
+        self._columns["transaction_id"][rows] = chunk["transaction_id"].to_numpy(dtype="S")
+        self._columns["transaction_date"][rows] = chunk["transaction_date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        for name in NUMERIC_COLUMNS:
+            self._columns[name][rows] = chunk[name].to_numpy(dtype=np.float64)
+        for name in CATEGORY_COLUMNS:
+            codes = pd.Categorical(chunk[name], categories=self.categories[name]).codes
+            if (codes < 0).any():
+                raise ValueError(f"Unknown {name} value in chunk")
+            self._columns[name][rows] = codes
+        self.offset = end
+
+    def close(self):
+        if self.offset != self.n_rows:
+            raise ValueError(f"Store expected {self.n_rows} rows but {self.offset} were written")
+        for array in self._columns.values():
+            array.flush()
+        meta = {"format_version": FORMAT_VERSION, "rows": self.n_rows, "categories": self.categories}
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+
+def write_store(df: pd.DataFrame, path: str):
+    """Write a whole DataFrame (CSV schema, parsed dates) as a store"""
+    categories = {name: sorted(df[name].astype(str).unique()) for name in CATEGORY_COLUMNS}
+    id_width = max(1, int(df["transaction_id"].astype(str).str.len().max()))
+    writer = StoreWriter(path, len(df), categories, id_width=id_width)
+    writer.write(df)
+    writer.close()
+
+
+def read_store(path: str, mmap: bool = True, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load a store as a DataFrame. Numeric, date and category columns are backed by the mapped files"""
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    mmap_mode = "r" if mmap else None
+    data = {}
+    for name in columns or COLUMN_ORDER:
+        array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        if name in CATEGORY_COLUMNS:
+            data[name] = pd.Categorical.from_codes(array, categories=meta["categories"][name], validate=False)
+        elif name == "transaction_date":
+            data[name] = array.view("datetime64[ns]")
+        elif name == "transaction_id":
+            # Identifiers are only needed for display, decoding them is the one per-process copy
+            data[name] = decode_ids(array)
+        else:
+            data[name] = array
+    return pd.DataFrame(data, copy=False)
+
+
+def read_ids(path: str) -> np.ndarray:
+    """The transaction_id column as memory-mapped fixed-width bytes, without decoding"""
+    return np.load(os.path.join(path, "transaction_id.npy"), mmap_mode="r")
+
+
+def decode_ids(ids: np.ndarray, positions: Optional[np.ndarray] = None) -> np.ndarray:
+    """Decode transaction ids to strings, only at `positions` when given"""
+    return np.char.decode(ids if positions is None else ids[positions], "ascii")
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# How long a processed MessageSid is remembered (Twilio retries within minutes)
+DEFAULT_TTL_SECONDS = int(os.getenv("WEBHOOK_DEDUP_TTL", 3600))
+# Width of each time bucket; whole buckets are dropped once they expire
+DEFAULT_BUCKET_SECONDS = int(os.getenv("WEBHOOK_DEDUP_BUCKET", 300))
+
+
+class MessageDeduplicator:
+    """
+    De-duplicate webhook deliveries keyed on an idempotency key (Twilio's MessageSid).
+
+    Keys live in time buckets so expiry is a cheap drop of the oldest bucket
+    instead of a per-key sweep. A key is either in flight (an asyncio.Future
+    that duplicates await) or completed (the cached reply). Completed replies
+    can optionally be persisted to SQLite so they survive restarts and are
+    shared between worker processes.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+                 db_path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.bucket_seconds = max(1, bucket_seconds)
+        self._buckets: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages ("
+                "message_sid TEXT PRIMARY KEY, reply TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        self.counters = {
+            "received": 0,
+            "processed": 0,
+            "duplicates_in_flight": 0,
+            "duplicates_completed": 0,
+            "failures": 0,
+        }
+
+    # ----- bucket bookkeeping -----
+
+    def _expire(self, now: float):
+        oldest_live = int((now - self.ttl_seconds) // self.bucket_seconds)
+        while self._buckets:
+            bucket_id = next(iter(self._buckets))
+            if bucket_id >= oldest_live:
+                break
+            self._buckets.popitem(last=False)
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        for bucket in reversed(self._buckets.values()):
+            if key in bucket:
+                return bucket[key]
+        return None
+
+    def _store(self, key: str, value: Any, now: float):
+        bucket_id = int(now // self.bucket_seconds)
+        if bucket_id not in self._buckets:
+            self._buckets[bucket_id] = {}
+        self._buckets[bucket_id][key] = value
+
+    def _discard(self, key: str):
+        for bucket in self._buckets.values():
+            bucket.pop(key, None)
+
+    # ----- SQLite backing -----
+
+    def _db_get(self, key: str, now: float) -> Optional[str]:
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT reply FROM processed_messages WHERE message_sid = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _db_put(self, key: str, reply: str, now: float):
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO processed_messages (message_sid, reply, created_at) VALUES (?, ?, ?)",
+                (key, reply, now),
+            )
+            self._db.execute(
+                "DELETE FROM processed_messages WHERE created_at < ?",
+                (now - self.ttl_seconds,),
+            )
+            self._db.commit()
+
+    # ----- public API -----
+
+    async def run(self, key: str, func: Callable[[], Awaitable[str]]) -> Tuple[str, str]:
+        """
+        Run func once per key.
+
+        Returns:
+            (reply, outcome) where outcome is "processed", "in_flight" (attached
+            to a running job) or "completed" (served from the cached reply).
+        """
+        now = time.time()
+        self._expire(now)
+        self.counters["received"] += 1
+
+        entry = self._lookup(key)
+        if isinstance(entry, asyncio.Future):
+            self.counters["duplicates_in_flight"] += 1
+            return await asyncio.shield(entry), "in_flight"
+        if entry is not None:
+            self.counters["duplicates_completed"] += 1
+            return entry, "completed"
+
+        cached = self._db_get(key, now)
+        if cached is not None:
+            self._store(key, cached, now)
+            self.counters["duplicates_completed"] += 1
+            return cached, "completed"
+
+        future = asyncio.get_running_loop().create_future()
+        self._store(key, future, now)
+        try:
+            reply = await func()
+        except BaseException as e:
+            # Let a later retry try again, and fail anyone attached to this attempt
+            self._discard(key)
+            self.counters["failures"] += 1
+            if not future.done():
+                future.set_exception(e)
+                # Mark retrieved so an unattached failure doesn't log a warning
+                future.exception()
+            raise
+
+        future.set_result(reply)
+        self._discard(key)
+        self._store(key, reply, time.time())
+        self._db_put(key, reply, time.time())
+        self.counters["processed"] += 1
+        return reply, "processed"
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the counters plus the current duplicate rate"""
+        received = self.counters["received"]
+        duplicates = self.counters["duplicates_in_flight"] + self.counters["duplicates_completed"]
+        tracked = sum(len(bucket) for bucket in self._buckets.values())
+        return {
+            **self.counters,
+            "duplicates": duplicates,
+            "duplicate_rate": round(duplicates / received, 4) if received else 0.0,
+            "tracked_keys": tracked,
+            "sqlite_backed": self._db is not None,
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import random
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from rate_limit import TokenBucket
+from tracing import span
+
+# Twilio rejects WhatsApp bodies longer than this
+MAX_BODY_LENGTH = 1600
+
+
+class DispatchError(Exception):
+    """Raised when a message part could not be delivered after all retries"""
+
+
+def split_message(message: str, limit: int = MAX_BODY_LENGTH) -> List[str]:
+    """
+    Split a long message into parts of at most `limit` characters.
+
+    Prefers paragraph, then line, then word boundaries so reports stay readable.
+    """
+    message = message.strip()
+    if len(message) <= limit:
+        return [message]
+
+    parts = []
+    remaining = message
+    while len(remaining) > limit:
+        window = remaining[:limit]
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = window.rfind(separator)
+            if cut > limit // 2:
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(remaining[:cut].rstrip())
+        remaining = remaining[cut:].lstrip()
+    if remaining:
+        parts.append(remaining)
+    return parts
+
+
+def _format_whatsapp_number(number: str) -> str:
+    return number if number.startswith("whatsapp:") else f"whatsapp:{number}"
+
+
+class OutboundDispatcher:
+    """
+    Asynchronous outbound WhatsApp sender for the Twilio Messages API.
+
+    All sends share one pooled HTTP client, a token-bucket rate limiter and a
+    concurrency cap. Rate-limited (429), server-side (5xx) and network errors
+    are retried with exponential backoff and jitter. Long messages are split
+    and the parts for one recipient are sent in order. Synchronous callers use
+    send_blocking(), which runs on the dispatcher's own event loop thread and
+    shares the rate limiter with everything else.
+    """
+
+    def __init__(self, account_sid: str, auth_token: Optional[str], from_number: str,
+                 api_base: str = "https://api.twilio.com",
+                 rate_per_second: float = 10.0, burst: Optional[float] = None,
+                 max_concurrency: int = 5, max_retries: int = 4,
+                 base_delay: float = 0.5, max_delay: float = 30.0, timeout: float = 15.0):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = _format_whatsapp_number(from_number)
+        self.api_base = api_base.rstrip("/")
+        self.limiter = TokenBucket(rate_per_second, burst)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        # The HTTP client and concurrency cap are bound to an event loop, so each loop gets its own
+        self._clients: Dict[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Semaphore]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+        self.stats = {"messages": 0, "parts_sent": 0, "parts_failed": 0, "retries": 0, "in_flight": 0}
+
+    @classmethod
+    def from_env(cls, account_sid: str, auth_token: Optional[str], from_number: str) -> "OutboundDispatcher":
+        """Build a dispatcher using the WHATSAPP_* / TWILIO_API_BASE environment settings"""
+        return cls(
+            account_sid,
+            auth_token,
+            from_number,
+            api_base=os.getenv("TWILIO_API_BASE", "https://api.twilio.com"),
+            rate_per_second=float(os.getenv("WHATSAPP_RATE_PER_SEC", 10)),
+            burst=float(os.getenv("WHATSAPP_RATE_BURST", 10)),
+            max_concurrency=int(os.getenv("WHATSAPP_MAX_CONCURRENCY", 5)),
+            max_retries=int(os.getenv("WHATSAPP_MAX_RETRIES", 4)),
+        )
+
+    @property
+    def messages_url(self) -> str:
+        return f"{self.api_base}/2010-04-01/Accounts/{self.account_sid}/Messages.json"
+
+    def _get_client(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            client = httpx.AsyncClient(
+                auth=(self.account_sid, self.auth_token or ""),
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+            self._clients[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return self._clients[loop]
+
+    async def close(self):
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="whatsapp-dispatcher", daemon=True).start()
+            return self._loop
+
+    def send_blocking(self, to_number: str, message: str) -> Dict[str, Any]:
+        """send() for synchronous code; must not be called from a running event loop"""
+        return asyncio.run_coroutine_threadsafe(self.send(to_number, message), self._background_loop()).result()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(self.max_delay, float(retry_after))
+            except ValueError:
+                pass
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _send_part(self, to_number: str, body: str) -> Dict[str, Any]:
+        client, semaphore = self._get_client()
+        data = {"To": to_number, "From": self.from_number, "Body": body}
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            async with semaphore:
+                self.stats["in_flight"] += 1
+                try:
+                    response = await client.post(self.messages_url, data=data)
+                except httpx.HTTPError as e:
+                    response = None
+                    last_error = f"{type(e).__name__}: {e}"
+                finally:
+                    self.stats["in_flight"] -= 1
+
+            if response is not None:
+                if 200 <= response.status_code < 300:
+                    self.stats["parts_sent"] += 1
+                    return response.json()
+                last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+                # Client errors other than rate limiting will not succeed on retry
+                if response.status_code != 429 and response.status_code < 500:
+                    break
+
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                retry_after = response.headers.get("Retry-After") if response is not None else None
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        self.stats["parts_failed"] += 1
+        raise DispatchError(f"Failed to send WhatsApp message to {to_number}: {last_error}")
+
+    async def send(self, to_number: str, message: str) -> Dict[str, Any]:
+        """Send one message (split into parts if needed) to a single recipient"""
+        to_number = _format_whatsapp_number(to_number)
+        parts = split_message(message)
+        self.stats["messages"] += 1
+        print(f"Dispatching WhatsApp message to {to_number} ({len(parts)} part(s))")
+
+        sids = []
+        with span("whatsapp.dispatch", {"parts": len(parts), "chars": len(message)}):
+            for part in parts:
+                result = await self._send_part(to_number, part)
+                sids.append(result.get("sid", "unknown"))
+        return {"to": to_number, "status": "success", "message_sids": sids, "parts": len(parts)}
+
+    async def broadcast(self, recipients: List[str], message: str) -> List[Dict[str, Any]]:
+        """Send the same message to many recipients concurrently, within the rate limit"""
+
+        async def send_one(recipient: str) -> Dict[str, Any]:
+            try:
+                return await self.send(recipient, message)
+            except DispatchError as e:
+                return {"to": _format_whatsapp_number(recipient), "status": "error", "error": str(e)}
+
+        # De-duplicate recipients while keeping their order
+        unique_recipients = list(dict.fromkeys(recipients))
+        return await asyncio.gather(*(send_one(r) for r in unique_recipients))
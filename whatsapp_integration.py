@@ -1,12 +1,18 @@
 import os
 import json
+import asyncio
 import requests
 from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
 from dotenv import load_dotenv
 import uvicorn
+from webhook_dedup import MessageDeduplicator
+from whatsapp_dispatcher import OutboundDispatcher
+import metrics
+import response_codecs
+from startup import Warmup
+from tracing import inject_headers, instrument_app, traced
 
 # Load environment variables
 load_dotenv()
@@ -16,9 +22,33 @@ TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "AC83bfaabb0e1c64a791e963b2
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 # Must use the Twilio WhatsApp sandbox number for testing
 TWILIO_PHONE_NUMBER = "+14155238886"  # WhatsApp sandbox number
+# Twilio REST API base URL (point at stubs/fake_twilio.py for local testing)
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
 
 # MCP Next.js API server URL
 MCP_API_URL = os.getenv("MCP_API_URL", "http://localhost:8001")
+# Authenticates WhatsApp to the bridge's admission control (ADMISSION_TRUSTED_CLIENTS there), so
+# each sender, named in X-Client-Id, gets a rate limit of their own; without it the bridge limits
+# this service as a whole by its address
+BRIDGE_HEADERS = {"Accept": response_codecs.accept_header()}
+if os.getenv("WHATSAPP_BRIDGE_TOKEN"):
+    BRIDGE_HEADERS["X-Client-Token"] = os.getenv("WHATSAPP_BRIDGE_TOKEN")
+# Optional JSON file mapping sender numbers to tenant datasets (see dataset_registry.py),
+# e.g. {"+962790000000": "jordan", "*": "default"}; "*" applies to everyone else
+WHATSAPP_DATASETS_FILE = os.getenv("WHATSAPP_DATASETS_FILE")
+
+def load_sender_datasets(path=WHATSAPP_DATASETS_FILE) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {number.replace("whatsapp:", "").strip(): dataset for number, dataset in json.load(f).items()}
+
+sender_datasets = load_sender_datasets()
+
+def dataset_for_sender(sender: str):
+    """The tenant dataset a WhatsApp sender ("whatsapp:+962...") is mapped to, if any"""
+    number = sender.replace("whatsapp:", "").strip()
+    return sender_datasets.get(number) or sender_datasets.get("*")
 
 app = FastAPI(title="WhatsApp Integration for MCP")
 
@@ -30,51 +60,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Twilio client
-twilio_client = None
-if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-else:
+# Server span per request, continuing the caller's trace
+instrument_app(app, "whatsapp_integration")
+# Request metrics, served from /metrics
+metrics.instrument_app(app)
+
+# De-duplicate Twilio webhook retries by MessageSid (optionally persisted to SQLite)
+webhook_dedup = MessageDeduplicator(db_path=os.getenv("WEBHOOK_DEDUP_DB"))
+
+# Outbound sends go through one rate-limited, retrying dispatcher
+dispatcher = OutboundDispatcher.from_env(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER)
+if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN):
     print("Warning: Twilio credentials not set. WhatsApp messaging will not work.")
 
+# Dispatcher and dedup counters, served with the request metrics from /metrics
+metrics.register_stats("whatsapp_dispatcher", dispatcher.stats, gauges=["in_flight"])
+metrics.register_stats("webhook_dedup", webhook_dedup.stats,
+                       gauges=["duplicate_rate", "tracked_keys", "sqlite_backed"])
+
+def bridge_ready() -> bool:
+    # Messages can only be answered once the bridge (and its MCP sessions) is ready
+    return requests.get(f"{MCP_API_URL}/readyz", timeout=1).status_code == 200
+
+# /livez and /readyz; there is nothing to warm here, readiness is the bridge's.
+# The bridge's answer is reused for BRIDGE_READY_TTL seconds across probes
+warmup = Warmup("whatsapp_integration").check("mcp_bridge", bridge_ready,
+                                              ttl=float(os.getenv("BRIDGE_READY_TTL", 2)))
+warmup.add_routes(app)
+
 def send_direct_whatsapp_message(to_number: str, message: str):
     """
-    Send WhatsApp message using direct Twilio API call 
-    (similar to the curl command)
+    Send a WhatsApp message from synchronous code (alert sinks, the startup test
+    message). Goes through the dispatcher, so it shares its rate limit and retries
     """
-    # Format number for WhatsApp if not already formatted
-    if not to_number.startswith("whatsapp:"):
-        to_number = f"whatsapp:{to_number}"
-    
-    # Always use the WhatsApp sandbox number
-    from_number = f"whatsapp:{TWILIO_PHONE_NUMBER}"
-    
-    print(f"Sending WhatsApp message from {from_number} to {to_number}")
-    
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
-    
-    data = {
-        'To': to_number,
-        'From': from_number,
-        'Body': message
-    }
-    
-    response = requests.post(
-        url,
-        data=data,
-        auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    )
-    
-    if response.status_code >= 200 and response.status_code < 300:
-        return response.json()
-    else:
-        print(f"Error sending WhatsApp message: {response.text}")
-        raise Exception(f"Failed to send WhatsApp message: {response.text}")
+    return dispatcher.send_blocking(to_number, message)
 
-def process_user_message(message_body: str):
+@traced("whatsapp.process_user_message")
+def process_user_message(message_body: str, dataset: str = None, sender: str = None):
     """
-    Process user message and intelligently route to appropriate AI tools
+    Process user message and intelligently route to appropriate AI tools,
+    against the sender's tenant dataset when one is given
     """
+    headers = dict(BRIDGE_HEADERS)
+    if dataset:
+        headers["X-Dataset"] = dataset
+    if sender:
+        headers["X-Client-Id"] = sender.replace("whatsapp:", "").strip()
     # HARDCODED TEST RESPONSES - Based on actual Jordan transaction data
     hardcoded_responses = {
         "best performing mall": "Based on the transaction data, C Mall (particularly C Mall Amman) has the highest transaction volume with an average transaction amount of 8.75 JOD. Z Mall Gardens follows closely with strong customer traffic.",
@@ -172,6 +203,7 @@ Try asking me about:
                     "tool_name": "generate_monthly_report",
                     "arguments": {"month": found_month}
                 },
+                headers=inject_headers(headers),
                 timeout=timeout_seconds
             )
             
@@ -182,6 +214,7 @@ Try asking me about:
             response = requests.post(
                 f"{MCP_API_URL}/call_tool",
                 json={"tool_name": "get_transaction_anomalies"},
+                headers=inject_headers(headers),
                 timeout=timeout_seconds
             )
             
@@ -192,6 +225,7 @@ Try asking me about:
             response = requests.post(
                 f"{MCP_API_URL}/call_tool",
                 json={"tool_name": "get_mall_summary"},
+                headers=inject_headers(headers),
                 timeout=timeout_seconds
             )
             
@@ -206,6 +240,7 @@ Try asking me about:
                     "tool_name": "get_financial_analysis",
                     "arguments": {"question": message_body}
                 },
+                headers=inject_headers(headers),
                 timeout=timeout_seconds
             )
         
@@ -213,7 +248,8 @@ Try asking me about:
         
         if response.status_code == 200:
             try:
-                response_json = response.json()
+                # MessagePack or JSON, whichever the bridge answered with
+                response_json = response_codecs.decode(response.content, response.headers.get("Content-Type", ""))
                 print(f"Response JSON: {str(response_json)[:200]}...")
                 
                 if "result" in response_json:
@@ -233,6 +269,11 @@ Try asking me about:
                 print(f"Error parsing JSON response: {str(e)}")
                 print(f"Raw response: {response.text[:500]}...")
                 return "I had trouble understanding the response from our AI system. Please try again."
+        elif response.status_code in (429, 503):
+            # Turned away by the bridge's admission control; tell the user when to come back
+            retry_after = response.headers.get("Retry-After", "a few")
+            print(f"MCP API busy ({response.status_code}), retry after {retry_after}s")
+            return f"We're handling a lot of requests right now. Please try again in {retry_after} seconds."
         else:
             print(f"Error from MCP API: {response.status_code} - {response.text}")
             return f"I'm having trouble processing your request right now. Please try again in a moment. (Error: {response.status_code})"
@@ -259,14 +300,24 @@ async def whatsapp_webhook(request: Request):
     # Get message details from the Twilio webhook
     message_body = form_data.get("Body", "")
     sender = form_data.get("From", "")
+    message_sid = form_data.get("MessageSid", "")
     
     print(f"\n=== INCOMING WHATSAPP MESSAGE ===")
     print(f"From: {sender}")
+    print(f"MessageSid: {message_sid or 'n/a'}")
     print(f"Message: {message_body}")
     
-    # Process the message
-    print(f"Processing message...")
-    response_text = process_user_message(message_body)
+    # Process the message off the event loop so Twilio retries can be handled meanwhile
+    async def process():
+        print(f"Processing message...")
+        return await asyncio.to_thread(process_user_message, message_body, dataset_for_sender(sender), sender)
+    
+    if message_sid:
+        response_text, outcome = await webhook_dedup.run(message_sid, process)
+        if outcome != "processed":
+            print(f"Duplicate delivery of {message_sid} ({outcome}), reusing reply")
+    else:
+        response_text = await process()
     print(f"Response: {response_text[:100]}..." if len(response_text) > 100 else f"Response: {response_text}")
     
     # Create TwiML response
@@ -281,35 +332,54 @@ async def send_whatsapp_message(request: Request):
     """
     Endpoint to send WhatsApp messages from the Next.js dashboard
     """
+    data = await request.json()
+    to_number = data.get("to")
+    message = data.get("message")
+    
+    if not to_number or not message or not isinstance(to_number, str) or not isinstance(message, str):
+        raise HTTPException(status_code=400, detail="Both 'to' and 'message' are required, as strings")
+    
     try:
-        data = await request.json()
-        to_number = data.get("to")
-        message = data.get("message")
-        
-        if not to_number or not message:
-            raise HTTPException(status_code=400, detail="Both 'to' and 'message' are required")
-        
-        # Try to send using direct API call first
-        try:
-            result = send_direct_whatsapp_message(to_number, message)
-            return {"status": "success", "message_sid": result.get("sid", "unknown")}
-        except Exception as e:
-            # Fall back to Twilio client if available
-            if twilio_client:
-                # Format number for WhatsApp (if not already formatted)
-                if not to_number.startswith("whatsapp:"):
-                    to_number = f"whatsapp:{to_number}"
-                
-                twilio_message = twilio_client.messages.create(
-                    body=message,
-                    from_=f"whatsapp:{TWILIO_PHONE_NUMBER}",
-                    to=to_number
-                )
-                return {"status": "success", "message_sid": twilio_message.sid}
-            else:
-                raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
+        result = await dispatcher.send(to_number, message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
+    return {
+        "status": "success",
+        "message_sid": result["message_sids"][0],
+        "message_sids": result["message_sids"],
+        "parts": result["parts"]
+    }
+
+@app.post("/broadcast")
+async def broadcast_whatsapp_message(request: Request):
+    """
+    Send the same message (e.g. the monthly report) to a list of recipients
+    """
+    data = await request.json()
+    recipients = data.get("recipients") or []
+    message = data.get("message")
+    
+    if not isinstance(recipients, list) or not recipients or not message:
+        raise HTTPException(status_code=400, detail="A non-empty 'recipients' list and 'message' are required")
+    if not isinstance(message, str) or not all(isinstance(r, str) and r.strip() for r in recipients):
+        raise HTTPException(status_code=400, detail="'message' and every recipient must be non-empty strings")
+    
+    results = await dispatcher.broadcast(recipients, message)
+    sent = sum(1 for r in results if r["status"] == "success")
+    return {
+        "status": "success" if sent == len(results) else ("partial" if sent else "error"),
+        "sent": sent,
+        "failed": len(results) - sent,
+        "results": results
+    }
+
+@app.on_event("startup")
+async def startup_event():
+    warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await dispatcher.close()
 
 @app.get("/status")
 async def get_status():
@@ -320,7 +390,9 @@ async def get_status():
         "twilio_configured": bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN),
         "twilio_account_sid": TWILIO_ACCOUNT_SID,
         "twilio_phone_number": TWILIO_PHONE_NUMBER,
-        "mcp_api_url": MCP_API_URL
+        "mcp_api_url": MCP_API_URL,
+        "dispatcher": dispatcher.stats,
+        "webhook_dedup": webhook_dedup.stats()
     }
     
     # Test connection to MCP API
@@ -336,13 +408,20 @@ async def get_status():
     
     return status
 
+@app.get("/webhook_stats")
+async def get_webhook_stats():
+    """
+    Report webhook de-duplication counters and the duplicate rate
+    """
+    return webhook_dedup.stats()
+
 @app.get("/send_test_message/{phone_number}")
 async def send_test_message(phone_number: str):
     """
     Endpoint to send a test message to WhatsApp
     """
     try:
-        result = send_direct_whatsapp_message(
+        result = await dispatcher.send(
             phone_number, 
             "Hello! I'm your RightNow Financial Advisor. You can chat with me naturally about financial analysis, mall summaries, transaction anomalies, or monthly reports. Just ask me anything in natural language!"
         )